@@ -60,13 +60,48 @@ class Application(object):
         return path
 
     def init_syntax_definitions(self):
-        from editxt.syntax import SyntaxFactory
-        self.syntax_factory = sf = SyntaxFactory()
-        paths = [NSBundle.mainBundle().resourcePath(), self.app_support_path()]
+        from editxt.syntax import SyntaxFactory, DefinitionCache, \
+            HighlightCache, SyntaxDefinitionWatcher
+        bundle = NSBundle.mainBundle()
+        cache = DefinitionCache(
+            os.path.join(self.app_support_path(), const.SYNTAX_CACHE_FILE),
+            bundle.objectForInfoDictionaryKey_(u"CFBundleVersion"))
+        self.syntax_factory = sf = SyntaxFactory(cache)
+        self.highlight_cache = HighlightCache(
+            os.path.join(self.app_support_path(), const.HIGHLIGHT_CACHE_DIR))
+        paths = [bundle.resourcePath(), self.app_support_path()]
         for path in paths:
             path = os.path.join(path, const.SYNTAX_DEFS_DIR)
             sf.load_definitions(path)
         sf.index_definitions()
+        self.syntax_watcher = SyntaxDefinitionWatcher.alloc().init(
+            sf, self.syntax_definitions_reloaded)
+
+    def syntax_definitions_reloaded(self, replaced):
+        """Color open documents whose syntax definitions were reloaded
+
+        :param replaced: A dict mapping replaced definitions to their
+        replacements (see SyntaxFactory.reload_definitions).
+        """
+        seen = set()
+        for editor in self.iter_editors():
+            for proj in editor.projects:
+                for view in proj.documents():
+                    doc = view.document
+                    if doc.id in seen or doc.syntaxdef not in replaced:
+                        continue
+                    seen.add(doc.id)
+                    new = replaced[doc.syntaxdef]
+                    if new is None:
+                        # look up the definition by filename again
+                        doc.syntaxer.filename = None
+                        doc.update_syntaxer()
+                    elif new is doc.syntaxdef:
+                        # nested definitions were replaced
+                        doc.syntaxer.reset()
+                        doc.color_text()
+                    else:
+                        doc.props.syntaxdef = new
 
     @property
     def syntaxdefs(self):
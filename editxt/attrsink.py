@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2012 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+"""Batched application of text color attributes"""
+import logging
+
+from editxt.spans import SpanStore
+
+log = logging.getLogger(__name__)
+
+UNKNOWN = object() # color of edited text (not applied by a sink)
+
+
+class AttributeSink(object):
+    """Destination for color changes
+
+    Subclasses implement set_color. begin and end bracket a batch of
+    changes.
+    """
+
+    def begin(self):
+        pass
+
+    def set_color(self, start, length, color):
+        """Set (or remove if color is None) the color of the given range"""
+        raise NotImplementedError("abstract method")
+
+    def end(self):
+        pass
+
+
+class RecordingSink(AttributeSink):
+    """Sink that records calls and keeps a color for each character"""
+
+    def __init__(self, length=0):
+        self.calls = []
+        self.colors = [None] * length
+
+    def begin(self):
+        self.calls.append("begin")
+
+    def set_color(self, start, length, color):
+        self.calls.append((start, length, color))
+        if start + length > len(self.colors):
+            self.colors.extend([None] * (start + length - len(self.colors)))
+        self.colors[start:start + length] = [color] * length
+
+    def end(self):
+        self.calls.append("end")
+
+
+class ColorRuns(object):
+    """Collect color runs and apply the runs that changed
+
+    Runs are added in increasing order of start index (the order in which a
+    scan produces them) with color() and clear(). Adjacent runs with the
+    same color are merged. flush() compares the runs with the colors that
+    were previously applied to the text and sends only the changed ranges
+    to a sink in one begin/end bracket.
+    """
+
+    def __init__(self):
+        self.applied = SpanStore()
+        self.pending = []
+
+    def color(self, start, length, color):
+        """Color the given range (remove color if color is None)"""
+        if length <= 0:
+            return
+        pending = self.pending
+        if pending:
+            last = pending[-1]
+            if last[1] == start and last[2] == color:
+                last[1] = start + length
+                return
+        pending.append([start, start + length, color])
+
+    def clear(self, start, length):
+        """Remove color from the given range"""
+        self.color(start, length, None)
+
+    def text_edited(self, start, length, changelen):
+        """Adjust applied colors after an edit
+
+        :param start: The start of the edited range.
+        :param length: The length of the edited range (the new text).
+        :param changelen: The change in length of the text.
+
+        The color of new text is unknown until it is colored again.
+        """
+        applied = self.applied
+        applied.clear(start, length - changelen)
+        applied.adjust(start, changelen)
+        applied.set(start, length, UNKNOWN)
+
+    def reset(self):
+        self.applied.reset()
+        del self.pending[:]
+
+    def changes(self):
+        """Get a list of ranges whose color differs from the applied color
+
+        :returns: A list of (start, length, color) tuples. Pending runs are
+        removed.
+        """
+        applied = self.applied
+        changes = []
+        def change(start, end, color):
+            if start >= end:
+                return
+            if changes:
+                last = changes[-1]
+                if last[1] == start and last[2] == color:
+                    last[1] = end
+                    return
+            changes.append([start, end, color])
+        for start, end, color in self.pending:
+            index = start
+            for istart, ilength, icolor in applied.overlapping(start, end - start):
+                if index < istart and color is not None:
+                    change(index, istart, color)
+                index = max(index, istart)
+                iend = min(istart + ilength, end)
+                if icolor != color:
+                    change(index, iend, color)
+                index = iend
+            if index < end and color is not None:
+                change(index, end, color)
+        del self.pending[:]
+        return [(start, end - start, color) for start, end, color in changes]
+
+    def flush(self, sink):
+        """Apply changed runs to sink
+
+        :returns: The number of ranges that were changed.
+        """
+        changes = self.changes()
+        if changes:
+            applied = self.applied
+            sink.begin()
+            try:
+                for start, length, color in changes:
+                    sink.set_color(start, length, color)
+                    if color is None:
+                        applied.clear(start, length)
+                    else:
+                        applied.set(start, length, color)
+            finally:
+                sink.end()
+        return len(changes)
@@ -0,0 +1,725 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2012 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+"""Syntax highlighting benchmarks
+
+Usage: python -m editxt.benchmark [options]
+
+Generated Python, JavaScript, Mako and EditXT log documents are colored
+with the syntax definitions in resources/syntaxdefs. The following are
+measured for each language and document size:
+
+- scan: time to scan the entire document with SyntaxDefinition.scan
+- parallel_scan: time to scan the document in chunks with a pool of
+  processes (see scan_parallel)
+- color: time to color the entire document with SyntaxCache.color_text
+- edits: time to recolor after an edit (insert a quote, delete a line,
+  paste a block) in the middle of the document
+- memory: size of the span cache and the applied color runs
+
+Results are written as JSON. When a baseline (the JSON output of a
+previous run) is given, each timing is compared with the baseline and the
+program exits with a non-zero status if any of them is slower than the
+baseline by more than the tolerance.
+
+This module runs without AppKit. Minimal stand-ins for the few AppKit and
+Foundation names used by the syntax engine are installed if PyObjC is not
+available, and colors are applied to a sink that only counts them.
+"""
+from __future__ import with_statement
+
+import gc
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import time
+import types
+from array import array
+from optparse import OptionParser
+
+log = logging.getLogger(__name__)
+
+LANGUAGES = ["python", "javascript", "mako", "editxtlog"]
+SIZES = ["10K", "100K", "1M", "10M", "50M"]
+EDITS = ["insert_quote", "delete_line", "paste_block"]
+REPEAT = 5
+TOLERANCE = 0.2
+CHUNK_SIZE = 1024 * 1024 # characters scanned by one process (parallel scan)
+
+
+def install_headless_modules():
+    """Install stand-ins for objc, AppKit and Foundation if necessary
+
+    :returns: True if the stand-ins were installed.
+    """
+    try:
+        import AppKit
+        return False
+    except ImportError:
+        pass
+
+    class NSRange(object):
+        __slots__ = ["location", "length"]
+        def __init__(self, location=0, length=0):
+            self.location = location
+            self.length = length
+        def __iter__(self):
+            yield self.location
+            yield self.length
+        def __getitem__(self, index):
+            return (self.location, self.length)[index]
+        def __len__(self):
+            return 2
+        def __eq__(self, other):
+            return tuple(self) == tuple(other)
+        def __ne__(self, other):
+            return not self == other
+        def __repr__(self):
+            return "NSRange(%r, %r)" % (self.location, self.length)
+
+    def NSUnionRange(a, b):
+        start = min(a[0], b[0])
+        return NSRange(start, max(a[0] + a[1], b[0] + b[1]) - start)
+
+    class NSObject(object):
+        @classmethod
+        def alloc(cls):
+            return cls.__new__(cls)
+        def init(self):
+            return self
+
+    class NSColor(NSObject):
+        def __init__(self, *rgba):
+            self.rgba = rgba
+        @classmethod
+        def colorWithCalibratedRed_green_blue_alpha_(cls, *rgba):
+            return cls(*rgba)
+
+    class StandIn(types.ModuleType):
+        def __getattr__(self, name):
+            # constants such as string encodings
+            if name.startswith("NS"):
+                value = hash(name) & 0xffff
+                setattr(self, name, value)
+                return value
+            raise AttributeError(name)
+
+    names = dict(
+        NSRange=NSRange,
+        NSMakeRange=NSRange,
+        NSUnionRange=NSUnionRange,
+        NSObject=NSObject,
+        NSColor=NSColor,
+        NSForegroundColorAttributeName=u"NSColor",
+        NSTextStorageEditedAttributes=1,
+        NSTextStorageEditedCharacters=2,
+    )
+    for name in ["NSAutoreleasePool", "NSTextStorage", "NSThread",
+                 "NSValueTransformer"]:
+        names[name] = type(name, (NSObject,), {})
+    objc = StandIn("objc")
+    objc.namedSelector = lambda name: (lambda func: func)
+    sys.modules["objc"] = objc
+    for modname in ["AppKit", "Foundation"]:
+        module = StandIn(modname)
+        module.__dict__.update(names)
+        module.__all__ = list(names)
+        sys.modules[modname] = module
+    return True
+
+
+# -- corpus generation --------------------------------------------------------
+
+WORDS = ("alpha beta gamma delta value index count item items result data "
+    "node parent child name path text line start end offset length size "
+    "cache state token color range spans runs editor document window view "
+    "project session config option handler event buffer stream").split()
+
+def _python_chunk(rnd):
+    w = lambda: rnd.choice(WORDS)
+    name = "%s_%s" % (w(), w())
+    return (
+        "class %(C)s(object):\n"
+        '    """%(a)s %(b)s %(c)s\n'
+        "\n"
+        "    %(d)s %(e)s\n"
+        '    """\n'
+        "\n"
+        "    def %(n)s(self, %(a)s, %(b)s=None):\n"
+        "        # %(c)s the %(d)s\n"
+        "        if %(a)s is None or not %(b)s:\n"
+        "            return %(i)d\n"
+        "        for %(e)s in self.%(c)s:\n"
+        "            %(a)s += len('%(d)s') * %(i)d\n"
+        '            print "%(b)s: %%s" %% (%(e)s,)\n'
+        "        try:\n"
+        "            self.%(d)s = [%(a)s, u'%(e)s\\'s', r\"\\d+\"]\n"
+        "        except Exception, err:\n"
+        "            raise ValueError('''%(c)s %(a)s''')\n"
+        "        return lambda x: x and True or False\n"
+        "\n"
+    ) % dict(C=w().title() + w().title(), n=name, a=w(), b=w(), c=w(),
+             d=w(), e=w(), i=rnd.randint(0, 1000))
+
+def _javascript_chunk(rnd):
+    w = lambda: rnd.choice(WORDS)
+    return (
+        "/* %(a)s %(b)s\n"
+        " * %(c)s %(d)s\n"
+        " */\n"
+        "function %(a)s%(C)s(%(b)s, %(c)s) {\n"
+        "    // %(d)s the %(e)s\n"
+        "    var %(e)s = new Array(%(i)d);\n"
+        "    if (%(b)s == null || typeof %(c)s === \"undefined\") {\n"
+        "        return false;\n"
+        "    }\n"
+        "    for (var i = 0; i < %(b)s.length; i++) {\n"
+        "        %(e)s[i] = '%(d)s' + %(b)s[i].replace(/\\s+/g, \"-\");\n"
+        "    }\n"
+        "    try {\n"
+        "        this.%(d)s = { %(a)s: %(i)d, \"%(c)s\": null };\n"
+        "    } catch (err) {\n"
+        "        throw new Error(\"%(a)s \\\"%(b)s\\\"\");\n"
+        "    }\n"
+        "    return %(e)s;\n"
+        "}\n"
+        "\n"
+    ) % dict(C=w().title(), a=w(), b=w(), c=w(), d=w(), e=w(),
+             i=rnd.randint(0, 1000))
+
+def _mako_chunk(rnd):
+    w = lambda: rnd.choice(WORDS)
+    return (
+        "<%%def name=\"%(a)s_%(b)s(%(c)s)\">\n"
+        "<!-- %(d)s %(e)s -->\n"
+        "<div class=\"%(a)s\" id=\"%(b)s-%(i)d\">\n"
+        "  ## %(c)s %(d)s\n"
+        "  %% for %(e)s in %(c)s.%(d)s:\n"
+        "    <span class=\"%(e)s\">${%(e)s.%(a)s | h}</span>\n"
+        "  %% endfor\n"
+        "  <%% %(b)s = %(c)s.get('%(d)s', %(i)d) %%>\n"
+        "  <p>%(a)s ${%(b)s} %(c)s</p>\n"
+        "</div>\n"
+        "</%%def>\n"
+        "<%%doc>\n"
+        "  %(d)s %(e)s %(a)s\n"
+        "</%%doc>\n"
+        "\n"
+    ) % dict(a=w(), b=w(), c=w(), d=w(), e=w(), i=rnd.randint(0, 1000))
+
+def _editxtlog_chunk(rnd):
+    w = lambda: rnd.choice(WORDS)
+    levels = ["DEBUG", "INFO", "INFO", "INFO", "WARNING", "ERROR", "CRITICAL"]
+    lines = []
+    for i in xrange(10):
+        lines.append("editxt.%s %s - %s %s %s %d\n" % (
+            w(), rnd.choice(levels), w(), w(), w(), rnd.randint(0, 100000)))
+    lines.append("Traceback (most recent call last):\n"
+        '  File "editxt/%s.py", line %d, in %s\n'
+        "    %s.%s()\n"
+        "AttributeError: %s\n" % (w(), rnd.randint(1, 2000), w(), w(), w(), w()))
+    return "".join(lines)
+
+CHUNKS = {
+    "python": _python_chunk,
+    "javascript": _javascript_chunk,
+    "mako": _mako_chunk,
+    "editxtlog": _editxtlog_chunk,
+}
+
+SYNTAX_FILES = {
+    "python": "python.syntax.py",
+    "javascript": "javascript.syntax.py",
+    "mako": "mako.syntax.py",
+    "editxtlog": "editxtlog.syntax.py",
+}
+
+def parse_size(value):
+    """Parse a size such as 10K or 1M (in characters)"""
+    units = {"K": 1024, "M": 1024 * 1024}
+    value = value.strip().upper()
+    if value[-1:] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+def generate_text(language, size, seed=0):
+    """Generate a document of (approximately) the given size
+
+    The text is deterministic for a given language, size and seed. It ends
+    at a chunk boundary, so it may be slightly longer than size.
+    """
+    rnd = random.Random("%s-%s" % (language, seed))
+    chunk = CHUNKS[language]
+    # generating every chunk is slow for large documents; repeat a pool
+    pool = [chunk(rnd) for i in xrange(200)]
+    parts = []
+    total = 0
+    while total < size:
+        part = rnd.choice(pool)
+        parts.append(part)
+        total += len(part)
+    return u"".join(parts)
+
+
+# -- parallel scanning --------------------------------------------------------
+#
+# Scanning chunks of a document in a pool of (forked) processes is measured
+# here, in a command line process. It is not done by the application: a
+# process forked from the application would inherit Objective-C runtime
+# state and locks held by its other threads.
+
+def split_chunks(text, offset=0, size=CHUNK_SIZE):
+    """Split text into chunks of approximately the given size
+
+    Each chunk begins at a line start, preferably the start of an empty
+    line (which is less likely to be inside a delimited range).
+
+    :returns: A list of (start, end) tuples. The end of the last chunk is
+    one past the end of the text (a token may begin at the end of the text).
+    """
+    textlen = len(text)
+    window = max(size // 16, 1)
+    chunks = []
+    start = offset
+    while True:
+        target = start + size
+        if target >= textlen:
+            break
+        index = text.find(u"\n\n", target, target + window)
+        if index < 0:
+            index = text.find(u"\n", target)
+            if index < 0:
+                break
+        chunks.append((start, index + 1))
+        start = index + 1
+    chunks.append((start, textlen + 1))
+    return chunks
+
+_scan_source = None # (syntaxdef, text) of a scan process (see scan_parallel)
+
+def _init_scan_process(syntaxdef, text):
+    global _scan_source
+    _scan_source = (syntaxdef, text)
+
+def scan_chunk(chunk, source=None):
+    """Find tokens that begin in the given chunk
+
+    The chunk is scanned from its start in the default lexer state; the
+    last token may extend beyond the end of the chunk.
+
+    :param chunk: A tuple (start, end).
+    :param source: A tuple (syntaxdef, text). Defaults to the source
+    given to this scan process when it was started.
+    :returns: A tuple (start, end, names, ids, bounds) where names is a
+    list of group names, ids is an array of indexes into names and bounds
+    is an array of start and end indexes (two for each token).
+    """
+    syntaxdef, text = source or _scan_source
+    start, end = chunk
+    names = []
+    name_ids = {}
+    ids = array("i")
+    bounds = array("i")
+    for name, tstart, tend in syntaxdef.matches(text, start):
+        if tstart >= end:
+            break
+        if name not in name_ids:
+            name_ids[name] = len(names)
+            names.append(name)
+        ids.append(name_ids[name])
+        bounds.append(tstart)
+        bounds.append(tend)
+    return start, end, names, ids, bounds
+
+def stitch_tokens(syntaxdef, text, results):
+    """Generate the tokens of a text from the tokens of its chunks
+
+    Tokens are generated in the same order as SyntaxDefinition.matches.
+    A chunk was scanned from its start in the default lexer state, which is
+    wrong if a token of the previous chunk extends over the start of the
+    chunk. In that case the text is scanned again from the end of that
+    token until a token boundary is reached at which the rescan and the
+    tokens of the chunk agree: the next token is found by searching from
+    the end of the previous token, so the tokens that follow a common
+    token boundary are the same.
+
+    :param results: An iterable of chunk scan results (see scan_chunk) in
+    order of their (contiguous) chunks.
+    """
+    pos = 0 # end of the last token
+    rescan = None
+    pending = None
+    for start, end, names, ids, bounds in results:
+        if rescan is None and pos > start:
+            rescan = syntaxdef.matches(text, pos)
+            pending = next(rescan, None)
+        index = 0 # index of the first chunk token to generate
+        if rescan is not None:
+            while pending is not None and pending[1] < start:
+                yield pending
+                pos = pending[2]
+                pending = next(rescan, None)
+            if pos > start:
+                # keys of the token boundaries in this chunk
+                keys = {}
+                for i in xrange(len(ids)):
+                    tstart = bounds[i * 2]
+                    tend = bounds[i * 2 + 1]
+                    keys[(tend, tstart == tend)] = i + 1
+                index = None
+                while pending is not None and pending[1] < end:
+                    yield pending
+                    pos = pending[2]
+                    index = keys.get((pos, pending[1] == pos))
+                    pending = next(rescan, None)
+                    if index is not None:
+                        break
+                if index is None:
+                    continue # rescan the next chunk
+            rescan = pending = None
+        for i in xrange(index, len(ids)):
+            pos = bounds[i * 2 + 1]
+            yield names[ids[i]], bounds[i * 2], pos
+    if rescan is not None:
+        while pending is not None:
+            yield pending
+            pending = next(rescan, None)
+
+def scan_parallel(syntaxdef, text, offset=0, processes=None,
+                  chunk_size=CHUNK_SIZE):
+    """Generate the tokens (see SyntaxDefinition.matches) of a large text
+
+    The text is split into chunks, which are scanned in a pool of processes
+    and stitched together. Chunks are scanned in this process if processes
+    is 1.
+
+    :param processes: The number of processes (default: number of CPUs).
+    """
+    chunks = split_chunks(text, offset, chunk_size)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if processes < 2 or len(chunks) < 2:
+        source = (syntaxdef, text)
+        results = (scan_chunk(chunk, source) for chunk in chunks)
+        for token in stitch_tokens(syntaxdef, text, results):
+            yield token
+        return
+    # the source is passed to each scan process when it is started
+    pool = multiprocessing.Pool(min(processes, len(chunks)),
+        _init_scan_process, (syntaxdef, text))
+    try:
+        results = pool.imap(scan_chunk, chunks)
+        for token in stitch_tokens(syntaxdef, text, results):
+            yield token
+    finally:
+        pool.terminate()
+
+
+# -- measurement --------------------------------------------------------------
+
+class CountingSink(object):
+    """Attribute sink that counts color changes
+
+    Used in place of editxt.syntax.TextStorageSink. Instances share the
+    counters of the factory that created them.
+    """
+
+    def __init__(self):
+        self.batches = 0
+        self.changes = 0
+
+    def __call__(self, text_storage, editing=False):
+        return self
+
+    def begin(self):
+        self.batches += 1
+
+    def set_color(self, start, length, color):
+        self.changes += 1
+
+    def end(self):
+        pass
+
+
+class BenchTextStorage(object):
+    """Minimal text storage for SyntaxCache.color_text"""
+
+    def __init__(self, text):
+        self.text = text
+        self.changelen = 0
+
+    def string(self):
+        return self.text
+
+    def editedMask(self):
+        return 2 # NSTextStorageEditedCharacters
+
+    def changeInLength(self):
+        return self.changelen
+
+    def replace(self, start, length, value):
+        """Replace a range of text
+
+        :returns: The edited range (start, length) of the new text.
+        """
+        self.text = self.text[:start] + value + self.text[start + length:]
+        self.changelen = len(value) - length
+        return start, len(value)
+
+
+def load_definition(language, path=None):
+    from editxt.syntax import SyntaxFactory
+    if path is None:
+        path = os.path.join(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))), "resources", "syntaxdefs")
+    return SyntaxFactory().load_definition(
+        os.path.join(path, SYNTAX_FILES[language]))
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return time.time() - start, result
+
+def span_memory(store):
+    """Approximate memory used by a SpanStore (in bytes)"""
+    return (sys.getsizeof(store.starts.values) + sys.getsizeof(store.lengths) +
+        sys.getsizeof(store.ids) + sys.getsizeof(store.infos) +
+        sys.getsizeof(store._info_ids))
+
+def bench_scan(sdef, text, repeat):
+    def scan():
+        count = [0]
+        def setcolor(color, range, prevend, info):
+            count[0] += 1
+        sdef.scan(text, setcolor)
+        return count[0]
+    times = []
+    for i in xrange(repeat):
+        seconds, tokens = timed(scan)
+        times.append(seconds)
+    seconds = min(times)
+    return {
+        "seconds": seconds,
+        "chars_per_second": len(text) / seconds if seconds else None,
+        "tokens": tokens,
+    }
+
+def bench_parallel_scan(sdef, text, repeat, processes=None):
+    def scan():
+        count = 0
+        for token in scan_parallel(sdef, text, processes=processes):
+            count += 1
+        return count
+    times = []
+    for i in xrange(repeat):
+        seconds, tokens = timed(scan)
+        times.append(seconds)
+    seconds = min(times)
+    return {
+        "seconds": seconds,
+        "chunks": len(split_chunks(text)),
+        "tokens": tokens,
+    }
+
+def edit_positions(text, count, seed=0):
+    """Get line start indexes near the middle of the text"""
+    rnd = random.Random(seed)
+    middle = len(text) // 2
+    spread = max(len(text) // 10, 1)
+    positions = []
+    for i in xrange(count):
+        index = middle + rnd.randint(-spread, spread)
+        positions.append(text.rfind(u"\n", 0, index) + 1)
+    return positions
+
+def bench_edits(sdef, text, repeat, block_size=2048):
+    """Color the text and then measure the cost of recoloring after edits
+
+    Each edit is reverted (and the text recolored) before the next edit.
+    """
+    from editxt.syntax import SyntaxCache
+    from Foundation import NSRange
+    ts = BenchTextStorage(text)
+    sink = CountingSink()
+    cache = SyntaxCache()
+    cache.syntaxdef = sdef
+    cache.sink_type = sink
+    color_seconds, ignore = timed(cache.color_text, ts)
+    result = {
+        "color": {"seconds": color_seconds, "changes": sink.changes},
+        "edits": {},
+        "memory": {
+            "spans": len(cache.cache),
+            "span_bytes": span_memory(cache.cache),
+            "runs": len(cache.runs.applied),
+            "run_bytes": span_memory(cache.runs.applied),
+        },
+    }
+    block = text[:block_size]
+    block = block[:block.rfind(u"\n") + 1] or block
+
+    def edit(start, length, value):
+        edited = ts.replace(start, length, value)
+        return timed(cache.color_text, ts, NSRange(*edited))[0]
+
+    for name in EDITS:
+        times = []
+        changes = 0
+        for start in edit_positions(ts.text, repeat):
+            before = sink.changes
+            if name == "insert_quote":
+                times.append(edit(start, 0, u'"'))
+                changes += sink.changes - before
+                edit(start, 1, u"")
+            elif name == "delete_line":
+                end = ts.text.find(u"\n", start) + 1 or len(ts.text)
+                line = ts.text[start:end]
+                times.append(edit(start, len(line), u""))
+                changes += sink.changes - before
+                edit(start, 0, line)
+            elif name == "paste_block":
+                times.append(edit(start, 0, block))
+                changes += sink.changes - before
+                edit(start, len(block), u"")
+        times.sort()
+        result["edits"][name] = {
+            "seconds": times[len(times) // 2],
+            "max_seconds": times[-1],
+            "changes": changes // len(times),
+        }
+    assert ts.text == text, "edits were not reverted"
+    return result
+
+def run(languages=LANGUAGES, sizes=SIZES, repeat=REPEAT, output=sys.stdout):
+    """Run benchmarks
+
+    :returns: A dict of results.
+    """
+    results = {}
+    for language in languages:
+        sdef = load_definition(language)
+        for size in sizes:
+            text = generate_text(language, parse_size(size))
+            gc.collect()
+            # large documents are scanned fewer times
+            reps = max(1, min(repeat, (10 * repeat * 1024 * 1024) // len(text)))
+            key = "%s/%s" % (language, size)
+            data = {"chars": len(text)}
+            data["scan"] = bench_scan(sdef, text, reps)
+            data["parallel_scan"] = bench_parallel_scan(sdef, text, reps)
+            data.update(bench_edits(sdef, text, reps))
+            results[key] = data
+            if output is not None:
+                output.write("%-20s scan %8.3fs  parallel %8.3fs  "
+                    "color %8.3fs  %s\n" % (key, data["scan"]["seconds"],
+                    data["parallel_scan"]["seconds"], data["color"]["seconds"],
+                    "  ".join("%s %.4fs" % (name, data["edits"][name]["seconds"])
+                              for name in EDITS)))
+    return {
+        "info": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "results": results,
+    }
+
+def timings(data):
+    """Get a dict of timings (name -> seconds) from a result dict"""
+    times = {}
+    for key, value in data["results"].iteritems():
+        times[key + " scan"] = value["scan"]["seconds"]
+        if "parallel_scan" in value:
+            times[key + " parallel_scan"] = value["parallel_scan"]["seconds"]
+        times[key + " color"] = value["color"]["seconds"]
+        for name, edit in value["edits"].iteritems():
+            times["%s %s" % (key, name)] = edit["seconds"]
+    return times
+
+def compare(data, baseline):
+    """Compare results with a baseline
+
+    :returns: A list of (name, seconds, baseline_seconds, ratio) tuples,
+    one for each timing that is present in both, sorted by name. The ratio
+    is None if the baseline timing is zero.
+    """
+    current = timings(data)
+    base = timings(baseline)
+    comparison = []
+    for name in sorted(set(current) & set(base)):
+        ratio = current[name] / base[name] if base[name] else None
+        comparison.append((name, current[name], base[name], ratio))
+    return comparison
+
+def regressions(comparison, tolerance=TOLERANCE):
+    return [item for item in comparison
+            if item[3] is not None and item[3] > 1 + tolerance]
+
+def main(args=None):
+    parser = OptionParser(usage="python -m editxt.benchmark [options]")
+    parser.add_option("-l", "--languages", default=",".join(LANGUAGES),
+        help="comma-delimited list of languages (default: %default)")
+    parser.add_option("-s", "--sizes", default=",".join(SIZES),
+        help="comma-delimited list of document sizes (default: %default)")
+    parser.add_option("-r", "--repeat", type="int", default=REPEAT,
+        help="number of times each measurement is repeated (default: %default)")
+    parser.add_option("-o", "--output",
+        help="write JSON results to this file (default: stdout)")
+    parser.add_option("-b", "--baseline",
+        help="compare results with this JSON file (from a previous run)")
+    parser.add_option("-t", "--tolerance", type="float", default=TOLERANCE,
+        help="fractional slowdown that is reported as a regression "
+             "(default: %default)")
+    options, ignore = parser.parse_args(args)
+    install_headless_modules()
+    languages = [v for v in options.languages.split(",") if v]
+    unknown = set(languages) - set(LANGUAGES)
+    if unknown:
+        parser.error("unknown language(s): %s" % ", ".join(sorted(unknown)))
+    sizes = [v for v in options.sizes.split(",") if v]
+    data = run(languages, sizes, options.repeat, sys.stderr)
+    if options.baseline:
+        with open(options.baseline) as fh:
+            baseline = json.load(fh)
+        comparison = compare(data, baseline)
+        data["baseline"] = {
+            "file": options.baseline,
+            "info": baseline.get("info"),
+            "ratios": dict((name, ratio) for name, x, y, ratio in comparison),
+        }
+        slow = regressions(comparison, options.tolerance)
+        data["regressions"] = [name for name, x, y, z in slow]
+        for name, seconds, base, ratio in slow:
+            sys.stderr.write("REGRESSION %s: %.4fs (baseline %.4fs, x%.2f)\n"
+                % (name, seconds, base, ratio))
+    if options.output:
+        with open(options.output, "w") as fh:
+            json.dump(data, fh, indent=2, sort_keys=True)
+    else:
+        json.dump(data, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+    return 1 if data.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -26,6 +26,16 @@ PROJECT_EXT = u"edxt"
 TEXT_DOCUMENT = u"public.plain-text"
 SYNTAX_DEFS_DIR = "syntaxdefs"
 SYNTAX_DEF_EXTENSION = ".syntax.py"
+# cache of loaded syntax definitions (in the application support directory)
+SYNTAX_CACHE_FILE = "syntaxdefs.cache"
+# directory of saved token spans of large documents (in the application
+# support directory) and the number of documents to remember
+HIGHLIGHT_CACHE_DIR = "highlight-cache"
+HIGHLIGHT_CACHE_FILES = 50
+# seconds between checks for changed syntax definition files
+SYNTAX_RELOAD_INTERVAL = 2.0
+# number of filename-to-syntax-definition lookups to remember
+SYNTAX_LOOKUP_CACHE_SIZE = 500
 LOG_NAME = "EditXT Log"
 
 DOC_ID_LIST_PBOARD_TYPE = "EditXT document id list"
@@ -38,6 +48,29 @@ WINDOW_CONTROLLERS_DEFAULTS_KEY = "window_controllers"
 
 LARGE_NUMBER_FOR_TEXT = 1e7
 
+# documents larger than this (in characters) are colored in the background
+SYNTAX_BACKGROUND_THRESHOLD = 100000
+# seconds to spend coloring after an edit before continuing in the background
+SYNTAX_EDIT_TIME = 0.05
+# lines longer than this (in characters) are colored only up to this column
+SYNTAX_MAX_LINE_LENGTH = 10000
+# seconds to spend coloring a long line before giving up on the rest of it
+SYNTAX_MAX_LINE_TIME = 0.1
+# color of the part of a long line that is not colored
+SYNTAX_LONG_LINE_COLOR = "808080"
+# syntax definitions with at least this many keywords (identifier-shaped word
+# tokens) match keywords by dict lookup rather than by regex alternation
+SYNTAX_KEYWORD_LOOKUP_MIN = 200
+# documents with at least this many characters get a trigram index (built
+# in the background) that narrows the text scanned by the find panel
+SEARCH_INDEX_THRESHOLD = 1024 * 1024
+# documents with at least this many characters are searched by a child
+# process that can be stopped with Escape (see editxt.search.SearchJob)
+# unless the search can use the trigram index
+SEARCH_JOB_THRESHOLD = 4 * 1024 * 1024
+# seconds after which a search in a child process is stopped
+SEARCH_JOB_TIMEOUT = 60
+
 DEFAULT_RIGHT_MARGIN = 80
 
 LINE_WRAP_NONE = "none"
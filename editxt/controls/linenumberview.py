@@ -31,25 +31,32 @@ log = logging.getLogger(__name__)
 
 
 class LineNumberView(NSRulerView):
+    """Ruler that shows the (logical) line numbers of a text view
+
+    Line numbers are looked up in the document's line index, and only the
+    first line fragment of each line is numbered, so numbers are correct
+    when lines are wrapped. Number labels are cached. After an edit only
+    the part of the ruler where visible numbers changed (or moved) is
+    redrawn, and the thickness of the ruler is recalculated only when the
+    number of digits in the line count changes.
+    """
+
+    max_labels = 1000 # number of cached line number labels
 
     def initWithScrollView_orientation_(self, scrollview, orientation):
         super(LineNumberView, self).initWithScrollView_orientation_(scrollview, orientation)
         self.textview = scrollview.documentView()
-        self.lines = []
         self.paragraph_style = ps = NSParagraphStyle.defaultParagraphStyle().mutableCopy()
         self.paragraphStyle = ps
         ps.setAlignment_(NSRightTextAlignment)
-        self.line_count = 1
-
-        # [[NSNotificationCenter defaultCenter]
-        #     addObserver:self
-        #     selector:@selector(textDidChange:)
-        #     name:NSTextStorageDidProcessEditingNotification
-        #     object:[(NSTextView *)aView textStorage]];
+        self.digits = 1
+        self.labels = {} # line number -> label (NSAttributedString)
+        self.label_font = None
+        self.drawn = {} # text view y-coordinate -> line number
 
         # subscribe to text edit notifications
         NSNotificationCenter.defaultCenter().addObserver_selector_name_object_(
-            self, "invalidateRuleThickness", NSTextDidChangeNotification,
+            self, "textDidChange:", NSTextDidChangeNotification,
             self.textview)
         return self
 
@@ -58,32 +65,37 @@ class LineNumberView(NSRulerView):
 
     # Line Counting ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
-    @untested
-    def estimate_line_count(self, font):
-        if "not in word wrap mode": # TODO detect word wrap mode
-            tv = self.textview
-            line_height = tv.layoutManager().defaultLineHeightForFont_(font)
-            min_count = int(round(tv.bounds().size.height / line_height))
-            return self.update_line_count(min_count)
-        else:
-            raise NotImplementedError("word-wrap line counting not implementedd")
-            # http://developer.apple.com/documentation/Cocoa/Conceptual/TextLayout/Tasks/CountLines.html
-
-    @untested
-    def update_line_count(self, value):
-        lc = self.line_count
-        if lc < value:
-            self.line_count = lc = value
-        return lc
+    def line_index(self):
+        return self.textview.doc_view.document.line_index
 
     def line_number_at_char_index(self, index):
-        font = self.textview.textStorage().font()
-        if font is None:
-            return 0
-        lm = self.textview.layoutManager()
-        line_height = lm.defaultLineHeightForFont_(font)
-        lrect, range = lm.lineFragmentRectForGlyphAtIndex_effectiveRange_(index, None)
-        return int(round(lrect.origin.y / line_height)) + 1
+        return self.line_index().line_at(index) + 1
+
+    def iter_line_numbers(self, top, bottom):
+        """Generate (y, line number) for lines that begin between top and bottom
+
+        Coordinates are in the text view. Fragments of wrapped lines after
+        the first are not numbered.
+        """
+        tv = self.textview
+        lm = tv.layoutManager()
+        tc = tv.textContainer()
+        lines = self.line_index()
+        glyph = lm.glyphIndexForPoint_inTextContainer_(NSMakePoint(0, top), tc)
+        last = lm.glyphIndexForPoint_inTextContainer_(NSMakePoint(0, bottom), tc)
+        numglyphs = lm.numberOfGlyphs()
+        while glyph <= last and glyph < numglyphs:
+            rect, grange = lm.lineFragmentRectForGlyphAtIndex_effectiveRange_(glyph, None)
+            index = lm.characterIndexForGlyphAtIndex_(glyph)
+            line = lines.line_at(index)
+            if lines.line_start(line) == index:
+                yield rect.origin.y, line + 1
+            glyph = grange.location + max(grange.length, 1)
+        rect = lm.extraLineFragmentRect()
+        if rect.size.height > 0 and rect.origin.y <= bottom \
+                and rect.origin.y + rect.size.height >= top:
+            # empty last line
+            yield rect.origin.y, len(lines)
 
     # Rule thickness and drawing ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
@@ -91,22 +103,73 @@ class LineNumberView(NSRulerView):
         font = self.textview.textStorage().font()
         if font is not None:
             charwidth = font.advancementForGlyph_(ord("0")).width
-            lines = self.estimate_line_count(font)
-            return int((len(str(lines)) + 3) * charwidth)
+            self.digits = len(str(len(self.line_index())))
+            return int((self.digits + 3) * charwidth)
         return self.ruleThickness()
 
     def requiredThickness(self):
         return self.calculate_thickness()
 
-    @untested
     def invalidateRuleThickness(self):
+        """Recalculate the thickness of the ruler and redraw it"""
         thickness = self.calculate_thickness()
-        # TODO do not call setNeedsDisplayInRect_ if the (exact) number of lines did not change
-        self.setNeedsDisplayInRect_(self.frame())
-        if thickness > self.ruleThickness():
+        self.drawn.clear()
+        self.setNeedsDisplay_(True)
+        if thickness != self.ruleThickness():
             self.setRuleThickness_(int(thickness))
             self.scrollView().tile()
 
+    def textDidChange_(self, notification):
+        digits = self.digits
+        thickness = self.calculate_thickness()
+        if self.digits != digits and thickness != self.ruleThickness():
+            self.invalidateRuleThickness()
+        else:
+            self.invalidate_changed_lines()
+
+    def text_offset(self):
+        """Get the offset from text view to ruler y-coordinates"""
+        return (self.textview.textContainerInset().height - 1) \
+            - self.scrollView().documentVisibleRect().origin.y
+
+    def invalidate_changed_lines(self):
+        """Redraw the part of the ruler where visible line numbers changed"""
+        font = self.textview.textStorage().font()
+        if font is None:
+            return
+        line_height = self.textview.layoutManager().defaultLineHeightForFont_(font)
+        offset = self.text_offset()
+        visible = self.visibleRect()
+        top = visible.origin.y - offset
+        bottom = top + visible.size.height
+        old = self.drawn
+        new = self.drawn = dict(self.iter_line_numbers(top, bottom))
+        changed = [y for y in set(old).union(new)
+            if y + line_height >= top and y <= bottom and old.get(y) != new.get(y)]
+        if changed:
+            low = min(changed)
+            high = max(changed) + line_height
+            self.setNeedsDisplayInRect_(NSMakeRect(
+                visible.origin.x, low + offset, visible.size.width, high - low))
+
+    def label(self, number, font):
+        """Get the (cached) label of a line number"""
+        if font is not self.label_font:
+            self.labels.clear()
+            self.label_font = font
+            self.label_attrs = {
+                NSFontAttributeName: font,
+                NSParagraphStyleAttributeName: self.paragraphStyle,
+            }
+        try:
+            return self.labels[number]
+        except KeyError:
+            if len(self.labels) >= self.max_labels:
+                self.labels.clear()
+            label = self.labels[number] = NSAttributedString.alloc() \
+                .initWithString_attributes_(unicode(number), self.label_attrs)
+            return label
+
     @untested
     def drawHashMarksAndLabelsInRect_(self, rect):
         """Draw the line numbers
@@ -123,37 +186,16 @@ class LineNumberView(NSRulerView):
         font = tv.textStorage().font()
         if font is None:
             return
-        lm = tv.layoutManager()
         lineHeight = tv.layoutManager().defaultLineHeightForFont_(font)
-        offset = (tv.textContainerInset().height - 1) \
-            - self.scrollView().documentVisibleRect().origin.y
-        top = NSMakePoint(0, rect.origin.y - offset)
-        bot = NSMakePoint(0, rect.origin.y - offset + rect.size.height)
-        topGlyph = lm.glyphIndexForPoint_inTextContainer_(top, tv.textContainer())
-        botGlyph = lm.glyphIndexForPoint_inTextContainer_(bot, tv.textContainer())
+        offset = self.text_offset()
+        top = rect.origin.y - offset
+        bottom = top + rect.size.height
         drawWidth = self.baselineLocation() + self.requiredThickness() - (lineHeight / 2)
         drawRect = NSMakeRect(0, 0, drawWidth, lineHeight)
-        attr = {
-            NSFontAttributeName: font,
-            NSParagraphStyleAttributeName: self.paragraphStyle,
-        }
-        i = topGlyph
-        line = max(0, int(top.y)) / int(lineHeight) + 1
-        # TODO handle word-wrap mode line counting (when that feature is implemented)
-
-        while i <= botGlyph:
-            lrect, range = lm.lineFragmentRectForGlyphAtIndex_effectiveRange_(i, None)
-            text = NSString.stringWithString_(unicode(line))
-            drawRect.origin.y = lrect.origin.y + offset
-            text.drawInRect_withAttributes_(drawRect, attr)
-            line += 1
-            i += range.length
-        last = tv.textStorage().length() - 1
-        if i >= last and tv.string()[last] in u"\n\r":
-            # draw last line number when the last character is newline
-            text = NSString.stringWithString_(unicode(line))
-            drawRect.origin.y = lrect.origin.y + offset + lineHeight
-            text.drawInRect_withAttributes_(drawRect, attr)
-            self.update_line_count(line + 1)
-        else:
-            self.update_line_count(line)
+        drawn = self.drawn
+        if len(drawn) > self.max_labels:
+            drawn.clear()
+        for y, line in self.iter_line_numbers(top, bottom):
+            drawn[y] = line
+            drawRect.origin.y = y + offset
+            self.label(line, font).drawInRect_(drawRect)
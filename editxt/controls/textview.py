@@ -47,6 +47,10 @@ class TextView(NSTextView):
         if not app.text_commander.do_textview_command_by_selector(self, selector):
             super(TextView, self).doCommandBySelector_(selector)
 
+    def cancelOperation_(self, sender):
+        if not FindController.shared_controller().stop_search():
+            super(TextView, self).cancelOperation_(sender)
+
     def validateUserInterfaceItem_(self, item):
         if item.action() == "performFindPanelAction:":
             return FindController.shared_controller().validate_action(item.tag())
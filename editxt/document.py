@@ -20,6 +20,7 @@
 import logging
 import objc
 import os
+import time
 
 import objc
 from AppKit import *
@@ -35,7 +36,10 @@ from editxt.controls.alert import Alert
 from editxt.controls.linenumberview import LineNumberView
 from editxt.controls.statscrollview import StatusbarScrollView
 from editxt.controls.textview import TextView
-from editxt.syntax import SyntaxCache
+from editxt.lineindex import LineIndex, visual_column
+from editxt.syntax import SyntaxCache, Highlighter
+from editxt.textscan import scan_text
+from editxt.trigram import TrigramIndex
 from editxt.textcommand import replace_newlines, change_indentation
 from editxt.util import KVOList, KVOProxy, KVOLink, untested, refactor
 from editxt.util import fetch_icon, filestat, register_undo_callback
@@ -87,6 +91,8 @@ class TextDocumentView(NSObject):
         self.document = document
         self.text_view = None
         self.scroll_view = None
+        self.line_status = None # (line, column, selection) in the status bar
+        self._column = None # last column computed by column_at
         self.props = KVOProxy(self)
         if isinstance(document, NSDocument):
             # HACK this should not be conditional (but it is for tests)
@@ -181,6 +187,12 @@ class TextDocumentView(NSObject):
             #sv.verticalRulerView().invalidateRuleThickness()
             sv.setRulersVisible_(True)
 
+            # color newly visible text first (large documents)
+            clip = sv.contentView()
+            clip.setPostsBoundsChangedNotifications_(True)
+            NSNotificationCenter.defaultCenter().addObserver_selector_name_object_(
+                self, "visibleRectDidChange:", NSViewBoundsDidChangeNotification, clip)
+
             self.wrap_mode = const.LINE_WRAP_NONE
             self.reset_edit_state()
         else:
@@ -348,6 +360,7 @@ class TextDocumentView(NSObject):
             self.project.remove_document_view(self)
         if doc is not None:
             if self.text_view is not None:
+                NSNotificationCenter.defaultCenter().removeObserver_(self)
                 self.scroll_view.removeFromSuperview()
                 self.scroll_view.verticalRulerView().denotify()
                 if doc.text_storage is not None:
@@ -366,21 +379,58 @@ class TextDocumentView(NSObject):
         name = 'N/A' if self.document is None else self.displayName()
         return '<%s 0x%x name=%s>' % (type(self).__name__, id(self), name)
 
+    def visible_range(self):
+        """Get the range of characters visible in the text view"""
+        tv = self.text_view
+        lm = tv.layoutManager()
+        glyphs = lm.glyphRangeForBoundingRect_inTextContainer_(
+            tv.visibleRect(), tv.textContainer())
+        return lm.characterRangeForGlyphRange_actualGlyphRange_(glyphs, None)[0]
+
+    def visibleRectDidChange_(self, notification):
+        highlighter = self.document.highlighter
+        if highlighter is not None:
+            highlighter.show(self.visible_range())
+
     # TextView delegate ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
-    @untested
     def textViewDidChangeSelection_(self, notification):
         tv = notification.object()
-        text = tv.string()
         range = tv.selectedRange()
-        index = range.location if range.location < text.length() else (text.length() - 1)
-        line = self.scroll_view.verticalRulerView().line_number_at_char_index(index)
-        i = index
-        while i > 0 and text[i - 1] != u"\n":
-            i -= 1
-        col = (index - i)
-        sel = range.length
-        self.scroll_view.statusView.updateLine_column_selection_(line, col, sel)
+        index = range.location
+        lines = self.document.line_index
+        line = lines.line_at(index)
+        col = self.column_at(tv.textStorage(), lines, lines.line_start(line), index)
+        status = (line + 1, col, range.length)
+        if status != self.line_status:
+            self.line_status = status
+            self.scroll_view.statusView.updateLine_column_selection_(*status)
+
+    def column_at(self, text_storage, lines, start, index):
+        """Get the visual column of index in the line that begins at start
+
+        Tabs are expanded to the document's indent size. When the caret
+        moves on a line of unchanged text only the characters between the
+        previous position and index are read.
+        """
+        def substring(start, end):
+            return text_storage.attributedSubstringFromRange_(
+                (start, end - start)).string()
+        tab_width = self.document.indent_size
+        key = (lines.version, start, tab_width)
+        begin, col = start, 0
+        if self._column is not None and self._column[0] == key:
+            prev, prevcol = self._column[1:]
+            if prev <= index:
+                begin, col = prev, prevcol
+            else:
+                text = substring(index, prev)
+                if u"\t" not in text:
+                    begin, col = index, prevcol - len(text)
+        if begin < index:
+            col = visual_column(substring(begin, index), tab_width, col)
+        self._column = (key, index, col)
+        return col
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
@@ -436,6 +486,10 @@ class TextDocument(NSDocument):
         }
         self.text_storage = NSTextStorage.alloc().initWithString_attributes_(u"", {})
         self.syntaxer = SyntaxCache()
+        self.highlighter = None
+        self._line_index = LineIndex()
+        self._search_index = None
+        self._edits = None
         self._filestat = None
         self.props = KVOProxy(self)
         self.indent_mode = const.INDENT_MODE_SPACE
@@ -492,6 +546,52 @@ class TextDocument(NSDocument):
     def default_text_attributes(self):
         return self._text_attributes
 
+    @property
+    def line_index(self):
+        """The line starts of the text (see editxt.lineindex.LineIndex)
+
+        The index is updated as the text is edited, and it is reset when
+        the text is read from a file (see reset_text_indexes). It is also
+        rebuilt if the length of the text changed without an edit
+        notification (before the document is the delegate of its text
+        storage).
+        """
+        index = self._line_index
+        ts = self.text_storage
+        if index.length != ts.length():
+            index.reset(ts.string())
+        return index
+
+    @property
+    def search_index(self):
+        """The trigram index of the text (see editxt.trigram.TrigramIndex)
+
+        Only large documents are indexed (this is None if the text is
+        smaller than const.SEARCH_INDEX_THRESHOLD). The index is built in
+        the background when it is first used, and it is updated as the
+        text is edited.
+        """
+        index = self._search_index
+        if index is None and \
+                self.text_storage.length() >= const.SEARCH_INDEX_THRESHOLD:
+            index = self._search_index = TrigramIndex()
+        return index
+
+    def reset_text_indexes(self, text=None, scan=None):
+        """Rebuild the text indexes after the text was replaced
+
+        This must be called when the contents of the text storage are
+        replaced without an edit notification; the indexes cannot detect
+        a replacement that does not change the length of the text.
+
+        :param text: The text; defaults to the text of the text storage.
+        :param scan: An optional scan of the text (see editxt.textscan).
+        """
+        if text is None:
+            text = self.text_storage.string()
+        self._line_index.reset(text, scan)
+        self._search_index = None
+
     def makeWindowControllers(self):
         editor = app.current_editor()
         if editor is None:
@@ -544,26 +644,23 @@ class TextDocument(NSDocument):
         self._filestat = None
 
     def analyze_content(self):
-        from editxt.textcommand import iterlines
         text = self.text_storage.string()
-        start, end, cend = text.getLineStart_end_contentsEnd_forRange_(
-            None, None, None, (0, 0))
-        if end != cend:
-            eol = EOLREF.get(text[cend:end], const.NEWLINE_MODE_UNIX)
-            self.newline_mode = eol
-        mode = None
-        for line in iterlines(text):
-            if line.startswith(u"\t"):
-                mode = const.INDENT_MODE_TAB
-                if line.strip():
-                    break
-            elif line.startswith(u" "):
-                mode = const.INDENT_MODE_SPACE
-                if line.strip():
-                    self.indent_size = len(line) - len(line.lstrip(u" "))
-                    break
-        if mode is not None:
-            self.indent_mode = mode
+        scan = scan_text(text)
+        eol = scan.eol(0)
+        if eol is not None:
+            self.newline_mode = EOLREF.get(eol, const.NEWLINE_MODE_UNIX)
+        line = scan.indented_line()
+        if line is not None:
+            start = scan.starts[line]
+            indent = text[start:start + scan.indents[line]]
+            if indent.startswith(u"\t"):
+                self.indent_mode = const.INDENT_MODE_TAB
+            else:
+                self.indent_mode = const.INDENT_MODE_SPACE
+                if start + len(indent) < scan.ends[line]:
+                    self.indent_size = len(indent) - len(indent.lstrip(u" "))
+        # index lines with the same scan
+        self.reset_text_indexes(text, scan)
 
     def is_externally_modified(self):
         """check if this document has been modified by another program"""
@@ -643,6 +740,8 @@ class TextDocument(NSDocument):
             self.performSelector_withObject_afterDelay_("_clearChanges", self, 0)
             textview.setSelectedRange_(NSRange(0, 0))
             self.update_syntaxer()
+        # reading the temporary store reset the indexes with its text
+        self.reset_text_indexes()
 
     @untested
     def prepareSavePanel_(self, panel):
@@ -690,10 +789,67 @@ class TextDocument(NSDocument):
     def _get_syntaxdef(self):
         return self.syntaxer.syntaxdef
     def _set_syntaxdef(self, value):
+        # a definition chosen from the syntax menu or replaced by a reload
+        # was not necessarily looked up with SyntaxFactory.get_definition
+        app.syntax_factory.link_nested(value)
         self.syntaxer.syntaxdef = value
-        self.syntaxer.color_text(self.text_storage)
+        self.color_text()
     syntaxdef = property(_get_syntaxdef, _set_syntaxdef)
 
+    def color_text(self, offset=0):
+        """Color the text beginning at offset (a token boundary)
+
+        Small documents are colored immediately. Large documents, and the
+        rest of a document after an edit that took too long to color, are
+        colored in the background beginning with the text that is visible
+        in this document's views.
+        """
+        if self.highlighter is not None:
+            self.highlighter.stop()
+            self.highlighter = None
+        ts = self.text_storage
+        if offset == 0 and ts.length() < const.SYNTAX_BACKGROUND_THRESHOLD:
+            self.syntaxer.color_text(ts)
+            return
+        if offset == 0 and self.restore_highlight():
+            return
+        self.highlighter = Highlighter.alloc().init(self.syntaxer, ts, offset)
+        for view in app.iter_views_of_document(self):
+            if view.text_view is not None:
+                self.highlighter.show(view.visible_range())
+
+    def restore_highlight(self):
+        """Color the text with the spans saved when it was last closed
+
+        :returns: True if the text was colored.
+        """
+        url = self.fileURL()
+        syntaxdef = self.syntaxdef
+        if url is None or self.isDocumentEdited() \
+                or not hasattr(syntaxdef, "wordinfo"):
+            return False
+        ts = self.text_storage
+        spans = app.highlight_cache.load(
+            url.path(), unicode(ts.string()), syntaxdef)
+        if spans is None:
+            return False
+        self.syntaxer.restore(ts, spans)
+        return True
+
+    def save_highlight(self):
+        """Save the spans of a large, unedited, completely colored document"""
+        hl = self.highlighter
+        ts = self.text_storage
+        url = self.fileURL()
+        syntaxdef = self.syntaxdef
+        if (hl is not None and hl.running) or ts is None or url is None \
+                or self.isDocumentEdited() \
+                or ts.length() < const.SYNTAX_BACKGROUND_THRESHOLD \
+                or not hasattr(syntaxdef, "wordinfo"):
+            return
+        app.highlight_cache.save(
+            url.path(), unicode(ts.string()), syntaxdef, self.syntaxer.cache)
+
     def update_syntaxer(self):
         if self.text_storage.delegate() is not self:
             self.text_storage.setDelegate_(self)
@@ -703,11 +859,63 @@ class TextDocument(NSDocument):
             syntaxdef = app.syntax_factory.get_definition(filename)
             if self.syntaxdef is not syntaxdef:
                 self.props.syntaxdef = syntaxdef
-                self.syntaxer.color_text(self.text_storage)
+                self.color_text()
+
+    def replace_ranges(self, ranges, strings):
+        """Replace many ranges of the text in a single edit
+
+        The text storage processes the replacements as one edit (its layout
+        managers are notified once), but the line index, the search index
+        and syntax coloring are updated for each replaced range rather than
+        for the entire span of the edit.
+
+        :param ranges: A list of sorted, non-overlapping ranges (NSRange) of
+        the text.
+        :param strings: A list of replacement strings; one for each range.
+        """
+        edits = []
+        delta = 0
+        for range, string in zip(ranges, strings):
+            changelen = len(string) - range.length
+            edits.append((range.location + delta, len(string), changelen))
+            delta += changelen
+        ts = self.text_storage
+        ts.beginEditing()
+        try:
+            # replace from the end so the ranges remain valid
+            for range, string in reversed(zip(ranges, strings)):
+                ts.replaceCharactersInRange_withString_(range, string)
+            self._edits = edits
+        finally:
+            ts.endEditing()
+            self._edits = None
 
     def textStorageDidProcessEditing_(self, notification):
-        range = self.text_storage.editedRange()
-        self.syntaxer.color_text(self.text_storage, range)
+        ts = self.text_storage
+        range = ts.editedRange()
+        edited = ts.editedMask() & NSTextStorageEditedCharacters
+        edits = self._edits
+        if edited:
+            text = ts.string()
+            changelen = ts.changeInLength()
+            if edits is None:
+                self._line_index.text_edited(
+                    text, range.location, range.length, changelen)
+                if self._search_index is not None:
+                    self._search_index.text_edited(
+                        text, range.location, range.length, changelen)
+            else:
+                self._line_index.batch_edited(text, edits)
+                if self._search_index is not None:
+                    self._search_index.batch_edited(text, edits)
+        deadline = time.time() + const.SYNTAX_EDIT_TIME
+        offset = self.syntaxer.color_text(ts, range, deadline, edits)
+        hl = self.highlighter
+        if hl is not None and hl.running:
+            if edited:
+                hl.text_edited(range, ts.changeInLength(), offset)
+        elif offset is not None:
+            self.color_text(offset)
 
     def updateChangeCount_(self, ctype):
         super(TextDocument, self).updateChangeCount_(ctype)
@@ -729,6 +937,10 @@ class TextDocument(NSDocument):
         # remove window controllers here so NSDocument does not close the windows
         for wc in list(self.windowControllers()):
             self.removeWindowController_(wc)
+        self.save_highlight()
+        if self.highlighter is not None:
+            self.highlighter.stop()
+            self.highlighter = None
         ts = self.text_storage
         if ts is not None and ts.delegate() is self:
             ts.setDelegate_(None)
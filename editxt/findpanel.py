@@ -22,6 +22,7 @@ import objc
 import os
 import re
 import time
+from functools import partial
 
 from AppKit import *
 from Foundation import *
@@ -29,6 +30,9 @@ from Foundation import *
 import editxt.constants as const
 from editxt import app
 from editxt.commandbase import PanelController, Options
+from editxt.search import (LITERAL, REGEX, WORD, SearchJob, count_matches,
+    find_match, iter_matches, nested_quantifiers, pattern_cache,
+    replace_matches)
 from editxt.util import KVOProxy, KVOLink
 
 log = logging.getLogger(__name__)
@@ -127,6 +131,7 @@ class FindController(PanelController):
         }
         #self.opts = opts = KVOProxy(FindOptions())
         self.recently_found_range = None
+        self.search_monitor = None
         return self
 
     def windowDidLoad(self):
@@ -287,6 +292,13 @@ class FindController(PanelController):
         if target is not None and ftext:
             text = target.string()
             selection = target.selectedRange()
+            mode = self.background_mode(text, ftext)
+            if mode is not None:
+                args = ((selection.location, selection.length),
+                        direction == BACKWARD, self.opts.wrap_around)
+                self.run_search(target, ftext, mode, u"Finding", find_match,
+                                args, partial(self._found, target, mode))
+                return
             range = self._find(text, ftext, selection, direction)
             if range is not None:
                 target.setSelectedRange_(range)
@@ -300,8 +312,7 @@ class FindController(PanelController):
         if options.regular_expression:
             finditer = self.regexfinditer
         elif options.match_entire_word:
-            ftext = u"\\b" + re.escape(ftext) + u"\\b"
-            finditer = self.regexfinditer
+            finditer = partial(self.regexfinditer, mode=WORD)
         else:
             finditer = self.simplefinditer
         range = NSMakeRange(selection.location, 0)
@@ -317,6 +328,23 @@ class FindController(PanelController):
             return range
         return None
 
+    def _found(self, target, mode, regex, span):
+        """Select the match found by a background search (see find)"""
+        if span is None:
+            NSBeep()
+            return
+        start, end = span
+        rematch = None
+        if mode != LITERAL:
+            # match again to get groups for replace (see FoundRange.expand)
+            rematch = regex.match(target.string(), start)
+            if rematch is not None and rematch.end() != end:
+                rematch = None
+        range = NSMakeRange(start, end - start)
+        self.recently_found_range = FoundRange(range, rematch)
+        target.setSelectedRange_(range)
+        target.scrollRangeToVisible_(range)
+
     def _replace_all(self, selection_only):
         target = self.find_target()
         ftext = self.find_value
@@ -334,56 +362,168 @@ class FindController(PanelController):
                 # another option: replace all (backward) to the beginning of the
                 # file, but there's no way to do that with the interface.
                 range = NSMakeRange(range.location, len(text) - range.location)
+        rtext = self.replace_value
+        mode = self.background_mode(text, ftext)
+        if mode is not None:
+            if range.length == 0:
+                end = len(text)
+            else:
+                end = range.location + range.length
+            args = (range.location, end, rtext, mode != LITERAL)
+            self.run_search(target, ftext, mode, u"Replacing",
+                replace_matches, args, partial(self._replace_found, target))
+            return
         if options.regular_expression:
             finditer = self.regexfinditer
         elif options.match_entire_word:
-            ftext = u"\\b" + re.escape(ftext) + u"\\b"
-            finditer = self.regexfinditer
+            finditer = partial(self.regexfinditer, mode=WORD)
         else:
             finditer = self.simplefinditer
-        rtext = self.replace_value
-        range0 = None
+        ranges = []
         rtexts = []
         for found in finditer(text, ftext, range, FORWARD, False):
-            range = found.range
-            if range0 is None:
-                range0 = range
-            else:
-                rtexts.append(text[sum(range1):range.location])
-            range1 = range
+            ranges.append(found.range)
             rtexts.append(found.expand(rtext))
-        if range0 is not None:
-            start = range0.location
-            range = NSMakeRange(start, sum(range1) - start)
-            value = "".join(rtexts)
-            if target.shouldChangeTextInRange_replacementString_(range, value):
-                target.textStorage().replaceCharactersInRange_withString_(range, value)
-                target.didChangeText()
-                target.setNeedsDisplay_(True)
-                return
+        self.replace_ranges(target, ranges, rtexts)
+
+    def _replace_found(self, target, regex, items):
+        """Replace the matches of a background search (see _replace_all)"""
+        ranges = [NSMakeRange(start, end - start) for start, end, value in items]
+        rtexts = [value for start, end, value in items]
+        self.replace_ranges(target, ranges, rtexts)
+
+    def replace_ranges(self, target, ranges, rtexts):
+        """Replace ranges of the target's text with the given strings"""
+        # replace only the matched ranges (not the text between them) so
+        # undo, coloring and layout are proportional to the replaced text
+        values = [NSValue.valueWithRange_(r) for r in ranges]
+        if ranges and \
+                target.shouldChangeTextInRanges_replacementStrings_(values, rtexts):
+            target.doc_view.document.replace_ranges(ranges, rtexts)
+            target.didChangeText()
+            target.setNeedsDisplay_(True)
+            return
         NSBeep()
 
     def count_occurrences(self, ftext, regex):
         target = self.find_target()
         if target is not None and ftext:
             text = target.string()
+            mode = self.background_mode(text, ftext, regex)
+            if mode is not None:
+                self.run_search(target, ftext, mode, u"Counting",
+                    count_matches, (0, len(text)),
+                    lambda regex, count: self.flash_count(count))
+                return
             range = NSMakeRange(0, text.length())
             options = self.opts
             if regex and options.regular_expression:
                 finditer = self.regexfinditer
             elif regex and options.match_entire_word:
-                ftext = u"\\b" + re.escape(ftext) + u"\\b"
-                finditer = self.regexfinditer
+                finditer = partial(self.regexfinditer, mode=WORD)
             else:
                 finditer = self.simplefinditer
             count = sum(1 for x in finditer(text, ftext, range, FORWARD, False))
-            if count:
-                self.flash_status_text(u"%i occurrences" % count)
-            else:
-                self.flash_status_text(u"Not found")
+            self.flash_count(count)
         else:
             NSBeep()
 
+    def flash_count(self, count):
+        if count:
+            self.flash_status_text(u"%i occurrences" % count)
+        else:
+            self.flash_status_text(u"Not found")
+
+    def background_mode(self, text, ftext, regex=True):
+        """Get the mode of a search that should be run in the background
+
+        Searches of large documents and of expressions that may backtrack
+        catastrophically (see editxt.search.nested_quantifiers) are run in
+        a child process so they can be stopped (see run_search). Literal
+        and whole word searches of indexed documents are run in the
+        foreground (they are fast at any document size).
+
+        :param regex: False if the find options for regular expression and
+        entire word matching should be ignored (see count_occurrences).
+        :returns: The mode of ftext (see editxt.search.PatternCache) or None
+        if the search should be run in the foreground.
+        """
+        options = self.opts
+        if regex and options.regular_expression:
+            mode = REGEX
+        elif regex and options.match_entire_word:
+            mode = WORD
+        else:
+            mode = LITERAL
+        if mode == REGEX:
+            try:
+                if nested_quantifiers(ftext):
+                    return mode
+            except re.error:
+                return None # the error is reported when it is compiled
+        if len(text) < const.SEARCH_JOB_THRESHOLD:
+            return None
+        if mode != REGEX and len(ftext) >= 3 \
+                and (mode == WORD or is_ascii(ftext)) \
+                and self.search_index(text) is not None:
+            return None
+        return mode
+
+    def run_search(self, target, ftext, mode, title, func, args, finish):
+        """Run a search in a child process (see editxt.search.SearchJob)
+
+        The progress of the search is shown in the status label. It can be
+        stopped with Escape (see stop_search) and it is stopped if it runs
+        longer than const.SEARCH_JOB_TIMEOUT seconds. The search is done on
+        a snapshot of the target's text; ``finish(regex, result)`` is called
+        when it is done unless the text was edited in the mean time.
+        """
+        self.stop_search()
+        try:
+            regex = self.compile(ftext, mode)
+        except re.error, err:
+            NSBeep()
+            log.error("cannot compile regex %r : %s", ftext, err)
+            return
+        document = target.doc_view.document
+        version = document.line_index.version
+        def done(job):
+            self.search_monitor = None
+            if document.line_index.version != version \
+                    or self.find_target() is not target:
+                NSBeep()
+                self.flash_status_text(u"Text changed during search")
+            elif job.error is not None:
+                NSBeep()
+                if job.error == "timed out":
+                    self.flash_status_text(u"Search timed out")
+                else:
+                    self.flash_status_text(u"Search failed")
+            else:
+                finish(regex, job.result)
+        self.stop_flashing_status()
+        job = SearchJob(func, regex, target.string(), args,
+                        const.SEARCH_JOB_TIMEOUT)
+        self.search_monitor = \
+            SearchMonitor.alloc().init(self.status_label, job, title, done)
+
+    def stop_search(self):
+        """Stop the search that is running in the background (if any)
+
+        :returns: True if a search was stopped, otherwise False.
+        """
+        monitor = self.search_monitor
+        self.search_monitor = None
+        if monitor is not None and monitor.stop():
+            self.flash_status_text(u"Search stopped")
+            return True
+        return False
+
+    def cancelOperation_(self, sender):
+        # Escape key pressed in the find panel
+        if not self.stop_search():
+            NSBeep()
+
     def simplefinditer(self, text, ftext, range, direction, yield_on_wrap):
         """Yields FoundRanges of text that match ftext
 
@@ -409,6 +549,10 @@ class FindController(PanelController):
             else:
                 range = NSMakeRange(0, startindex)
         endindex = range.location + range.length
+        trigrams = None
+        if len(ftext) >= 3 and is_ascii(ftext):
+            # non-ASCII text may match canonically equivalent characters
+            trigrams = self.search_index(text)
         wrapped = False
         while True:
             if forwardSearch:
@@ -427,7 +571,7 @@ class FindController(PanelController):
                         frange = NSRange(startindex, index - startindex)
                 else:
                     frange = NSRange(range.location, index - range.location)
-            found = text.rangeOfString_options_range_(ftext, opts, frange)
+            found = range_of_string(text, ftext, opts, frange, trigrams)
             if found and found.length > 0 and found.location < endindex:
                 yield FoundRange(found)
                 index = found.location + (found.length if forwardSearch else 0)
@@ -439,46 +583,52 @@ class FindController(PanelController):
             else:
                 break
 
-    def regexfinditer(self, text, ftext, range, direction, yield_on_wrap):
+    def regexfinditer(self, text, ftext, range, direction, yield_on_wrap,
+                      mode=REGEX):
         """Yields FoundRanges of text matched by ftext (a regular expression)
 
         if yield_on_wrap evaluates to True and wrapAround search option is set
         then WRAPTOKEN is yielded when the search wraps around the beginning/end
         of the file.
+
+        :param mode: The mode of ftext (see editxt.search.PatternCache).
         """
-        flags = re.UNICODE | re.MULTILINE
         options = self.opts
-        if options.ignore_case:
-            flags |= re.IGNORECASE
         try:
-            regex = re.compile(ftext, flags)
+            regex = self.compile(ftext, mode)
         except re.error, err:
             NSBeep()
             log.error("cannot compile regex %r : %s", ftext, err)
         else:
-            backward = (direction == BACKWARD)
-            wrapped = False
-            endindex = range.location + range.length
-            while True:
-                if range.length > 0:
-                    itr = regex.finditer(text, range.location, endindex)
-                elif (wrapped and backward) or (not wrapped and not backward):
-                    itr = regex.finditer(text, range.location)
-                else:
-                    itr = regex.finditer(text, 0, range.location)
-                if backward:
-                    itr = reversed(list(itr))
-                for match in itr:
-                    s = match.start()
-                    e = match.end()
-                    #log.debug("searching for %r found %r at (%s, %s)", ftext, match.group(), s, e)
-                    yield FoundRange(NSMakeRange(s, e - s), match)
-                if options.wrap_around and not wrapped and range.length == 0:
+            trigrams = self.search_index(text)
+            if trigrams is not None:
+                finditer = partial(trigrams.finditer, regex)
+            else:
+                finditer = regex.finditer
+            matches = iter_matches(finditer, text, range.location,
+                range.length, direction == BACKWARD, options.wrap_around)
+            for match in matches:
+                if match is None:
                     if yield_on_wrap:
                         yield WRAPTOKEN
-                    wrapped = True
-                else:
-                    break
+                    continue
+                s = match.start()
+                e = match.end()
+                #log.debug("searching for %r found %r at (%s, %s)", ftext, match.group(), s, e)
+                yield FoundRange(NSMakeRange(s, e - s), match)
+
+    def search_index(self, text):
+        """Get the trigram index of text (the find target's text)
+
+        None is returned if the document is not indexed or if its index is
+        not ready (it is being built in the background).
+        """
+        target = self.find_target()
+        if target is not None:
+            index = target.doc_view.document.search_index
+            if index is not None and index.ready_for(text):
+                return index
+        return None
 
     def find_target(self):
         try:
@@ -493,6 +643,10 @@ class FindController(PanelController):
 
     def flash_status_text(self, text):
         self.stop_flashing_status()
+        if self.status_label is None:
+            # the panel has not been loaded (background search from menu)
+            self.status_flasher = None
+            return
         self.status_flasher = StatusFlasher.alloc().init(self.status_label, text)
 
     def stop_flashing_status(self):
@@ -510,11 +664,8 @@ class FindController(PanelController):
     def validate_expression(self):
         if self.opts.regular_expression and self.find_text is not None:
             ftext = self.find_text.stringValue()
-            flags = re.UNICODE | re.MULTILINE
-            if self.opts.ignore_case:
-                flags |= re.IGNORECASE
             try:
-                regex = re.compile(ftext, flags)
+                self.compile(ftext)
             except re.error, err:
                 NSBeep()
                 # Note: if the find dialog type is NSPanel (instead of NSWindow)
@@ -530,6 +681,16 @@ class FindController(PanelController):
                 return False
         return True
 
+    def compile(self, ftext, mode=REGEX):
+        """Compile ftext with the flags of the current find options
+
+        Compiled expressions are shared (see editxt.search.pattern_cache).
+        """
+        flags = re.UNICODE | re.MULTILINE
+        if self.opts.ignore_case:
+            flags |= re.IGNORECASE
+        return pattern_cache.compile(ftext, flags, mode)
+
     def load_options(self):
         pboard = NSPasteboard.pasteboardWithName_(NSFindPboard)
         if pboard.availableTypeFromArray_([NSStringPboardType]):
@@ -560,6 +721,34 @@ class FindController(PanelController):
         return True
 
 
+def is_ascii(text):
+    try:
+        text.encode("ascii")
+    except UnicodeError:
+        return False
+    return True
+
+
+def range_of_string(text, ftext, opts, range, index=None):
+    """Find ftext in range of text with NSString.rangeOfString_options_range_
+
+    Only the parts of range where ftext may begin are searched if index (a
+    TrigramIndex of text, see editxt.trigram) is given.
+    """
+    if index is None:
+        return text.rangeOfString_options_range_(ftext, opts, range)
+    start = range.location
+    end = start + range.length
+    extra = len(ftext) - 1
+    backward = bool(opts & NSBackwardsSearch)
+    for lo, hi in index.candidates(ftext, start, end, backward):
+        found = text.rangeOfString_options_range_(
+            ftext, opts, NSMakeRange(lo, min(hi + extra, end) - lo))
+        if found.length > 0:
+            return found
+    return NSMakeRange(NSNotFound, 0)
+
+
 class StatusFlasher(NSObject):
 
     timing = (0.2, 0.2, 0.2, 5)
@@ -594,6 +783,75 @@ class StatusFlasher(NSObject):
         self.runner = None
 
 
+class SearchMonitor(NSObject):
+    """Show the progress of a search job in a status label
+
+    The job (see editxt.search.SearchJob) is started, and its progress is
+    shown every interval seconds until it is finished. ``callback(job)`` is
+    called on the main thread as soon as the job is finished (unless it was
+    stopped).
+    """
+
+    interval = 0.1
+
+    @objc.namedSelector("init:job:title:callback:")
+    def init(self, label, job, title, callback):
+        self = super(SearchMonitor, self).init()
+        self.label = label
+        self.job = job
+        self.title = title
+        self.callback = callback
+        def finished(job):
+            # called in the worker thread
+            pool = NSAutoreleasePool.alloc().init()
+            try:
+                self.performSelectorOnMainThread_withObject_waitUntilDone_(
+                    "jobFinished:", job, False)
+            finally:
+                del pool
+        job.callback = finished
+        job.start()
+        self.show(u"%s..." % title)
+        self.performSelector_withObject_afterDelay_("doEvent", self, self.interval)
+        return self
+
+    def show(self, text):
+        if self.label is not None:
+            self.label.setHidden_(False)
+            self.label.setStringValue_(text)
+
+    def jobFinished_(self, job):
+        if job is not self.job:
+            return # stopped
+        self.job = None
+        self.show(u"")
+        self.callback(job)
+
+    def doEvent(self):
+        job = self.job
+        if job is None:
+            return
+        done, count = job.progress
+        text = u"%s... %i%%" % (self.title, done * 100)
+        if count:
+            text += u" (%i found)" % count
+        self.show(text)
+        self.performSelector_withObject_afterDelay_("doEvent", self, self.interval)
+
+    def stop(self):
+        """Cancel the job
+
+        :returns: True if the job was running, otherwise False.
+        """
+        job = self.job
+        self.job = None
+        if job is None:
+            return False
+        job.cancel()
+        self.show(u"")
+        return True
+
+
 class FoundRange(object):
 
     def __init__(self, range, rematch=None):
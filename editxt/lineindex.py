@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2012 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+"""Index of the line starts of a text"""
+import logging
+
+from editxt.spans import OffsetArray
+from editxt.textscan import EOL, scan_text
+
+log = logging.getLogger(__name__)
+
+
+class LineIndex(object):
+    """Sorted array of the offsets at which the lines of a text begin
+
+    The first line begins at offset zero. A newline at the end of the text
+    begins an empty last line. Newlines are those of const.EOLS; ``\\r\\n``
+    is a single newline. The version number is incremented each time the
+    text changes.
+
+    Lines are found by binary search, so looking up the line of an offset
+    (or the offset of a line) takes O(log n) time. Line starts are shifted
+    lazily after an edit (see editxt.spans.OffsetArray).
+    """
+
+    def __init__(self, text=u""):
+        self.version = 0
+        self.reset(text)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __repr__(self):
+        return "<%s %i lines>" % (type(self).__name__, len(self))
+
+    def reset(self, text, scan=None):
+        """Index all lines of text
+
+        :param scan: A TextScan (see editxt.textscan) of text. The text
+        will be scanned if this is not given.
+        """
+        if scan is None:
+            scan = scan_text(text)
+        self.starts = OffsetArray(scan.line_starts())
+        self.length = len(text)
+        self.version += 1
+
+    def line_at(self, index):
+        """Get the (zero-based) number of the line that contains index"""
+        return self.starts.bisect(index) - 1 if index > 0 else 0
+
+    def line_start(self, line):
+        """Get the offset at which the given (zero-based) line begins"""
+        if line < 0:
+            line += len(self.starts)
+        return self.starts[line]
+
+    def line_range(self, line):
+        """Get the range ``(start, end)`` of a line, including its newline"""
+        if line < 0:
+            line += len(self.starts)
+        start = self.starts[line]
+        if line + 1 < len(self.starts):
+            return start, self.starts[line + 1]
+        return start, self.length
+
+    def line_ranges(self, start, end):
+        """Generate ``(start, end)`` ranges of lines that overlap a range
+
+        No text is copied; the ranges can be used to slice the text.
+        """
+        if end <= start:
+            return
+        starts = self.starts
+        nlines = len(starts)
+        line = self.line_at(start)
+        lstart = starts[line]
+        while lstart < end:
+            line += 1
+            lend = starts[line] if line < nlines else self.length
+            yield lstart, lend
+            lstart = lend
+            if line >= nlines:
+                break
+
+    def text_edited(self, text, index, length, changelen):
+        """Update line starts after an edit
+
+        :param text: The edited text.
+        :param index: The offset of the edit.
+        :param length: The length of the new (inserted) text.
+        :param changelen: The change in length of the text.
+        """
+        self.batch_edited(text, [(index, length, changelen)])
+
+    def batch_edited(self, text, edits):
+        """Update line starts after a batch of edits
+
+        :param text: The edited text.
+        :param edits: A list of ``(index, length, changelen)`` tuples (see
+        text_edited) in ascending order, with offsets in the edited text.
+        """
+        if self.length + sum(edit[2] for edit in edits) != len(text):
+            # the text changed without notice; start over
+            self.reset(text)
+            return
+        for edit in edits:
+            self._edited(text, *edit)
+        self.version += 1
+
+    # internal helpers
+
+    def _edited(self, text, index, length, changelen):
+        lo = max(index, 1)
+        oldend = index + length - changelen
+        # line starts that depend on the replaced text
+        first = self.starts.bisect(lo - 1)
+        last = self.starts.bisect(oldend)
+        self.starts.delete(first, last)
+        self.starts.shift(first, changelen)
+        newend = index + length
+        new = [match.end() for match in EOL.finditer(text,
+            max(index - 1, 0), min(newend + 1, len(text)))]
+        new = [i for i in new if lo <= i <= newend]
+        if new:
+            self.starts.insert(first, new)
+        self.length += changelen
+
+
+def visual_column(text, tab_width, column=0):
+    """Get the column at the end of text
+
+    Each tab advances to the next multiple of tab_width. Other characters
+    (text should not contain newlines) are one column wide.
+
+    :param column: The column at which text begins.
+    """
+    tab_width = max(tab_width, 1)
+    prev = 0
+    i = text.find(u"\t")
+    while i >= 0:
+        column += i - prev
+        column += tab_width - column % tab_width
+        prev = i + 1
+        i = text.find(u"\t", prev)
+    return column + len(text) - prev
@@ -0,0 +1,456 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2012 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+"""Regular expression search helpers"""
+import cPickle
+import logging
+import os
+import re
+import sre_constants
+import sre_parse
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+# pattern modes (see PatternCache.compile)
+REGEX = "regex"
+LITERAL = "literal"
+WORD = "word"
+
+
+class PatternCache(object):
+    """A bounded cache of compiled regular expressions
+
+    Compiled expressions are keyed by ``(pattern, flags, mode)``. When the
+    cache is full the least recently used expression is evicted (the cache
+    of the re module is cleared entirely when it fills up, and it is shared
+    with every other module, so it does not keep the patterns of the find
+    panel for long). ``hits`` and ``misses`` count lookups.
+    """
+
+    def __init__(self, size=100):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._patterns = OrderedDict()
+
+    def __len__(self):
+        return len(self._patterns)
+
+    def __repr__(self):
+        return "<%s %i/%i hits=%i misses=%i>" % (type(self).__name__,
+            len(self), self.size, self.hits, self.misses)
+
+    def compile(self, pattern, flags=0, mode=REGEX):
+        """Get the compiled regular expression of pattern
+
+        :param pattern: The text of the pattern.
+        :param flags: Regular expression flags (see re.compile).
+        :param mode: REGEX (pattern is a regular expression), LITERAL
+        (pattern is literal text) or WORD (pattern is literal text that
+        only matches whole words).
+        :raises: re.error if the pattern cannot be compiled (errors are not
+        cached).
+        """
+        key = (pattern, flags, mode)
+        patterns = self._patterns
+        try:
+            regex = patterns.pop(key)
+        except KeyError:
+            self.misses += 1
+            if mode == REGEX:
+                regex = re.compile(pattern, flags)
+            elif mode == LITERAL:
+                regex = re.compile(re.escape(pattern), flags)
+            elif mode == WORD:
+                regex = re.compile(u"\\b" + re.escape(pattern) + u"\\b", flags)
+            else:
+                raise ValueError("unknown pattern mode: %r" % (mode,))
+            while patterns and len(patterns) >= self.size:
+                patterns.popitem(last=False)
+        else:
+            self.hits += 1
+        patterns[key] = regex
+        return regex
+
+    def clear(self):
+        self._patterns.clear()
+
+
+# compiled patterns shared by the find panel and text commands
+pattern_cache = PatternCache()
+
+
+def nested_quantifiers(pattern, flags=0):
+    """Find repeated sub-patterns that contain a variable repeat
+
+    Patterns like ``(a+)+`` or ``(\\s*x?)*`` may take exponential time to
+    fail to match.
+
+    :returns: A list of the outer repeats (as strings such as ``{0,inf}``)
+    that contain a repeat of a variable number of items.
+    """
+    REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+    def fmt(low, high):
+        high = "inf" if high == sre_constants.MAXREPEAT else high
+        return "{%s,%s}" % (low, high)
+    def subpatterns(op, av):
+        if op in REPEATS:
+            return [av[2]]
+        if op == sre_constants.SUBPATTERN:
+            return [av[-1]]
+        if op == sre_constants.BRANCH:
+            return av[1]
+        if op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            return [av[1]]
+        return []
+    def contains_repeat(sub):
+        for op, av in sub:
+            if op in REPEATS and av[0] != av[1]:
+                return True
+            if any(contains_repeat(s) for s in subpatterns(op, av)):
+                return True
+        return False
+    found = []
+    def walk(sub):
+        for op, av in sub:
+            if op in REPEATS and av[1] > 1 and contains_repeat(av[2]):
+                found.append(fmt(av[0], av[1]))
+            for s in subpatterns(op, av):
+                walk(s)
+    walk(sre_parse.parse(pattern, flags))
+    return found
+
+
+def reverse_finditer(finditer, text, start=0, end=None, size=64 * 1024,
+                     overlap=1024):
+    """Generate regex matches from end toward start (nearest first)
+
+    The result is like ``reversed(list(finditer(text, start, end)))``, but
+    text is scanned in windows of size characters, beginning with the
+    window at the end of the range. Memory use is proportional to the
+    window size, and the time to find the first match is proportional to
+    its distance from end (plus a window).
+
+    A forward scan that starts in the middle of the text may not find the
+    same matches as a scan from the start (it may begin inside a match).
+    Therefore the matches found in a window are generated only after the
+    scan of the previous window has continued into it and confirmed them
+    (or found other matches in their place). Matches that begin in the
+    overlap at the start of a window and do not extend beyond it are left
+    to the previous window. The overlap grows to the length of the longest
+    match seen. Matches still differ from those of a forward scan if they
+    are chained (each beginning where the last ended) through a whole
+    window, but they are real matches, generated in order.
+
+    :param finditer: A function like ``regex.finditer``; it is called with
+    ``(text, pos, endpos)``.
+    :param size: The size of a window.
+    :param overlap: The (initial) size of the overlap.
+    """
+    if end is None:
+        end = len(text)
+    limit = end + 1 # empty matches may begin at end
+    later = []      # matches (beginning at or after limit) to be confirmed
+    later_limit = limit
+    while True:
+        size = max(size, overlap * 2)
+        window = max(start, limit - size)
+        safe = window if window == start else window + overlap
+        found = []
+        confirmed = []
+        pos = 0 # index of the first unconfirmed match in later
+        for match in finditer(text, window, end):
+            overlap = max(overlap, match.end() - match.start())
+            if match.start() < limit:
+                if match.start() >= safe or match.end() > safe:
+                    found.append(match)
+                continue
+            if match.start() >= later_limit:
+                break
+            while pos < len(later) and later[pos].start() < match.start():
+                pos += 1 # not found by this scan
+            if pos < len(later) and later[pos].span() == match.span():
+                # the scans agree from here on
+                confirmed.extend(later[pos:])
+                break
+            confirmed.append(match)
+        for match in reversed(confirmed):
+            yield match
+        if window == start:
+            for match in reversed(found):
+                yield match
+            break
+        later = found
+        later_limit = limit
+        limit = min(safe, found[0].start()) if found else safe
+
+
+def iter_matches(finditer, text, location, length, backward=False, wrap=False):
+    """Generate matches in the order in which the find panel visits them
+
+    The range ``(location, length)`` of text is searched. If length is zero
+    the text is searched from location to its end (or to its start if
+    backward) and then, if wrap is true, from the other end of the text
+    back to location. None is generated when the search wraps.
+
+    :param finditer: A function like ``regex.finditer`` (see
+    reverse_finditer).
+    """
+    end = location + length
+    wrapped = False
+    while True:
+        if length > 0:
+            bounds = (location, end)
+        elif wrapped == backward:
+            bounds = (location, len(text))
+        else:
+            bounds = (0, location)
+        if backward:
+            matches = reverse_finditer(finditer, text, *bounds)
+        else:
+            matches = finditer(text, *bounds)
+        for match in matches:
+            yield match
+        if wrap and not wrapped and length == 0:
+            yield None
+            wrapped = True
+        else:
+            break
+
+
+class SearchJob(object):
+    """A search that runs in a child process
+
+    ``func(progress, finditer, text, *args)`` is called in a child process,
+    where finditer is ``regex.finditer``. The child is a new Python process
+    (see command) rather than a fork of this one, which would not be safe in
+    a Cocoa application. func, regex, text and args are pickled and sent to
+    it; func must be importable (like count_matches). The search calls
+    ``progress(done, count)`` as it goes (done is a number between 0 and 1,
+    count is the number of matches so far); reports are sent back at most
+    every interval seconds. The result of func is sent back when it returns.
+
+    The child is terminated if the job is canceled or if it runs longer
+    than timeout seconds. A thread could not be stopped while the re module
+    is matching (which may take forever if the expression backtracks
+    catastrophically), and it would hold the interpreter lock meanwhile.
+
+    The child is run by a worker thread of this process, which calls
+    ``callback(job)`` when the job is finished; its result (or error) is set
+    by then.
+    """
+
+    command = [sys.executable, "-m", "editxt.search"]
+    interval = 0.1
+
+    def __init__(self, func, regex, text, args=(), timeout=None,
+                 callback=None):
+        self.func = func
+        self.regex = regex
+        self.text = text
+        self.args = args
+        self.timeout = timeout
+        self.callback = callback
+        self.progress = (0.0, 0)
+        self.result = None
+        self.error = None
+        self.finished = False
+        self._process = None
+        self._thread = None
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        if self.finished:
+            state = "error: %s" % self.error if self.error else "done"
+        else:
+            state = "%i%%" % (self.progress[0] * 100)
+        return "<%s %s %s>" % (type(self).__name__,
+            getattr(self.func, "__name__", self.func), state)
+
+    def start(self):
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        self.started = time.time()
+        self._process = subprocess.Popen(self.command, env=env,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, close_fds=True)
+        self._thread = thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+        if self.timeout is not None:
+            self._timer = timer = threading.Timer(
+                self.timeout, self._stop, ("timed out",))
+            timer.daemon = True
+            timer.start()
+
+    def _run(self):
+        """Send the search to the child and receive its reports
+
+        This runs in a worker thread; reading from the child does not hold
+        the interpreter lock.
+        """
+        process = self._process
+        result = error = None
+        try:
+            search = (self.func, self.regex, unicode(self.text), self.args,
+                      self.interval)
+            cPickle.dump(search, process.stdin, 2)
+            process.stdin.close()
+            while True:
+                kind, value = cPickle.load(process.stdout)
+                if kind == "progress":
+                    self.progress = value
+                    continue
+                if kind == "done":
+                    result = value
+                else:
+                    error = value
+                break
+        except (EOFError, IOError, cPickle.UnpicklingError):
+            error = "search process exited"
+        except Exception, err:
+            log.error("search failed", exc_info=True)
+            error = str(err) or type(err).__name__
+        process.stdout.close()
+        process.wait()
+        if self._timer is not None:
+            self._timer.cancel()
+        with self._lock:
+            if self.error is None and self.timeout is not None and \
+                    time.time() - self.started > self.timeout:
+                self.error = "timed out"
+            if self.error is None:
+                self.error = error
+                self.result = result
+            self.finished = True
+        if self.callback is not None:
+            self.callback(self)
+
+    def join(self, timeout=None):
+        """Wait for the search to finish
+
+        :returns: True if the job is finished, otherwise False.
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.finished
+
+    def cancel(self):
+        """Stop the search (if it is running)"""
+        self._stop("canceled")
+
+    def _stop(self, error):
+        with self._lock:
+            if self.finished or self.error is not None:
+                return
+            self.error = error
+        try:
+            self._process.terminate()
+        except OSError:
+            pass # the process has exited
+
+
+def serve(infile, outfile):
+    """Run a search sent by SearchJob (in the child process)"""
+    func, regex, text, args, interval = cPickle.load(infile)
+    def send(kind, value):
+        cPickle.dump((kind, value), outfile, 2)
+        outfile.flush()
+    reported = [time.time()]
+    def progress(done, count=0):
+        now = time.time()
+        if now - reported[0] >= interval:
+            reported[0] = now
+            send("progress", (done, count))
+    try:
+        result = func(progress, regex.finditer, text, *args)
+    except Exception, err:
+        log.error("search failed", exc_info=True)
+        send("error", str(err) or type(err).__name__)
+    else:
+        send("done", result)
+
+
+def count_matches(progress, finditer, text, start, end):
+    """Count the matches in a range of text (see SearchJob)
+
+    :param finditer: A function like ``regex.finditer``.
+    """
+    count = 0
+    span = float(max(end - start, 1))
+    for match in finditer(text, start, end):
+        count += 1
+        progress((match.end() - start) / span, count)
+    return count
+
+
+def find_match(progress, finditer, text, selection, backward=False,
+               wrap=False):
+    """Find the match nearest to the selection (see SearchJob)
+
+    The search begins at the start of the selection (see iter_matches).
+    A match of the selected text is skipped.
+
+    :param selection: A tuple ``(location, length)``.
+    :returns: The span ``(start, end)`` of the match or None.
+    """
+    location, length = selection
+    selected = (location, location + length)
+    for i, match in enumerate(iter_matches(
+            finditer, text, location, 0, backward, wrap)):
+        if match is None:
+            continue
+        if i == 0 and match.span() == selected:
+            continue # find next
+        return match.span()
+    return None
+
+
+def replace_matches(progress, finditer, text, start, end, replacement,
+                    expand=False):
+    """Get replacements for the matches in a range of text (see SearchJob)
+
+    :param expand: Expand backreferences in replacement (see
+    ``match.expand``).
+    :returns: A list of ``(start, end, value)`` tuples.
+    """
+    items = []
+    span = float(max(end - start, 1))
+    for match in finditer(text, start, end):
+        value = replacement
+        if expand:
+            try:
+                value = match.expand(replacement)
+            except Exception:
+                log.error("error expanding replace expression", exc_info=True)
+        items.append((match.start(), match.end(), value))
+        progress((match.end() - start) / span, len(items))
+    return items
+
+
+if __name__ == "__main__":
+    logging.basicConfig()
+    # reports are sent on stdout; anything else printed goes to stderr
+    outfile = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    sys.stdout = sys.stderr
+    serve(sys.stdin, outfile)
@@ -28,6 +28,7 @@ from Foundation import *
 
 import editxt.constants as const
 from editxt.commandbase import SheetController
+from editxt.search import pattern_cache
 from editxt.textcommand import iterlines
 
 log = logging.getLogger(__name__)
@@ -54,7 +55,7 @@ class SortLinesController(SheetController):
 
 def sortlines(textview, opts):
     text = textview.string()
-    regex = re.compile(opts.search_pattern) if opts.regex_sort else None
+    regex = pattern_cache.compile(opts.search_pattern) if opts.regex_sort else None
     if opts.match_pattern:
         groups = [int(g.strip()) for g in opts.match_pattern.split("\\") if g.strip()]
     else:
@@ -79,7 +80,8 @@ def sortlines(textview, opts):
         range = text.lineRangeForRange_(textview.selectedRange())
     else:
         range = (0, len(text))
-    output = "".join(sorted(iterlines(text, range), key=key, reverse=opts.reverse_sort))
+    lines = iterlines(text, range, textview.doc_view.document.line_index)
+    output = "".join(sorted(lines, key=key, reverse=opts.reverse_sort))
     if textview.shouldChangeTextInRange_replacementString_(range, output):
         textview.textStorage().replaceCharactersInRange_withString_(range, output)
         textview.didChangeText()
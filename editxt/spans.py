@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2012 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+"""Compact storage for non-overlapping text spans"""
+import logging
+from array import array
+from bisect import bisect_right
+
+log = logging.getLogger(__name__)
+
+
+class OffsetArray(object):
+    """Sorted array of text offsets that are shifted lazily after edits
+
+    Offsets at or beyond the pivot index are offset by a pending delta,
+    which is applied (to the offsets between the old and the new pivot)
+    only when a later shift moves the pivot. Consecutive edits at the same
+    place in the text are cheap.
+
+    Indexing returns shifted offsets. The (partly unshifted) array is
+    values. Owners keep other values of each offset in parallel sequences,
+    which they update when offsets are inserted or deleted.
+    """
+
+    def __init__(self, values=None):
+        self.values = array("i") if values is None else values
+        self._pivot = 0
+        self._delta = 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        if i >= self._pivot:
+            return self.values[i] + self._delta
+        return self.values[i]
+
+    def __setitem__(self, i, value):
+        if i >= self._pivot:
+            value -= self._delta
+        self.values[i] = value
+
+    def __repr__(self):
+        return "<%s %r>" % (type(self).__name__,
+            [self[i] for i in xrange(len(self))])
+
+    def bisect(self, index):
+        """Get the number of offsets that are less than or equal to index"""
+        values = self.values
+        pivot = self._pivot
+        i = bisect_right(values, index, 0, pivot)
+        if i == pivot:
+            i = bisect_right(values, index - self._delta, pivot, len(values))
+        return i
+
+    def insert(self, i, offsets):
+        """Insert a sorted sequence of offsets before index i"""
+        if i < self._pivot:
+            self._pivot += len(offsets)
+        elif self._delta:
+            delta = self._delta
+            offsets = [value - delta for value in offsets]
+        self.values[i:i] = array("i", offsets)
+
+    def delete(self, lo, hi):
+        """Delete the offsets at indexes lo through hi - 1"""
+        if hi <= lo:
+            return
+        del self.values[lo:hi]
+        if hi <= self._pivot:
+            self._pivot -= hi - lo
+        elif lo < self._pivot:
+            self._pivot = lo
+
+    def shift(self, i, delta):
+        """Shift offsets at index i and beyond by delta"""
+        pivot = self._pivot
+        pending = self._delta
+        if pending:
+            values = self.values
+            if pivot < i:
+                lo, hi, apply = pivot, i, pending
+            else:
+                lo, hi, apply = i, pivot, delta
+            for j in xrange(lo, hi):
+                values[j] += apply
+            i = hi
+        self._pivot = i
+        self._delta = pending + delta
+
+    def flush(self):
+        """Apply the pending delta
+
+        :returns: The array of offsets (values).
+        """
+        self.shift(len(self.values), 0)
+        return self.values
+
+
+class SpanStore(object):
+    """Sorted list of non-overlapping spans (start, length, info)
+
+    Spans are kept in parallel arrays of start offsets, lengths and info ids,
+    so memory use grows with the number of spans rather than with the length
+    of the text. Info values (syntax group names) are interned; each distinct
+    value is stored once.
+
+    Start offsets are shifted lazily after an edit (see OffsetArray).
+    """
+
+    def __init__(self):
+        self.starts = OffsetArray()
+        self.lengths = array("i")
+        self.ids = array("i")
+        self.infos = []
+        self._info_ids = {}
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        infos = self.infos
+        starts = self.starts
+        for i in xrange(len(starts)):
+            yield starts[i], self.lengths[i], infos[self.ids[i]]
+
+    def __repr__(self):
+        return "<%s %r>" % (type(self).__name__, list(self))
+
+    def reset(self):
+        """Remove all spans"""
+        self.starts = OffsetArray()
+        del self.lengths[:]
+        del self.ids[:]
+        del self.infos[:]
+        self._info_ids.clear()
+
+    def get(self, index):
+        """Get the span that contains index
+
+        :returns: A tuple (start, length, info) or None if index is not
+        inside a span.
+        """
+        i = self.starts.bisect(index) - 1
+        if i < 0:
+            return None
+        start = self.starts[i]
+        length = self.lengths[i]
+        if index < start + length:
+            return start, length, self.infos[self.ids[i]]
+        return None
+
+    def overlapping(self, start, length):
+        """Generate spans (start, length, info) that overlap the given range"""
+        if length <= 0:
+            return
+        end = start + length
+        i = max(self.starts.bisect(start) - 1, 0)
+        infos = self.infos
+        for i in xrange(i, len(self.starts)):
+            istart = self.starts[i]
+            if istart >= end:
+                break
+            ilength = self.lengths[i]
+            if istart + ilength > start:
+                yield istart, ilength, infos[self.ids[i]]
+
+    def set(self, start, length, info):
+        """Add a span, replacing anything in the range it covers"""
+        self.clear(start, length)
+        if length <= 0:
+            return
+        try:
+            ident = self._info_ids[info]
+        except KeyError:
+            ident = self._info_ids[info] = len(self.infos)
+            self.infos.append(info)
+        self._insert(self.starts.bisect(start), start, length, ident)
+
+    def clear(self, start, length):
+        """Remove spans in the given range
+
+        Spans that overlap either end of the range are truncated.
+        """
+        if length <= 0:
+            return
+        end = start + length
+        lo = self.starts.bisect(start - 1)
+        if lo > 0:
+            i = lo - 1
+            istart = self.starts[i]
+            iend = istart + self.lengths[i]
+            if iend > start:
+                self.lengths[i] = start - istart
+                if iend > end:
+                    # the range is in the middle of a span: split it
+                    self._insert(lo, end, iend - end, self.ids[i])
+                    return
+        hi = self.starts.bisect(end - 1)
+        if hi > lo:
+            i = hi - 1
+            istart = self.starts[i]
+            iend = istart + self.lengths[i]
+            if iend > end:
+                # keep the tail of the last span
+                self.starts[i] = end
+                self.lengths[i] = iend - end
+                hi -= 1
+            self._delete(lo, hi)
+
+    def adjust(self, index, changelen):
+        """Adjust spans for text inserted or deleted at index
+
+        Inserted text is included in the span that contains index (if any).
+        Deleted text takes the spans that overlap it or that contain index
+        with it; those spans should be rescanned.
+
+        :returns: A tuple (start, length); the range of changed text, which
+        includes spans that were removed.
+        """
+        if changelen > 0:
+            i = self.starts.bisect(index - 1)
+            if i > 0:
+                start = self.starts[i - 1]
+                if start < index < start + self.lengths[i - 1]:
+                    self.lengths[i - 1] += changelen
+            self.starts.shift(i, changelen)
+            return index, changelen
+        if changelen == 0:
+            return index, 0
+        end = index - changelen
+        start = newend = index
+        lo = self.starts.bisect(index)
+        if lo > 0 and self.starts[lo - 1] + self.lengths[lo - 1] > index:
+            lo -= 1
+            start = self.starts[lo]
+        hi = self.starts.bisect(end - 1)
+        if hi > lo:
+            last = self.starts[hi - 1] + self.lengths[hi - 1]
+            if last > end:
+                newend = index + last - end
+        self._delete(lo, hi)
+        self.starts.shift(lo, changelen)
+        return start, newend - start
+
+    def arrays(self):
+        """Get the arrays (starts, lengths, ids) and the list of infos
+
+        Pending offsets are applied first. The result is shared with this
+        store, and must not be modified.
+        """
+        return self.starts.flush(), self.lengths, self.ids, self.infos
+
+    @classmethod
+    def from_arrays(cls, starts, lengths, ids, infos):
+        """Create a store with arrays returned by SpanStore.arrays"""
+        store = cls()
+        store.starts = OffsetArray(starts)
+        store.lengths = lengths
+        store.ids = ids
+        store.infos = list(infos)
+        store._info_ids = dict((info, i) for i, info in enumerate(infos))
+        return store
+
+    # internal helpers
+
+    def _insert(self, i, start, length, ident):
+        self.starts.insert(i, [start])
+        self.lengths.insert(i, length)
+        self.ids.insert(i, ident)
+
+    def _delete(self, lo, hi):
+        if hi <= lo:
+            return
+        self.starts.delete(lo, hi)
+        del self.lengths[lo:hi]
+        del self.ids[lo:hi]
@@ -17,14 +17,27 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import with_statement
+
+import ast
 import glob
+import hashlib
+import cPickle as pickle
+import json
 import logging
+import mmap
 import os
 import re
 import string
-from fnmatch import fnmatch
+import struct
+import sys
+import time
+from array import array
+from collections import OrderedDict
+from fnmatch import translate
 from itertools import chain, izip, count
 
+import objc
 from AppKit import *
 from Foundation import NSRange, NSUnionRange
 
@@ -33,11 +46,14 @@ from Foundation import NSRange, NSUnionRange
 # from pygments.styles import get_style_by_name
 
 import editxt.constants as const
+from editxt.attrsink import AttributeSink, ColorRuns
+from editxt.spans import SpanStore
 
 log = logging.getLogger(__name__)
 
 
 SYNTAX_RANGE_ATTRIBUTE = u"SYNTAX_RANGE_ATTRIBUTE"
+LONG_LINE = "long line" # name of the uncolored part of a long line
 
 class Error(Exception): pass
 class StopHighlight(Error): pass
@@ -45,15 +61,38 @@ class StopHighlight(Error): pass
 
 class SyntaxFactory():
 
-    def __init__(self):
+    def __init__(self, cache=None):
+        """Syntax definition factory
+
+        :param cache: A DefinitionCache or None.
+        """
         self.registry = {"*.txt": PLAIN_TEXT}
         self.definitions = [PLAIN_TEXT]
+        self.cache = cache
+        self.paths = [] # directories from which definitions were loaded
+        self.sources = OrderedDict() # filename -> definition (load order)
+        self.invalidate()
+
+    def invalidate(self):
+        """Discard the filename pattern index and cached lookups
+
+        This must be called after self.registry is modified.
+        """
+        self._index = None
+        self._lookups = OrderedDict()
 
     def load_definitions(self, path):
+        self.invalidate()
+        if path and path not in self.paths:
+            self.paths.append(path)
         if path and os.path.exists(path):
-            for filename in glob.glob(os.path.join(path, "*" + const.SYNTAX_DEF_EXTENSION)):
+            filenames = glob.glob(os.path.join(path, "*" + const.SYNTAX_DEF_EXTENSION))
+            if self.cache is not None:
+                self.cache.prune(path, filenames)
+            for filename in filenames:
                 try:
-                    sdef = self.load_definition(filename)
+                    sdef = self.read_definition(filename)
+                    self.sources[filename] = sdef
                     if not sdef.disabled:
                         overrides = []
                         for pattern in sdef.filepatterns:
@@ -71,15 +110,159 @@ class SyntaxFactory():
                     stat.append(filename)
                     log.info("syntax definition: %s", " ".join(stat))
 
+    def file_status(self):
+        """Get the status of the definition files in self.paths
+
+        :returns: A dict mapping each filename to a tuple
+        ``(modification time, size)``.
+        """
+        status = {}
+        for path in self.paths:
+            pattern = os.path.join(path, "*" + const.SYNTAX_DEF_EXTENSION)
+            for filename in glob.glob(pattern):
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    continue # removed since glob
+                status[filename] = (stat.st_mtime, stat.st_size)
+        return status
+
+    def reload_definitions(self, filenames):
+        """Reload the definitions of files that were changed, added or removed
+
+        Only the given files are read (or executed) again. The registry is
+        rebuilt (definitions in later paths still override those in earlier
+        paths) and definitions that nested a replaced definition are linked
+        to its replacement.
+
+        :returns: A dict mapping each replaced definition to its
+        replacement, which is None if the file was removed or the
+        definition was disabled. A definition whose nested definitions
+        were replaced maps to itself.
+        """
+        if not filenames:
+            return {}
+        sources = self.sources
+        replaced = {}
+        for filename in filenames:
+            old = sources.get(filename)
+            if os.path.exists(filename):
+                try:
+                    if old is None or (isinstance(old, LazySyntaxDefinition)
+                                       and not old.loaded):
+                        new = self.read_definition(filename)
+                    else:
+                        new = self.load_definition(filename)
+                except Exception:
+                    log.error("error reloading syntax definition: %s",
+                        filename, exc_info=True)
+                    continue
+                sources[filename] = new
+                log.info("syntax definition reloaded: %s %s", new.name, filename)
+            else:
+                if sources.pop(filename, None) is None:
+                    continue
+                new = None
+                log.info("syntax definition removed: %s", filename)
+            if old is not None:
+                replaced[old] = None if new is None or new.disabled else new
+        registry = self.registry
+        registry.clear()
+        registry["*.txt"] = PLAIN_TEXT
+        for path in self.paths:
+            for filename, sdef in sources.iteritems():
+                if os.path.dirname(filename) == path.rstrip(os.sep) \
+                        and not sdef.disabled:
+                    for pattern in sdef.filepatterns:
+                        registry[pattern] = sdef
+        self.invalidate()
+        self.index_definitions()
+        def unloaded(sdef):
+            return isinstance(sdef, LazySyntaxDefinition) and not sdef.loaded
+        fresh = set(new for new in replaced.itervalues() if new is not None)
+        for new in fresh:
+            if not unloaded(new):
+                self.link_nested(new)
+        changed = True
+        while changed:
+            changed = False
+            for sdef in sources.itervalues():
+                if sdef in replaced or sdef in fresh or unloaded(sdef):
+                    continue
+                nested = getattr(sdef, "nested", None) or {}
+                if any(value in replaced for value in nested.itervalues()):
+                    self.link_nested(sdef)
+                    replaced[sdef] = sdef
+                    changed = True
+        return replaced
+
+    def read_definition(self, filename):
+        """Read a syntax definition without compiling it if possible
+
+        :returns: A LazySyntaxDefinition if the name and file patterns of
+        the definition are in the cache or can be read without executing
+        the file (they are assigned literal values). Otherwise the loaded
+        definition.
+        """
+        cache = self.cache
+        if cache is not None:
+            mtime = os.stat(filename).st_mtime
+            header = cache.get_header(filename, mtime)
+            if header is not None:
+                return LazySyntaxDefinition(self, filename, **header)
+        with open(filename) as fh:
+            source = fh.read()
+        header = {}
+        for node in ast.parse(source, filename).body:
+            if isinstance(node, (ast.ClassDef, ast.FunctionDef)):
+                names = [node.name]
+            elif isinstance(node, ast.Assign):
+                names = [t.id for t in node.targets if isinstance(t, ast.Name)]
+            else:
+                continue
+            if "SyntaxDefinition" in names:
+                break # custom definition type
+            if LazySyntaxDefinition.header_names.intersection(names):
+                try:
+                    value = ast.literal_eval(node.value)
+                except ValueError:
+                    break # header value is not a literal
+                for name in names:
+                    header[name] = value
+        else:
+            if "name" in header and "filepatterns" in header:
+                header = dict((name, value) for name, value in header.iteritems()
+                              if name in LazySyntaxDefinition.header_names)
+                if cache is not None:
+                    cache.set_header(filename, mtime, header)
+                return LazySyntaxDefinition(self, filename, **header)
+        sdef = self.load_definition(filename)
+        if cache is not None:
+            cache.set_header(filename, mtime, dict(name=sdef.name,
+                filepatterns=sdef.filepatterns, disabled=sdef.disabled))
+        return sdef
+
     def load_definition(self, filename):
+        cache = self.cache
+        if cache is not None:
+            mtime = os.stat(filename).st_mtime
+            sdef = cache.get_definition(filename, mtime)
+            if sdef is not None:
+                return sdef
         ns = {"RE": RE}
         execfile(filename, ns)
         ns.pop("RE", None)
         ns.pop("__builtins__", None)
         factory = ns.pop("SyntaxDefinition", SyntaxDefinition)
-        return factory(filename, **ns)
+        sdef = factory(filename, **ns)
+        if cache is not None:
+            cache.set_definition(filename, mtime, sdef)
+        return sdef
 
     def index_definitions(self):
+        self.invalidate()
+        if self.cache is not None:
+            self.cache.save()
         unique = dict((id(sd), sd) for sd in self.registry.itervalues())
         defs = sorted(unique.itervalues(), key=lambda d:(d.name, id(d)))
         self.definitions[:] = defs
@@ -87,137 +270,1032 @@ class SyntaxFactory():
         sd.update_definitions(defs)
 
     def get_definition(self, filename):
-        for pattern, sdef in self.registry.iteritems():
-            if fnmatch(filename, pattern):
+        """Get the syntax definition for the given filename
+
+        If more than one filename pattern matches, the most specific
+        pattern wins: the one with the most characters that must be matched
+        literally (not by a wildcard). Ties are broken by comparing the
+        patterns as strings. Results are cached by filename.
+        """
+        lookups = self._lookups
+        try:
+            sdef = lookups.pop(filename)
+        except KeyError:
+            sdef = self._find_definition(filename)
+            if isinstance(sdef, LazySyntaxDefinition) and not sdef.loaded:
+                sdef.load()
+                if self.cache is not None:
+                    self.cache.save()
+            self.link_nested(sdef)
+            if len(lookups) >= const.SYNTAX_LOOKUP_CACHE_SIZE:
+                lookups.popitem(last=False)
+        lookups[filename] = sdef
+        return sdef
+
+    def get_nested_definition(self, name):
+        """Get a definition by name or file extension (case-insensitive)
+
+        :returns: The definition or None if it was not found.
+        """
+        key = name.lower()
+        for sdef in self.registry.itervalues():
+            if sdef.name.lower() == key:
                 return sdef
-        return PLAIN_TEXT
+        sdef = self._find_definition("." + key)
+        return None if sdef is PLAIN_TEXT else sdef
+
+    def link_nested(self, sdef, seen=None):
+        """Resolve the names of the nested definitions of sdef
+
+        Nested definitions are linked as well (recursively).
+        """
+        if not hasattr(sdef, "embedded"):
+            return
+        if seen is None:
+            seen = set()
+        if id(sdef) in seen:
+            return
+        seen.add(id(sdef))
+        nested = sdef.nested
+        for group, value in sdef.embedded.iteritems():
+            if isinstance(value, basestring):
+                found = self.get_nested_definition(value)
+                if found is None:
+                    log.warn("nested syntax definition not found: %s (in %s)",
+                        value, sdef.name)
+                    nested.pop(group, None)
+                    continue
+                nested[group] = value = found
+            self.link_nested(value, seen)
+
+    def _find_definition(self, filename):
+        if self._index is None:
+            self._index = self._build_index()
+        names, extensions, globxp, globs = self._index
+        matches = []
+        if filename in names:
+            matches.append(names[filename])
+        i = filename.find(".")
+        while i >= 0:
+            # the longest matching extension is the most specific
+            ext = filename[i + 1:]
+            if ext in extensions:
+                matches.append(extensions[ext])
+                break
+            i = filename.find(".", i + 1)
+        if globxp is not None:
+            match = globxp.match(filename)
+            if match is not None:
+                matches.append(globs[match.lastgroup])
+        if not matches:
+            return PLAIN_TEXT
+        return min(matches)[2]
+
+    def _build_index(self):
+        """Build an index of filename patterns
+
+        :returns: A tuple ``(names, extensions, globxp, globs)``.
+        ``names`` maps literal filenames (patterns without wildcards) and
+        ``extensions`` maps extensions (of ``*.ext`` patterns) to
+        ``(key, pattern, sdef)`` tuples, which sort in order of
+        precedence. ``globxp`` is a regular expression that matches any
+        other pattern, with a group (in order of precedence) for each
+        pattern; ``globs`` maps group names to ``(key, pattern, sdef)``.
+        """
+        wildcard = re.compile(r"[*?[]")
+        names = {}
+        extensions = {}
+        globs = {}
+        others = []
+        for pattern, sdef in self.registry.iteritems():
+            literal = len(re.sub(r"\[[^]]*\]?|[*?]", "", pattern))
+            item = (-literal, pattern, sdef)
+            if not wildcard.search(pattern):
+                names[pattern] = item
+            elif pattern.startswith("*.") and not wildcard.search(pattern[2:]):
+                extensions[pattern[2:]] = item
+            else:
+                others.append(item)
+        if others:
+            others.sort()
+            parts = []
+            for i, item in enumerate(others):
+                name = "g%i" % i
+                globs[name] = item
+                parts.append("(?P<%s>%s)" % (name, translate(item[1])))
+            globxp = re.compile("|".join(parts))
+        else:
+            globxp = None
+        return names, extensions, globxp, globs
+
+
+class DefinitionCache(object):
+    """Persistent cache of syntax definitions
+
+    Entries are keyed by definition filename, and are valid as long as the
+    modification time of the file is unchanged. The entire cache is
+    discarded when the EditXT version changes. An entry holds the header
+    (name, file patterns and disabled flag) of a definition and, once the
+    definition has been loaded, the pickled definition, which is unpickled
+    (and its regular expressions compiled) only when it is used.
+    """
+
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version
+        self._entries = None
+        self.dirty = False
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            self._entries = {}
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path, "rb") as fh:
+                        version, entries = pickle.load(fh)
+                except Exception:
+                    log.warn("cannot read syntax definition cache: %s",
+                        self.path, exc_info=True)
+                else:
+                    if version == self.version:
+                        self._entries = entries
+        return self._entries
+
+    def get_header(self, filename, mtime):
+        entry = self.entries.get(filename)
+        if entry is None or entry[0] != mtime:
+            return None
+        return entry[1]
+
+    def set_header(self, filename, mtime, header):
+        header = dict(header, filepatterns=list(header["filepatterns"]))
+        entry = self.entries.get(filename)
+        if entry is None or entry[0] != mtime or entry[1] != header:
+            self.entries[filename] = (mtime, header, None)
+            self.dirty = True
+
+    def get_definition(self, filename, mtime):
+        entry = self.entries.get(filename)
+        if entry is None or entry[0] != mtime or entry[2] is None:
+            return None
+        try:
+            return pickle.loads(entry[2])
+        except Exception:
+            log.warn("cannot unpickle syntax definition: %s",
+                filename, exc_info=True)
+            return None
+
+    def set_definition(self, filename, mtime, sdef):
+        try:
+            data = pickle.dumps(sdef, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            log.debug("cannot pickle syntax definition: %s",
+                filename, exc_info=True)
+            data = None
+        header = dict(name=sdef.name, filepatterns=list(sdef.filepatterns),
+                      disabled=sdef.disabled)
+        self.entries[filename] = (mtime, header, data)
+        self.dirty = True
+
+    def prune(self, path, filenames):
+        """Remove entries for files in path other than the given filenames"""
+        keep = set(filenames)
+        path = os.path.normpath(path)
+        entries = self.entries
+        for filename in list(entries):
+            if os.path.dirname(filename) == path and filename not in keep:
+                del entries[filename]
+                self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        temp = self.path + ".tmp"
+        try:
+            dirpath = os.path.dirname(self.path)
+            if not os.path.exists(dirpath):
+                os.makedirs(dirpath)
+            with open(temp, "wb") as fh:
+                pickle.dump((self.version, self.entries), fh,
+                    pickle.HIGHEST_PROTOCOL)
+            os.rename(temp, self.path)
+        except Exception:
+            log.warn("cannot save syntax definition cache: %s",
+                self.path, exc_info=True)
+        else:
+            self.dirty = False
+
+
+def unicode_path(path):
+    """Get a file path as unicode (byte strings are decoded as UTF-8)"""
+    if isinstance(path, str):
+        return path.decode("utf-8")
+    return path
+
+
+class HighlightCache(object):
+    """Persistent cache of the token spans of colored documents
+
+    The spans of each document are saved in a separate file, which is named
+    by a hash of the document's path, in the given directory. Saved spans
+    are used only if the size and modification time of the document file,
+    a hash of the text and the syntax definition (its file and the
+    modification time of that file) are unchanged. At most max_files files
+    are kept; the least recently saved files are removed. A file is not
+    written again if its spans are still valid (the document was reopened
+    and closed without changes); its modification time is updated instead.
+
+    File format: a header (magic string, format version, length of the
+    metadata and number of spans), the metadata (JSON: key, hash, infos,
+    item size and byte order), and arrays of span starts, lengths and info
+    ids. Files are read with mmap so the metadata can be checked without
+    reading the spans.
+    """
+
+    magic = "EXHC"
+    version = 1
+    header = struct.Struct("<4sIII")
+
+    def __init__(self, path, max_files=const.HIGHLIGHT_CACHE_FILES):
+        self.path = path
+        self.max_files = max_files
+
+    def filename(self, path):
+        return os.path.join(self.path, hashlib.sha1(
+            unicode_path(path).encode("utf-8")).hexdigest() + ".spans")
+
+    def key(self, path, syntaxdef):
+        # paths are unicode to match the key loaded from JSON
+        stat = os.stat(path)
+        sdfile = getattr(syntaxdef, "filename", None)
+        sdtime = os.stat(sdfile).st_mtime if sdfile else None
+        return [unicode_path(path), stat.st_size, stat.st_mtime,
+                syntaxdef.name, sdfile and unicode_path(sdfile), sdtime]
+
+    def text_hash(self, text):
+        return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+    def load(self, path, text, syntaxdef):
+        """Load the saved spans of a document
+
+        :param path: The path of the document file.
+        :param text: The text of the document.
+        :param syntaxdef: The syntax definition of the document.
+        :returns: A SpanStore or None if there are no valid saved spans.
+        """
+        filename = self.filename(path)
+        if not os.path.exists(filename):
+            return None
+        try:
+            key = self.key(path, syntaxdef)
+            with open(filename, "rb") as fh:
+                data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                meta, pos, count = self._read_meta(data)
+                if not self._is_valid(meta, key, self.text_hash(text)):
+                    return None
+                size = count * meta["itemsize"]
+                arrays = []
+                for i in xrange(3):
+                    values = array("i")
+                    values.fromstring(data[pos:pos + size])
+                    arrays.append(values)
+                    pos += size
+            finally:
+                data.close()
+        except Exception:
+            log.warn("cannot read highlight cache: %s", filename, exc_info=True)
+            return None
+        infos = [str(info) for info in meta["infos"]]
+        return SpanStore.from_arrays(*arrays, infos=infos)
+
+    def _read_meta(self, data):
+        """Read the metadata of a cache file
+
+        :param data: The contents of the file (a string or mmap).
+        :returns: A tuple ``(meta, pos, count)``; the metadata (None if the
+        file has a different format), the index of the first span array in
+        data and the number of spans.
+        """
+        magic, version, metalen, count = self.header.unpack_from(data)
+        if magic != self.magic or version != self.version:
+            return None, None, 0
+        pos = self.header.size
+        meta = json.loads(data[pos:pos + metalen])
+        return meta, pos + metalen, count
+
+    def _is_valid(self, meta, key, texthash):
+        return meta is not None and meta["key"] == key \
+            and meta["itemsize"] == array("i").itemsize \
+            and meta["byteorder"] == sys.byteorder \
+            and meta["hash"] == texthash
+
+    def _is_saved(self, filename, key, texthash):
+        """Check if a cache file contains valid spans for the given key"""
+        if not os.path.exists(filename):
+            return False
+        try:
+            with open(filename, "rb") as fh:
+                data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                meta = self._read_meta(data)[0]
+            finally:
+                data.close()
+        except Exception:
+            return False
+        return self._is_valid(meta, key, texthash)
+
+    def save(self, path, text, syntaxdef, spans):
+        """Save the spans of a document
+
+        :param spans: A SpanStore.
+        """
+        filename = self.filename(path)
+        temp = filename + ".tmp"
+        try:
+            key = self.key(path, syntaxdef)
+            texthash = self.text_hash(text)
+            if self._is_saved(filename, key, texthash):
+                os.utime(filename, None) # recently used (see prune)
+                return
+            starts, lengths, ids, infos = spans.arrays()
+            meta = json.dumps({
+                "key": key,
+                "hash": texthash,
+                "infos": infos,
+                "itemsize": starts.itemsize,
+                "byteorder": sys.byteorder,
+            })
+            if not os.path.exists(self.path):
+                os.makedirs(self.path)
+            with open(temp, "wb") as fh:
+                fh.write(self.header.pack(
+                    self.magic, self.version, len(meta), len(starts)))
+                fh.write(meta)
+                for values in [starts, lengths, ids]:
+                    values.tofile(fh)
+            os.rename(temp, filename)
+            self.prune()
+        except Exception:
+            log.warn("cannot save highlight cache: %s", filename, exc_info=True)
+
+    def prune(self):
+        """Remove the oldest files if there are more than max_files"""
+        names = glob.glob(os.path.join(self.path, "*.spans"))
+        if len(names) <= self.max_files:
+            return
+        names.sort(key=lambda name: os.stat(name).st_mtime)
+        for name in names[:len(names) - self.max_files]:
+            os.remove(name)
 
 
 class SyntaxCache(object):
 
     def __init__(self):
-        self.cache = []
+        self.cache = SpanStore()
+        self.runs = ColorRuns()
+        # called with the text storage and a flag that is true if it is
+        # processing an edit (see TextStorageSink)
+        self.sink_type = TextStorageSink
         self._syntaxdef = PLAIN_TEXT
         self.filename = None
+        # group name -> SyntaxCache of the nested definition of a delimited
+        # range (holds the tokens of all ranges of the group)
+        self.nested = {}
+        self.regions = SpanStore() # text scanned by nested definitions
 
     def _get_syntaxdef(self):
         return self._syntaxdef
     def _set_syntaxdef(self, value):
         if value is not self._syntaxdef:
-            del self.cache[:]
+            self.reset()
             self._syntaxdef = value
     syntaxdef = property(_get_syntaxdef, _set_syntaxdef)
 
-    def color_text(self, ts, minrange=None):
+    def reset(self):
+        """Discard all tokens; the text must be colored again"""
+        self.cache.reset()
+        self.nested = {}
+        self.regions.reset()
+
+    def color_text(self, ts, minrange=None, deadline=None, edits=None):
+        """Color the text in the given text storage
+
+        If minrange is given, rescan the text beginning at the end of the
+        line preceding the (edited) range. Scanning stops at the first line
+        boundary or token boundary beyond the edited range at which the
+        lexer state matches the state recorded by the previous scan (see
+        find_sync).
+
+        :param deadline: Stop scanning (after at least one token has been
+        colored) when time.time() is greater than this value.
+        :param edits: A list of ``(index, length, changelen)`` tuples; the
+        edits (in ascending order, with offsets in the edited text) that
+        make up minrange (see TextDocument.replace_ranges). Each edit is
+        rescanned on its own rather than the entire range.
+
+        The colors of an edit (minrange is not None) are applied while the
+        text storage is processing the edit (see
+        TextDocument.textStorageDidProcessEditing_), so they are not
+        bracketed with beginEditing/endEditing (see TextStorageSink).
+        :returns: None or, if scanning stopped at the deadline, the index of
+        the token boundary at which coloring should be resumed.
+        """
         if ts.editedMask() == NSTextStorageEditedAttributes:
             return # we don't care if only attributes changed
-        sdef = self._syntaxdef
-        if sdef is None:
+        if self._syntaxdef is None:
             return
         text = ts.string()
-        tlen = ts.length()
-
-        if minrange is not None:
-            adjrange = self.adjust(minrange.location, ts.changeInLength())
-            minrange = NSUnionRange(minrange, adjrange)
-            i = minrange.location - 1
-            if i < 0:
-                i = 0
-            else:
-                while i > 0 and text[i] != u"\n":
-                    i -= 1
-            prerange, info = self.get(i)
-            if prerange is None:
-                prerange = NSRange(i, 0)
-            minrange = NSUnionRange(minrange, prerange)
-            minstart = minrange.location
-            minend = minrange.location + minrange.length
-        else:
-            minstart = 0
-            minend = tlen
-
-        def setcolor(color, range, prevend, info, ts=ts, cache=self, minend=minend):
-            prevcache = cache.get(range.location)
-            prevend = max(min(prevend, range.location), 0)
-            rangelen = max((range.location - prevend) + range.length, 0)
-            prevrange = NSRange(prevend, rangelen)
-            cache.clear(prevrange)
-            ts.removeAttribute_range_(NSForegroundColorAttributeName, prevrange)
+
+        if minrange is None:
+            return self._color(ts, text, 0, None, None, deadline=deadline)
+        if edits is None:
+            edits = [(minrange.location, minrange.length, ts.changeInLength())]
+        ranges = []
+        for index, length, changelen in edits:
+            self.runs.text_edited(index, length, changelen)
+            adjrange = self.adjust(index, changelen)
+            start = min(index, adjrange.location)
+            end = max(index + length, adjrange.location + adjrange.length)
+            # earlier ranges were computed before this edit: move (or
+            # extend) their ends beyond it, then merge overlapping ranges
+            merged = []
+            for rstart, rend in ranges:
+                if rend > index:
+                    rend = max(rend + changelen, index + length)
+                if rend >= start:
+                    start = min(start, rstart)
+                    end = max(end, rend)
+                else:
+                    merged.append((rstart, rend))
+            merged.append((start, end))
+            ranges = merged
+        for edit in ranges:
+            minstart, state, minend = self.resume_point(text, *edit)
+            offset = self._color(ts, text, minstart, state, minend,
+                                 deadline=deadline, edit=edit, editing=True)
+            if offset is not None:
+                return offset
+        return None
+
+    def resume_point(self, text, start, end, lower=0, upper=None):
+        """Find the point at which to rescan edited text
+
+        :param start: The start of the edited range.
+        :param end: The end of the edited range.
+        :param lower: The index at which scanning normally begins.
+        :param upper: The index at which scanning normally ends.
+        :returns: A tuple ``(minstart, state, minend)``; the index at which
+        to resume scanning, the lexer state at that index (see line_state)
+        and the index beyond which the scan may rejoin the previous scan.
+        """
+        if upper is None:
+            upper = len(text)
+        minend = end
+        if getattr(self._syntaxdef, "longxp", None) is not None:
+            # the cutoff of a long line depends on the length of the
+            # line, so the rest of the edited line is scanned again
+            lineend = text.find(u"\n", minend, upper)
+            minend = upper if lineend < 0 else lineend
+        # resume at the newline that precedes the edited line (a token
+        # may begin with a newline)
+        minstart = max(text.rfind(u"\n", lower, start), lower)
+        state = self.line_state(minstart)
+        if state is None and minstart > lower:
+            # the end of a token that ends at the newline may depend on
+            # the text that follows it
+            prerange, info = self.get(minstart - 1)
+            if prerange is not None:
+                minstart = prerange.location
+        return minstart, state, minend
+
+    def color_slice(self, ts, offset, limit):
+        """Color part of the text in the given text storage
+
+        Scanning begins at offset, which must be a token boundary (the
+        start of the text or the end of a token colored by a previous scan),
+        and stops before the first token that begins at or beyond limit.
+
+        :returns: The index at which scanning stopped (a token boundary at
+        which scanning may be resumed) or None if the end of the text was
+        reached.
+        """
+        if self._syntaxdef is None:
+            return None
+        return self._color(ts, ts.string(), offset, None, None, limit)
+
+    def restore(self, ts, spans):
+        """Color the text with spans saved by a previous scan
+
+        :param spans: A SpanStore (see HighlightCache.load), which becomes
+        the span cache.
+        """
+        info = self._syntaxdef.wordinfo
+        nested = getattr(self._syntaxdef, "nested", None)
+        runs = self.runs
+        runs.reset()
+        runs.text_edited(0, ts.length(), 0) # colors of the text are unknown
+        self.cache = spans
+        self.nested = {}
+        self.regions.reset()
+        text = ts.string()
+        prevend = 0
+        try:
+            for start, length, name in spans:
+                if prevend < start:
+                    runs.clear(prevend, start - prevend)
+                if nested and name in nested:
+                    self._color_region(text, start, start + length, name)
+                else:
+                    runs.color(start, length, info[name][0])
+                prevend = start + length
+            if prevend < ts.length():
+                runs.clear(prevend, ts.length() - prevend)
+        finally:
+            runs.flush(self.sink_type(ts))
+
+    def color_tokens(self, ts, tokens, prevend):
+        """Color tokens produced by a scan of a copy of the text
+
+        :param tokens: A sequence of ``(color, start, length, info)`` tuples
+        in the order they were passed to setcolor by SyntaxDefinition.scan.
+        :param prevend: The end of the token preceding the first token.
+        :returns: The end of the last token.
+        """
+        runs = self.runs
+        nested = getattr(self._syntaxdef, "nested", None)
+        text = ts.string() if nested else None
+        try:
+            for color, start, length, info in tokens:
+                if prevend < start:
+                    runs.clear(prevend, start - prevend)
+                    self._clear(prevend, start - prevend)
+                if color is not None and length > 0:
+                    self.cache.set(start, length, info)
+                    if nested and info in nested:
+                        self._color_region(text, start, start + length, info)
+                    else:
+                        runs.color(start, length, color)
+                        self._clear_nested(start, length)
+                prevend = max(prevend, start + length)
+        finally:
+            runs.flush(self.sink_type(ts))
+        return prevend
+
+    def _color(self, ts, text, minstart, state, minend, limit=None,
+               deadline=None, edit=None, editing=False):
+        try:
+            return self._scan(text, minstart, state, minend, limit, deadline, edit)
+        finally:
+            self.runs.flush(self.sink_type(ts, editing))
+
+    def _scan(self, text, minstart, state, minend, limit=None, deadline=None,
+              edit=None, region=None):
+        """Scan and color text (see color_text and color_slice)
+
+        :param edit: A tuple ``(start, end)``; the edited range of the text
+        or None if the text was not edited since the previous scan.
+        :param region: A tuple ``(start, end)``; the part of the text to
+        scan (with the syntax definition of this cache) as if it were the
+        entire text. Scan all of the text if None.
+        :returns: The index at which scanning stopped (see color_slice).
+        """
+        textlen = len(text)
+        runs = self.runs
+        spans = self.cache
+        nested = getattr(self._syntaxdef, "nested", None)
+        nested_caches = self.nested
+
+        def setcolor(color, range, prevend, info, cache=self):
+            start = range.location
+            if start < textlen:
+                if limit is not None and start >= limit:
+                    if prevend < start:
+                        runs.clear(prevend, start - prevend)
+                        spans.clear(prevend, start - prevend)
+                    raise StopHighlight(prevend)
+                if deadline is not None and prevend > minstart \
+                        and time.time() > deadline:
+                    raise StopHighlight(prevend)
+            end = start + range.length
+            sync = None
+            if minend is not None and end >= minend:
+                sync = cache.find_sync(text, prevend, start, end, info, minend)
+            if sync is not None and sync <= start:
+                start = sync
+            if prevend < start:
+                runs.clear(prevend, start - prevend)
+                spans.clear(prevend, start - prevend)
+                if nested_caches:
+                    cache._clear_nested(prevend, start - prevend)
+            if sync is not None and sync == start:
+                raise StopHighlight()
             if color is not None:
-                ts.addAttribute_value_range_(NSForegroundColorAttributeName, color, range)
-                cache.set(range, info)
-            if range.location + range.length > minend and (range, info) == prevcache:
+                if nested and info in nested:
+                    cache.set(range, info)
+                    cache._color_region(text, range.location, end, info, edit)
+                else:
+                    cstart = max(prevend, start)
+                    cend = end if sync is None else min(sync, end)
+                    runs.color(cstart, cend - cstart, color)
+                    cache.set(range, info)
+                    if nested_caches:
+                        cache._clear_nested(range.location, range.length)
+            if sync is not None:
                 raise StopHighlight()
 
+        syntaxdef = self._syntaxdef
         try:
-            sdef.scan(text, setcolor, minstart)
-        except StopHighlight:
-            pass
+            if region is None:
+                syntaxdef.scan(text, setcolor, minstart, state)
+            else:
+                rstart, rend = region
+                def shift(color, range, prevend, info):
+                    range = NSRange(range.location + rstart, range.length)
+                    setcolor(color, range, prevend + rstart, info)
+                if state is not None:
+                    state = (state[0], state[1] - rstart)
+                syntaxdef.scan(text[rstart:rend], shift, minstart - rstart, state)
+        except StopHighlight, err:
+            if err.args:
+                return err.args[0]
+        return None
+
+    def _color_region(self, text, start, end, name, edit=None):
+        """Color a delimited range that has a nested syntax definition
+
+        The delimiters are colored with the color of the range, and the
+        text between them is scanned with the nested definition. Tokens of
+        the nested definition are cached separately (see self.nested), so
+        if the text between the delimiters was scanned by the previous scan
+        (and has been changed only by an edit, a tuple ``(start, end)``)
+        only the edited part of it is rescanned; the scan of this text does
+        not depend on the text outside of it.
+        """
+        color, name, startxp, endxp = self._syntaxdef.wordinfo[name]
+        syntaxdef = self._syntaxdef.nested[name]
+        delim = startxp.match(text, start)
+        cstart = start if delim is None else min(delim.end(), end)
+        delim = endxp.search(text, cstart)
+        cend = delim.start() if delim is not None and delim.end() == end else end
+        runs = self.runs
+        regions = self.regions
+        if regions.get(cstart) != (cstart, cend - cstart, name):
+            edit = None
+        regions.clear(start, end - start)
+        regions.set(cstart, cend - cstart, name)
+        sub = self.nested.get(name)
+        if sub is None or sub.syntaxdef is not syntaxdef:
+            sub = self.nested[name] = SyntaxCache()
+            sub.runs = runs
+            sub.syntaxdef = syntaxdef
+            edit = None
+        for other in self.nested.itervalues():
+            if other is not sub:
+                other._clear(start, end - start)
+        sub._clear(start, cstart - start)
+        sub._clear(cend, end - cend)
+        runs.color(start, cstart - start, color)
+        if cstart == start and cend == end:
+            # cannot nest: the range has no delimiters
+            runs.color(start, end - start, color)
+            sub._clear(start, end - start)
+            regions.clear(start, end - start)
+        elif edit is None:
+            sub._clear(cstart, cend - cstart)
+            sub._scan(text, cstart, None, None, region=(cstart, cend))
+        else:
+            estart = max(edit[0], cstart)
+            eend = min(edit[1], cend)
+            if estart <= eend:
+                minstart, state, minend = \
+                    sub.resume_point(text, estart, eend, cstart, cend)
+                sub._scan(text, minstart, state, minend,
+                          edit=(estart, eend), region=(cstart, cend))
+        runs.color(cend, end - cend, color)
+
+    def line_state(self, index):
+        """Get the lexer state at the given (line start) index
+
+        Returns a tuple ``(name, start)`` if the cached token named ``name``
+        that begins at ``start`` (before index) extends over index. Returns
+        None if a scan beginning at index would start in the default state.
+        """
+        range, info = self.get(index)
+        if range is None or range.location >= index:
+            return None
+        return info, range.location
+
+    def find_sync(self, text, prevend, start, end, info, minend):
+        """Find the point at which a new scan rejoins the previous scan
+
+        Consider the region scanned after the previous token (which ended
+        at prevend) up to the end of the token (start, end) named info.
+        Line starts in (prevend, start] are in the default state and line
+        starts in (start, end) are inside the new token. Only points that
+        follow an unedited character (the character at minend or beyond)
+        are considered.
+
+        Return the first index in that region at which the previous scan
+        recorded the same lexer state:
+
+        - a line start outside any token in both scans
+        - a line start inside a token named info that ends at end
+        - end if a token ended at end in the previous scan
+
+        Return None if there is no such point.
+        """
+        i = text.find(u"\n", max(prevend, minend), start)
+        while i >= 0:
+            if self.line_state(i + 1) is None:
+                return i + 1
+            i = text.find(u"\n", i + 1, start)
+        i = text.find(u"\n", max(start, minend), end - 1)
+        while i >= 0:
+            range, oldinfo = self.get(i + 1)
+            if range is not None and range.location <= i:
+                oldend = range.location + range.length
+                if oldinfo == info and oldend == end:
+                    return i + 1
+                i = max(i + 1, oldend - 1)
+            else:
+                i += 1
+            i = text.find(u"\n", i, end - 1)
+        if end > minend and end > 0:
+            range, oldinfo = self.get(end - 1)
+            if range is not None and range.location + range.length == end:
+                return end
+        return None
 
     def adjust(self, index, changelen):
-        if changelen < 0:
-            cache = self.cache
-            del cache[index:index-changelen]
-            start = end = index
-            if index < len(cache):
-                # [(0,3), (1,2), <snip> (1,2), (2,1)]
-
-                # clear overlapping range before adjustment
-                if index > 0:
-                    hit = cache[index - 1]
-                    if hit and hit[1] > 1:
-                        start = index - (hit[0] + 1)
-                        for i in xrange(hit[0] + 1):
-                            if i < 0:
-                                # this should never happen
-                                start = 0
-                                break
-                            cache[index - 1 - i] = None
-
-                # clear overlapping range after adjustment
-                hit = cache[index]
-                if hit and hit[0] > 0:
-                    end = index + hit[1]
-                    for i in xrange(hit[1]):
-                        cache[index + i] = None
-
-            return NSRange(start, end - start)
-        self.cache[index:index] = [None for i in xrange(changelen)]
-        return NSRange(index, changelen)
+        nested = getattr(self._syntaxdef, "nested", None)
+        if not nested:
+            return NSRange(*self.cache.adjust(index, changelen))
+        # a range with a nested definition (and the text between its
+        # delimiters) is kept if it contains the edit, so only the edited
+        # part of it is rescanned
+        def adjust(spans, inner):
+            span = spans.get(index - 1)
+            if span is not None and span[2] in nested:
+                start, length, info = span
+                end = start + length
+                if changelen < 0 and index - changelen < end + inner \
+                        or changelen > 0 and inner and index == end:
+                    spans.clear(start, length)
+                    range = spans.adjust(index, changelen)
+                    spans.set(start, length + changelen, info)
+                    return range
+            return spans.adjust(index, changelen)
+        range = NSRange(*adjust(self.cache, 0))
+        adjust(self.regions, 1)
+        for sub in self.nested.itervalues():
+            range = NSUnionRange(range, sub.adjust(index, changelen))
+        return range
 
     def get(self, index):
-        try:
-            value = self.cache[index]
-        except IndexError:
-            return (None, None)
-        if value is None:
+        span = self.cache.get(index)
+        if span is None:
             return (None, None)
-        return NSRange(index - value[0], value[0] + value[1]), value[2]
+        return NSRange(span[0], span[1]), span[2]
 
     def set(self, range, info):
-        cache = self.cache
-        while range.location > len(cache):
-            cache.append(None)
-        for i in xrange(range.length):
-            try:
-                cache[range.location + i] = (i, range.length - i, info)
-            except IndexError:
-                cache.append((i, range.length - i, info))
+        self.cache.set(range.location, range.length, info)
 
     def clear(self, range):
-        cache = self.cache
-        if range.location + range.length >= len(cache):
-            del cache[range.location:]
+        self._clear(range.location, range.length)
+
+    def _clear(self, start, length):
+        self.cache.clear(start, length)
+        self._clear_nested(start, length)
+
+    def _clear_nested(self, start, length):
+        self.regions.clear(start, length)
+        for sub in self.nested.itervalues():
+            sub._clear(start, length)
+
+
+class TextStorageSink(AttributeSink):
+    """Apply color changes to an NSTextStorage
+
+    :param editing: True if the text storage is processing an edit (its
+    delegate is being notified of the edit). The changes are applied
+    without a beginEditing/endEditing bracket in that case; a nested
+    bracket would make the text storage process editing again.
+    """
+
+    def __init__(self, text_storage, editing=False):
+        self.text_storage = text_storage
+        self.editing = editing
+
+    def begin(self):
+        if not self.editing:
+            self.text_storage.beginEditing()
+
+    def set_color(self, start, length, color):
+        range = NSRange(start, length)
+        if color is None:
+            self.text_storage.removeAttribute_range_(
+                NSForegroundColorAttributeName, range)
+        else:
+            self.text_storage.addAttribute_value_range_(
+                NSForegroundColorAttributeName, color, range)
+
+    def end(self):
+        if not self.editing:
+            self.text_storage.endEditing()
+
+
+class Highlighter(NSObject):
+    """Color a large document in the background
+
+    Tokens are produced by a worker thread, which scans an immutable copy
+    of the text (tagged with a version number) beginning at self.offset.
+    Tokens are sent to the main thread in batches; a batch is applied only
+    if its version is still current (the text has not been edited since the
+    copy was made). Everything before self.offset has been colored.
+
+    Visible ranges are colored first on the main thread, beginning at the
+    start of the first visible line (the result may be corrected when the
+    worker's tokens for that range arrive).
+    """
+
+    batch_size = 1000
+
+    @objc.namedSelector("init:textStorage:offset:")
+    def init(self, syntaxer, text_storage, offset):
+        self = super(Highlighter, self).init()
+        self.syntaxer = syntaxer
+        self.text_storage = text_storage
+        self.offset = offset
+        self.visible = []
+        self.version = 0
+        self.running = True
+        self.start_worker()
+        return self
+
+    def start_worker(self):
+        self.version += 1
+        text = unicode(self.text_storage.string())
+        args = (self.syntaxer.syntaxdef, text, self.offset, self.version)
+        NSThread.detachNewThreadSelector_toTarget_withObject_("tokenize:", self, args)
+
+    def tokenize_(self, args):
+        pool = NSAutoreleasePool.alloc().init()
+        try:
+            def post(batch):
+                self.performSelectorOnMainThread_withObject_waitUntilDone_(
+                    "applyTokens:", batch, False)
+            self.tokenize(post, *args)
+        finally:
+            del pool
+
+    def tokenize(self, post, syntaxdef, text, offset, version):
+        """Scan text (in a worker thread)
+
+        Batches of tokens are passed to post as a tuple
+        ``(version, [(color, start, length, info), ...], done)``.
+        Scanning stops early if version is no longer current.
+        """
+        tokens = []
+        def setcolor(color, range, prevend, info):
+            if version != self.version:
+                raise StopHighlight()
+            tokens.append((color, range.location, range.length, info))
+            if len(tokens) >= self.batch_size:
+                post((version, list(tokens), False))
+                del tokens[:]
+        try:
+            syntaxdef.scan(text, setcolor, offset)
+        except StopHighlight:
+            return
+        except Exception:
+            log.error("cannot scan text with %r", syntaxdef, exc_info=True)
+            return
+        post((version, tokens, True))
+
+    def applyTokens_(self, batch):
+        version, tokens, done = batch
+        if version != self.version or not self.running:
+            return
+        self.offset = self.syntaxer.color_tokens(
+            self.text_storage, tokens, self.offset)
+        if done:
+            self.stop()
+
+    def show(self, range):
+        """Color the given (newly visible) range as soon as possible"""
+        if self.running and range.location + range.length > self.offset:
+            self.visible.append(range)
+            NSObject.cancelPreviousPerformRequestsWithTarget_selector_object_(
+                self, "colorVisible", None)
+            self.performSelector_withObject_afterDelay_("colorVisible", None, 0)
+
+    def colorVisible(self):
+        ts = self.text_storage
+        while self.visible:
+            range = self.visible.pop()
+            end = range.location + range.length
+            if self.running and end > self.offset:
+                text = ts.string()
+                start = text.rfind(u"\n", 0, range.location) + 1
+                self.syntaxer.color_slice(ts, max(start, self.offset), end)
+
+    def text_edited(self, range, changelen, resume=None):
+        """Restart the worker after an edit
+
+        The edited range has already been colored by
+        SyntaxCache.color_text. Tokens from the previous worker are
+        discarded, and coloring resumes with a new copy of the text.
+
+        :param resume: The offset at which SyntaxCache.color_text stopped
+        coloring or None if it finished.
+        """
+        if not self.running:
+            return
+        if range.location + range.length - changelen < self.offset:
+            offset = self.offset + changelen
+        elif range.location < self.offset:
+            text = self.text_storage.string()
+            offset = text.rfind(u"\n", 0, range.location) + 1
+        else:
+            offset = self.offset
+        if resume is not None:
+            offset = min(offset, resume)
+        # resume at the start of the token (if any) that contains offset
+        prerange, info = self.syntaxer.get(offset)
+        self.offset = offset if prerange is None else prerange.location
+        del self.visible[:]
+        self.start_worker()
+
+    def stop(self):
+        if self.running:
+            NSObject.cancelPreviousPerformRequestsWithTarget_selector_object_(
+                self, "colorVisible", None)
+        self.running = False
+        self.version += 1
+
+
+class SyntaxDefinitionWatcher(NSObject):
+    """Reload syntax definitions when their files change
+
+    The directories from which the factory loaded definitions are polled
+    (on the main thread) for definition files that were changed, added or
+    removed. Changed files are reloaded with
+    SyntaxFactory.reload_definitions, and the callback is called with the
+    dict of replaced definitions that it returns.
+    """
+
+    interval = const.SYNTAX_RELOAD_INTERVAL
+
+    @objc.namedSelector("init:callback:")
+    def init(self, factory, callback):
+        self = super(SyntaxDefinitionWatcher, self).init()
+        self.factory = factory
+        self.callback = callback
+        self.status = factory.file_status()
+        self.running = True
+        self.schedule()
+        return self
+
+    def schedule(self):
+        self.performSelector_withObject_afterDelay_("check", None, self.interval)
+
+    def check(self):
+        if not self.running:
+            return
         try:
-            for i in xrange(range.length):
-                cache[range.location + i] = None
-            next_index = range.location + range.length + 1
-            next = cache[next_index]
-            if next and next[0] > 0:
-                for i in xrange(next[1]):
-                    cache[next_index + i] = None
-        except IndexError:
-            pass
+            self.reload()
+        finally:
+            self.schedule()
+
+    def reload(self):
+        """Reload changed definitions
+
+        :returns: The dict of replaced definitions (see
+        SyntaxFactory.reload_definitions).
+        """
+        old = self.status
+        new = self.status = self.factory.file_status()
+        changed = sorted(filename
+            for filename in set(old).union(new)
+            if old.get(filename) != new.get(filename))
+        if not changed:
+            return {}
+        replaced = self.factory.reload_definitions(changed)
+        if replaced:
+            try:
+                self.callback(replaced)
+            except Exception:
+                log.error("cannot update reloaded syntax definitions",
+                    exc_info=True)
+        return replaced
+
+    def stop(self):
+        if self.running:
+            NSObject.cancelPreviousPerformRequestsWithTarget_selector_object_(
+                self, "check", None)
+        self.running = False
 
 
 class NoHighlight(object):
@@ -227,7 +1305,7 @@ class NoHighlight(object):
         self.comment_token = comment_token
         self.disabled = disabled
 
-    def scan(self, text, setcolor, offset=0):
+    def scan(self, text, setcolor, offset=0, state=None):
         if offset == 0:
             setcolor(None, NSRange(len(text) - 1, 0), 0, None)
 
@@ -238,7 +1316,10 @@ class NoHighlight(object):
 class SyntaxDefinition(NoHighlight):
 
     def __init__(self, filename, name, filepatterns, word_groups=(),
-        delimited_ranges=(), comment_token="", disabled=False, flags=0):
+        delimited_ranges=(), comment_token="", disabled=False, flags=0,
+        max_line_length=const.SYNTAX_MAX_LINE_LENGTH,
+        max_line_time=const.SYNTAX_MAX_LINE_TIME,
+        long_line_color=const.SYNTAX_LONG_LINE_COLOR):
         """Syntax definition
 
         arguments:
@@ -257,6 +1338,17 @@ class SyntaxDefinition(NoHighlight):
                     ('"', ['"', '\n'], 'RRGGBB', None),
                     ('<?', ['?>'], 'RRGGBB', "php"),
                 ]
+                The text between the delimiters of a range with a nested
+                definition (or the name or file extension of a definition,
+                which is looked up by SyntaxFactory) is colored with that
+                definition; the delimiters are colored with the range color.
+            max_line_length - lines longer than this (in characters) are
+                colored only up to this column. Zero or None to color all
+                lines completely.
+            max_line_time - stop coloring a long line after this many
+                seconds (zero or None for no limit).
+            long_line_color - <RRGGBB color string> of the part of a long
+                line that is not colored.
         """
         super(SyntaxDefinition, self).__init__(name, comment_token, disabled)
         def escape(token):
@@ -269,18 +1361,37 @@ class SyntaxDefinition(NoHighlight):
         self.filepatterns = set(filepatterns)
         self.word_groups = list(word_groups)
         self.delimited_ranges = list(delimited_ranges)
+        self.embedded = {} # group name -> nested definition or its name
+        self.nested = {} # group name -> nested definition
         self.wordinfo = wordinfo = {}
-        flags |= re.DOTALL
+        self.keywords = keywords = {}
+        self.group_order = order = {}
+        self.patterns = patterns = {} # group name -> regular expression
+        self.flags = flags = flags | re.DOTALL
         groups = []
 
+        # Identifier-shaped words are found with a single word expression
+        # and looked up in self.keywords if there are many of them; a large
+        # alternation of words is slow because each alternative is tried at
+        # every position.
         word_char = re.compile(r"\w")
+        word_token = re.compile(r"\w+\Z")
+        def is_word(token):
+            return not hasattr(token, "pattern") and word_token.match(token)
+        lookup = sum(1 for tokens, color in word_groups
+            for token in tokens if is_word(token)) >= const.SYNTAX_KEYWORD_LOOKUP_MIN
+        fold = string.lower if flags & re.IGNORECASE else None
         for tokens, color in word_groups:
             name = namegen.next()
+            order[name] = len(order)
             color = self.getColor(color)
             wordgroup = []
             for token in tokens:
                 if hasattr(token, "pattern"):
                     word = token.pattern
+                elif lookup and is_word(token):
+                    keywords.setdefault(fold(token) if fold else token, name)
+                    continue
                 else:
                     word = escape(token)
                     if word_char.match(token[0]):
@@ -288,42 +1399,210 @@ class SyntaxDefinition(NoHighlight):
                     if word_char.match(token[-1]):
                         word = word + r"\b"
                 wordgroup.append(word)
-            groups.append("(?P<%s>%s)" % (name, "|".join(wordgroup)))
-            wordinfo[name] = (color, name)
+            if wordgroup:
+                patterns[name] = "(?P<%s>%s)" % (name, "|".join(wordgroup))
+                groups.append(patterns[name])
+            wordinfo[name] = (color, name, None, None)
 
         for start, ends, color, sdef in delimited_ranges:
             name = namegen.next()
+            order[name] = len(order)
             color = self.getColor(color)
             phrase = "(?P<%s>(%s).*?(%s))" % (
                 name,
                 escape(start),
-                "|".join(escape(token) for token in chain(ends, [RE("$")]))
+                "|".join(escape(token) for token in chain(ends, [RE(r"\Z")]))
             )
+            patterns[name] = phrase
             groups.append(phrase)
-            endxp = re.compile(".*?" + "|".join(escape(token) for token in ends), flags)
-            wordinfo[name] = (color, name) #, endxp)
+            startxp = re.compile(escape(start), flags)
+            endxp = re.compile(
+                "|".join(escape(token) for token in chain(ends, [RE(r"\Z")])), flags)
+            wordinfo[name] = (color, name, startxp, endxp)
+            if sdef is not None:
+                self.embedded[name] = sdef
+                if not isinstance(sdef, basestring):
+                    self.nested[name] = sdef
 
-        self.regex = re.compile("|".join(groups), flags)
+        self.regex = re.compile("|".join(groups), flags) if groups else None
+        self.wordxp = re.compile(r"\b\w+", flags) if keywords else None
+        self.fold = fold
+
+        self.max_line_length = max_line_length
+        self.max_line_time = max_line_time
+        if max_line_length:
+            # sre limits the repeat count of a single item
+            blocks, rem = divmod(max_line_length, 1000)
+            self.longxp = re.compile(r"^(?:[^\n]{1000}){%i}[^\n]{%i}"
+                                     % (blocks, rem), re.MULTILINE)
+        else:
+            self.longxp = None
+        wordinfo[LONG_LINE] = (
+            self.getColor(long_line_color), LONG_LINE, None, None)
 
-    def scan(self, text, setcolor, offset=0):
+    def matches(self, text, offset=0):
+        """Generate syntax tokens ``(group name, start, end)`` in text
+
+        Tokens are found in the same order and with the same precedence as
+        a single regular expression with a group for each word group and
+        delimited range: the leftmost token wins, and the group that was
+        defined first wins if two tokens begin at the same index.
+
+        Tokens that would begin beyond the cutoff column of a long line
+        (see max_line_length and max_line_time) are replaced by a single
+        LONG_LINE token, which extends to the end of the line.
+        """
+        tokens = self._matches(text, offset)
+        if self.longxp is None:
+            return tokens
+        return self._cut_long_lines(text, offset, tokens)
+
+    def _cut_long_lines(self, text, offset, tokens):
+        longxp = self.longxp
+        max_time = self.max_line_time
+        textlen = len(text)
+        def next_long_line(index):
+            # (start, cutoff, end) of the first long line that ends at or
+            # after index (the end of a line is the index of its newline)
+            match = longxp.search(text, text.rfind(u"\n", 0, index) + 1)
+            if match is None:
+                return textlen + 1, textlen + 1, textlen + 1
+            end = text.find(u"\n", match.end())
+            return match.start(), match.end(), (textlen if end < 0 else end)
+        lstart, cutoff, lend = next_long_line(offset)
+        started = None
+        pos = offset # end of the previous token
+        while True:
+            for name, start, end in tokens:
+                while start >= lend:
+                    lstart, cutoff, lend = next_long_line(start + 1)
+                    started = None
+                if start >= lstart and start < cutoff and max_time:
+                    if started is None:
+                        started = time.time()
+                    elif time.time() - started > max_time:
+                        cutoff = start
+                if start >= cutoff:
+                    pos = max(pos, cutoff)
+                    yield LONG_LINE, pos, lend
+                    pos = lend
+                    tokens = self._matches(text, lend)
+                    break
+                yield name, start, end
+                pos = end
+            else:
+                return
+
+    def _matches(self, text, offset):
+        regex = self.regex
+        if self.wordxp is None:
+            if regex is not None:
+                for match in regex.finditer(text, offset):
+                    yield match.lastgroup, match.start(), match.end()
+            return
+        keywords = self.keywords
+        order = self.group_order
+        fold = self.fold
+        def search(match):
+            # like finditer: do not match an empty string twice
+            end = match.end()
+            if end == match.start():
+                if end >= len(text):
+                    return None
+                end += 1
+            return regex.search(text, end)
+        other = None if regex is None else regex.search(text, offset)
+        pos = offset
+        for word in self.wordxp.finditer(text, offset):
+            wstart = word.start()
+            if wstart < pos:
+                continue # inside the previous token
+            name = keywords.get(fold(word.group()) if fold else word.group())
+            if name is None:
+                continue
+            while other is not None and (other.start() < wstart or
+                    (other.start() == wstart and
+                     order[other.lastgroup] < order[name])):
+                pos = other.end()
+                yield other.lastgroup, other.start(), pos
+                other = search(other)
+            if wstart < pos:
+                continue # inside the previous token
+            pos = word.end()
+            yield name, wstart, pos
+            if other is not None and other.start() < pos:
+                other = regex.search(text, pos)
+        while other is not None:
+            yield other.lastgroup, other.start(), other.end()
+            other = search(other)
+
+    def scan(self, text, setcolor, offset=0, state=None):
+        """Scan text for syntax tokens, calling setcolor for each token
+
+        arguments:
+            offset - the index at which to begin scanning.
+            state - None or a tuple (<group name>, <start index>) if offset
+                is inside a token that began before offset. Scanning resumes
+                inside a delimited range by searching for the end of the
+                range with its end expression; any other token is rescanned
+                from its start index.
+        """
         info = self.wordinfo
         prevend = offset
-        for match in self.regex.finditer(text, offset):
-            data = info.get(match.lastgroup)
+        if state is not None:
+            name, start = state
+            data = info.get(name)
+            delim = None
+            if data is not None and data[2] is not None:
+                delim = data[2].match(text, start)
+            if delim is not None:
+                # an end delimiter may begin before offset, but not inside
+                # the start delimiter
+                match = data[3].search(text, max(offset - 1, delim.end()))
+                thisend = match.end()
+            if delim is not None and thisend > offset:
+                setcolor(data[0], NSRange(start, thisend - start), prevend, name)
+                prevend = offset = thisend
+            else:
+                prevend = offset = start
+        for name, thestart, thisend in self.matches(text, offset):
+            data = info.get(name)
             if data is None:
-                log.error("invalid syntax match: %r", match.groups())
+                log.error("invalid syntax match: %r", name)
                 continue
-            thestart = match.start()
-            thisend = match.end()
             range = NSRange(thestart, thisend - thestart)
             setcolor(data[0], range, prevend, data[1])
-            prevend = range.location + range.length
-        setcolor(None,  NSRange(len(text) - 1, 0), prevend, None)
+            prevend = thisend
+        setcolor(None, NSRange(len(text), 0), prevend, None)
+
+    def __getstate__(self):
+        """Get state for pickle (colors are saved as RRGGBB strings)"""
+        state = dict(self.__dict__)
+        wordinfo = {}
+        for key, (color, name, startxp, endxp) in self.wordinfo.iteritems():
+            try:
+                color = self._colorNames[color]
+            except KeyError:
+                raise pickle.PicklingError("cannot pickle color: %r" % (color,))
+            wordinfo[key] = (color, name, startxp, endxp)
+        state["wordinfo"] = wordinfo
+        del state["nested"] # names are resolved again by SyntaxFactory
+        return state
+
+    def __setstate__(self, state):
+        wordinfo = state["wordinfo"]
+        for key, (color, name, startxp, endxp) in wordinfo.items():
+            wordinfo[key] = (self.getColor(color), name, startxp, endxp)
+        state["nested"] = dict((key, sdef)
+            for key, sdef in state["embedded"].iteritems()
+            if not isinstance(sdef, basestring))
+        self.__dict__.update(state)
 
     _colorCache = {}
+    _colorNames = {}
 
     @staticmethod
-    def getColor(value, cache=_colorCache):
+    def getColor(value, cache=_colorCache, names=_colorNames):
         if isinstance(value, NSColor):
             return value
         try:
@@ -334,9 +1613,53 @@ class SyntaxDefinition(NoHighlight):
             g = int(value[2:4], 16) / 255.0
             b = int(value[4:], 16) / 255.0
             color = cache[value] = NSColor.colorWithCalibratedRed_green_blue_alpha_(r, g, b, 1.0)
+            names[color] = value
             return color
 
 
+class LazySyntaxDefinition(object):
+    """Syntax definition that is loaded the first time it is used
+
+    Only the header (name, file patterns and disabled flag) is read when
+    definitions are loaded at startup. Other attributes are looked up on
+    the full definition, which is loaded (and its regular expressions
+    compiled) on first access.
+    """
+
+    header_names = frozenset(["name", "filepatterns", "disabled"])
+
+    def __init__(self, factory, filename, name, filepatterns, disabled=False):
+        self.factory = factory
+        self.filename = filename
+        self.name = name
+        self.filepatterns = set(filepatterns)
+        self.disabled = disabled
+        self._definition = None
+
+    @property
+    def loaded(self):
+        return self._definition is not None
+
+    def load(self):
+        """Load and return the full definition"""
+        if self._definition is None:
+            try:
+                self._definition = self.factory.load_definition(self.filename)
+            except Exception:
+                log.error("error loading syntax definition: %s",
+                    self.filename, exc_info=True)
+                self._definition = PLAIN_TEXT
+        return self._definition
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __repr__(self):
+        return "<%s : %s>" % (type(self).__name__, self.name)
+
+
 PLAIN_TEXT = NoHighlight("Plain Text", "x")
 
 
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2012 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+"""Profile the regular expressions of a syntax definition
+
+Usage: python -m editxt.syntaxprofile [options] DEFINITION SAMPLE
+
+Each word group and delimited range of the syntax definition (a
+*.syntax.py file) is compiled separately and searched for in the sample
+text, one search at a time, so the slowest searches (and the positions at
+which they started) can be reported for each group. The combined regular
+expression and the complete tokenizer are timed as well. Patterns with
+nested quantifiers, which may backtrack catastrophically, are flagged.
+
+Each pattern is searched in a separate process that is terminated if it
+does not finish within the timeout.
+"""
+from __future__ import with_statement
+
+import logging
+import multiprocessing
+import sys
+import time
+from optparse import OptionParser
+
+from editxt.search import nested_quantifiers
+
+log = logging.getLogger(__name__)
+
+WORST = 3 # number of slowest searches to report per pattern
+TIMEOUT = 30.0 # seconds
+
+
+def line_col(text, index):
+    """Get the (one-based) line and column of an index in text"""
+    return text.count(u"\n", 0, index) + 1, index - text.rfind(u"\n", 0, index)
+
+def profile_pattern(pattern, flags, text, worst=WORST):
+    """Search for all matches of a pattern, timing each search
+
+    :returns: A dict with the total time, the number of matches and a list
+    of the slowest searches as ``(seconds, start, match start or None)``
+    tuples, slowest first.
+    """
+    import re
+    regex = re.compile(pattern, flags)
+    search = regex.search
+    timer = time.time
+    textlen = len(text)
+    matches = 0
+    total = 0.0
+    searches = []
+    pos = 0
+    while pos <= textlen:
+        start = timer()
+        match = search(text, pos)
+        seconds = timer() - start
+        total += seconds
+        if match is None:
+            searches.append((seconds, pos, None))
+            break
+        searches.append((seconds, pos, match.start()))
+        matches += 1
+        pos = match.end()
+        if pos == match.start():
+            pos += 1
+    searches.sort(reverse=True)
+    return {"seconds": total, "matches": matches, "worst": searches[:worst]}
+
+def profile_matches(sdef, text):
+    """Time the tokenizer (SyntaxDefinition.matches)"""
+    start = time.time()
+    tokens = sum(1 for token in sdef.matches(text))
+    return {"seconds": time.time() - start, "matches": tokens, "worst": []}
+
+def run_profile(func, args, timeout=TIMEOUT):
+    """Call func(*args) in a separate process
+
+    :returns: The result of the function or None on timeout.
+    """
+    pool = multiprocessing.Pool(1)
+    try:
+        result = pool.apply_async(func, args)
+        try:
+            return result.get(timeout)
+        except multiprocessing.TimeoutError:
+            return None
+    finally:
+        pool.terminate()
+
+def describe(sdef):
+    """Generate (group name, description, pattern, flags) for each group
+
+    Pattern is None for a word group whose words are all looked up in the
+    keyword dictionary.
+    """
+    from editxt.syntax import LONG_LINE
+    def brief(value, size=40):
+        value = getattr(value, "pattern", value)
+        value = repr(value)[1:-1] if isinstance(value, basestring) else repr(value)
+        return value if len(value) <= size else value[:size - 3] + "..."
+    items = []
+    for tokens, color in sdef.word_groups:
+        items.append("words %s: %s" % (color, brief(" ".join(
+            getattr(token, "pattern", token) for token in tokens))))
+    for start, ends, color, ignore in sdef.delimited_ranges:
+        items.append("range %s: %s ... %s" % (color, brief(start, 20),
+            " | ".join(brief(end, 20) for end in ends)))
+    for i, desc in enumerate(items):
+        name = "g%i" % i
+        yield name, desc, sdef.patterns.get(name), sdef.flags
+    if sdef.wordxp is not None:
+        yield "keywords", "keywords (%i, dictionary lookup)" \
+            % len(sdef.keywords), sdef.wordxp.pattern, sdef.wordxp.flags
+    if sdef.longxp is not None:
+        yield LONG_LINE, "long lines (over %i characters)" \
+            % sdef.max_line_length, sdef.longxp.pattern, sdef.longxp.flags
+
+def profile(sdef, text, worst=WORST, timeout=TIMEOUT):
+    """Profile the regular expressions of a syntax definition
+
+    :returns: A list of dicts (one for each group, the combined regular
+    expression and the tokenizer) with keys: name, description, seconds,
+    matches, worst, nested. Seconds is None if a search timed out.
+    """
+    timed_out = dict(seconds=None, matches=0, worst=[])
+    results = []
+    for name, desc, pattern, flags in describe(sdef):
+        data = {"name": name, "description": desc, "nested": []}
+        if pattern is None:
+            data.update(seconds=0.0, matches=0, worst=[])
+        else:
+            data["nested"] = nested_quantifiers(pattern, flags)
+            result = run_profile(profile_pattern,
+                (pattern, flags, text, worst), timeout)
+            data.update(result or timed_out)
+        results.append(data)
+    if sdef.regex is not None:
+        data = {"name": "regex", "description": "combined regular expression",
+                "nested": []}
+        result = run_profile(profile_pattern,
+            (sdef.regex.pattern, sdef.flags, text, worst), timeout)
+        data.update(result or timed_out)
+        results.append(data)
+    data = {"name": "matches", "nested": [],
+            "description": "tokenizer (SyntaxDefinition.matches)"}
+    data.update(run_profile(profile_matches, (sdef, text), timeout) or timed_out)
+    results.append(data)
+    return results
+
+def report(results, text, output=sys.stdout):
+    write = output.write
+    write("%-10s %10s %9s %12s  %s\n" % (
+        "group", "seconds", "matches", "matches/s", "description"))
+    for data in results:
+        seconds = data["seconds"]
+        if seconds is None:
+            rate = elapsed = "TIMEOUT"
+        else:
+            elapsed = "%.4f" % seconds
+            rate = "%.0f" % (data["matches"] / seconds) if seconds else "-"
+        write("%-10s %10s %9i %12s  %s\n" % (
+            data["name"], elapsed, data["matches"], rate, data["description"]))
+        if data["nested"]:
+            write("%10s WARNING nested quantifiers: %s\n"
+                % ("", " ".join(data["nested"])))
+        for seconds, pos, found in data["worst"]:
+            line, col = line_col(text, pos)
+            where = "no match" if found is None else \
+                "match at %s:%s" % line_col(text, found)
+            write("%10s %.6fs search from %s:%s (%s)\n"
+                % ("", seconds, line, col, where))
+
+def main(args=None):
+    parser = OptionParser(usage="python -m editxt.syntaxprofile "
+                                "[options] DEFINITION SAMPLE")
+    parser.add_option("-w", "--worst", type="int", default=WORST,
+        help="number of slowest searches to report (default: %default)")
+    parser.add_option("-t", "--timeout", type="float", default=TIMEOUT,
+        help="seconds to allow for each pattern (default: %default)")
+    options, args = parser.parse_args(args)
+    if len(args) != 2:
+        parser.error("expected a syntax definition file and a sample file")
+    from editxt.benchmark import install_headless_modules
+    install_headless_modules()
+    from editxt.syntax import SyntaxFactory
+    sdef = SyntaxFactory().load_definition(args[0])
+    with open(args[1]) as fh:
+        text = fh.read().decode("utf-8", "replace")
+    results = profile(sdef, text, options.worst, options.timeout)
+    report(results, text)
+    return 1 if any(r["seconds"] is None or r["nested"] for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -60,12 +60,14 @@ def test_create():
     sv.documentView() >> tv
     not_class = m.replace(NSNotificationCenter)
     notifier = not_class.defaultCenter() >> m.mock(NSNotificationCenter)
-    notifier.addObserver_selector_name_object_(ANY, "invalidateRuleThickness",
+    notifier.addObserver_selector_name_object_(ANY, "textDidChange:",
         NSTextDidChangeNotification, tv)
     with m:
         lnv = create_lnv(scrollview=sv)
-        eq_(lnv.lines, [])
         eq_(lnv.textview, tv)
+        eq_(lnv.digits, 1)
+        eq_(lnv.labels, {})
+        eq_(lnv.drawn, {})
         eq_(lnv.paragraph_style.alignment(), NSRightTextAlignment)
 
 def test_requiredThickness():
@@ -80,20 +82,19 @@ def test_calculate_thickness():
         m = Mocker()
         tv = m.mock(TextView)
         lnv = create_lnv(tv)
-        estimate_line_count = m.method(lnv.estimate_line_count)
         ruleThickness = m.method(lnv.ruleThickness)
-        lines = []
         font = None if c.font_is_none else m.mock(NSFont)
         (tv.textStorage() >> m.mock(NSTextStorage)).font() >> font
         if c.font_is_none:
             ruleThickness() >> c.result
         else:
-            estimate_line_count(font) >> c.numlines
+            tv.doc_view.document.line_index >> [None] * c.numlines
             cw = font.advancementForGlyph_(ord("0")).width >> 15
         with m:
             result = lnv.calculate_thickness()
             eq_(result, c.result)
-            eq_(lnv.lines, lines)
+            if not c.font_is_none:
+                eq_(lnv.digits, len(str(c.numlines)))
     c = TestConfig(font_is_none=False)
     yield test, c(font_is_none=True, result=0)
     yield test, c(numlines=0, result=15 * 4)
@@ -102,26 +103,127 @@ def test_calculate_thickness():
     yield test, c(numlines=3000, result=15 * 7)
 
 def test_line_number_at_char_index():
+    from editxt.lineindex import LineIndex
     def test(c):
         m = Mocker()
         tv = m.mock(TextView)
         lnv = create_lnv(tv)
-        font = None if c.font_is_none else m.mock(NSFont)
-        (tv.textStorage() >> m.mock(NSTextStorage)).font() >> font
-        if not c.font_is_none:
-            rect = m.mock(NSRect)
-            rng = m.mock(NSRange)
-            lm = tv.layoutManager() >> m.mock(NSLayoutManager)
-            lm.defaultLineHeightForFont_(font) >> 10
-            lm.lineFragmentRectForGlyphAtIndex_effectiveRange_(c.index, None) >> (rect, rng)
-            rect.origin.y >> (10 * c.index)
+        tv.doc_view.document.line_index >> LineIndex(c.text)
         with m:
             result = lnv.line_number_at_char_index(c.index)
             eq_(result, c.result)
-    c = TestConfig(font_is_none=False)
-    yield test, c(font_is_none=True, index=0, result=0)
+    c = TestConfig(text=u"abc\ndef\n")
+    yield test, c(text=u"", index=0, result=1)
     yield test, c(index=0, result=1)
+    yield test, c(index=3, result=1)
+    yield test, c(index=4, result=2)
+    yield test, c(index=8, result=3)
+
+
+class FakeLayoutManager(object):
+    """Layout in which lines are wrapped every width characters"""
+    def __init__(self, text, width, line_height=10):
+        self.fragments = [] # (y, start, length)
+        self.extra = NSMakeRect(0, 0, 0, 0)
+        y = start = 0
+        for line in text.splitlines(True):
+            for i in xrange(0, len(line), width):
+                length = len(line[i:i + width])
+                self.fragments.append((y, start, length))
+                start += length
+                y += line_height
+        if not text or text.endswith(u"\n"):
+            self.extra = NSMakeRect(0, y, 100, line_height)
+        self.line_height = line_height
+        self.length = len(text)
+    def glyphIndexForPoint_inTextContainer_(self, point, container):
+        i = min(int(point.y) // self.line_height, len(self.fragments) - 1)
+        return self.fragments[i][1] if i >= 0 else self.length
+    def numberOfGlyphs(self):
+        return self.length
+    def lineFragmentRectForGlyphAtIndex_effectiveRange_(self, glyph, ignore):
+        for y, start, length in self.fragments:
+            if start <= glyph < start + length:
+                return NSMakeRect(0, y, 100, self.line_height), NSRange(start, length)
+        raise IndexError(glyph)
+    def characterIndexForGlyphAtIndex_(self, glyph):
+        return glyph
+    def extraLineFragmentRect(self):
+        return self.extra
+
+def test_iter_line_numbers():
+    from editxt.lineindex import LineIndex
+    def test(text, width, top, bottom, result):
+        m = Mocker()
+        tv = m.mock(TextView)
+        lnv = create_lnv(tv)
+        (tv.layoutManager() << FakeLayoutManager(text, width)).count(0, None)
+        (tv.textContainer() << None).count(0, None)
+        tv.doc_view.document.line_index >> LineIndex(text)
+        with m:
+            eq_(list(lnv.iter_line_numbers(top, bottom)), result)
+    text = u"abc\ndefghij\nk"
+    yield test, text, 20, 0, 100, [(0, 1), (10, 2), (20, 3)]
+    yield test, text, 3, 0, 100, [(0, 1), (20, 2), (50, 3)]
+    yield test, text, 3, 25, 45, [(20, 2)]
+    yield test, text + u"\n", 20, 0, 100, [(0, 1), (10, 2), (20, 3), (30, 4)]
+    yield test, u"", 20, 0, 100, [(0, 1)]
+
+def test_label():
+    lnv = create_lnv()
+    font = NSFont.fontWithName_size_("Monaco", 10.0)
+    label = lnv.label(42, font)
+    eq_(label.string(), u"42")
+    assert lnv.label(42, font) is label
+    lnv.max_labels = 1
+    assert lnv.label(43, font) is not label
+    eq_(list(lnv.labels), [43])
+
+def test_textDidChange_():
+    def test(c):
+        m = Mocker()
+        lnv = create_lnv()
+        lnv.digits = 1
+        def calc():
+            lnv.digits = c.digits
+            return c.thickness
+        expect(m.method(lnv.calculate_thickness)()).call(calc)
+        if c.digits != 1:
+            m.method(lnv.ruleThickness)() >> 40
+        if c.digits != 1 and c.thickness != 40:
+            m.method(lnv.invalidateRuleThickness)()
+        else:
+            m.method(lnv.invalidate_changed_lines)()
+        with m:
+            lnv.textDidChange_(None)
+    c = TestConfig(digits=1, thickness=40)
+    yield test, c
+    yield test, c(digits=2)
+    yield test, c(digits=2, thickness=50)
 
+def test_invalidate_changed_lines():
+    def test(old, new, result):
+        m = Mocker()
+        tv = m.mock(TextView)
+        lnv = create_lnv(tv)
+        lnv.drawn = dict(old)
+        font = m.mock(NSFont)
+        (tv.textStorage() >> m.mock(NSTextStorage)).font() >> font
+        tv.layoutManager().defaultLineHeightForFont_(font) >> 10
+        m.method(lnv.text_offset)() >> -100
+        m.method(lnv.visibleRect)() >> NSMakeRect(0, 0, 30, 50)
+        m.method(lnv.iter_line_numbers)(100, 150) >> new
+        if result is not None:
+            m.method(lnv.setNeedsDisplayInRect_)(NSMakeRect(0, *result))
+        with m:
+            lnv.invalidate_changed_lines()
+            eq_(lnv.drawn, dict(new))
+    lines = [(100, 11), (110, 12), (120, 13), (130, 14), (140, 15)]
+    yield test, lines, lines, None
+    yield test, lines + [(0, 1)], lines, None # not visible
+    yield test, lines, lines[:2] + [(120, 14), (130, 15), (140, 16)], (20, 30, 30)
+    yield test, lines[:3], lines, (30, 30, 20)
+    yield test, lines, [(100, 11), (115, 12)] + lines[2:], (10, 30, 15)
 
 # - (void)calculateLines
 # {
@@ -69,6 +69,17 @@ def test_TextView_doCommandBySelector_():
     with m:
         tv.doCommandBySelector_(selector)
 
+def test_TextView_cancelOperation_():
+    from editxt.findpanel import FindController
+    m = Mocker()
+    tv = TextView.alloc().init()
+    fc = m.replace("editxt.findpanel.FindController")
+    sender = m.mock()
+    # True omits super call
+    (fc.shared_controller() >> m.mock(FindController)).stop_search() >> True
+    with m:
+        tv.cancelOperation_(sender)
+
 def test_TextView_validateUserInterfaceItem_():
     from editxt.findpanel import FindController
     from editxt.textcommand import TextCommandController
@@ -86,21 +86,77 @@ def test_app_support_path():
     yield test, c(has_paths=True)
 
 def test_init_syntax_definitions():
-    from editxt.syntax import SyntaxFactory
+    from editxt.syntax import SyntaxFactory, DefinitionCache, \
+        HighlightCache, SyntaxDefinitionWatcher
     m = Mocker()
     app = Application()
     sf_class = m.replace(SyntaxFactory, spec=False, passthrough=False)
+    dc_class = m.replace(DefinitionCache, spec=False, passthrough=False)
+    hc_class = m.replace(HighlightCache, spec=False, passthrough=False)
+    sw_class = m.replace(SyntaxDefinitionWatcher, spec=False, passthrough=False)
     app_log = m.replace("editxt.application.log", passthrough=False)
     nsb = m.replace(NSBundle)
     app_support_path = m.method(Application.app_support_path)
-    sf = sf_class() >> m.mock(SyntaxFactory)
-    rsrc_path = nsb.mainBundle().resourcePath() >> "/resources/syntax"
-    asup_path = app_support_path() >> "/app_support/syntax"
+    bundle = nsb.mainBundle() >> m.mock(NSBundle)
+    asup_path = "/app_support/syntax"
+    expect(app_support_path()).result(asup_path).count(3)
+    version = bundle.objectForInfoDictionaryKey_(u"CFBundleVersion") >> "1.0"
+    cache = dc_class(os.path.join(asup_path, const.SYNTAX_CACHE_FILE), version) \
+        >> m.mock(DefinitionCache)
+    sf = sf_class(cache) >> m.mock(SyntaxFactory)
+    hcache = hc_class(os.path.join(asup_path, const.HIGHLIGHT_CACHE_DIR)) \
+        >> m.mock(HighlightCache)
+    rsrc_path = bundle.resourcePath() >> "/resources/syntax"
     for path in [rsrc_path, asup_path]:
         sf.load_definitions(os.path.join(path, const.SYNTAX_DEFS_DIR))
     sf.index_definitions()
+    watcher = sw_class.alloc().init(sf, app.syntax_definitions_reloaded) \
+        >> m.mock(SyntaxDefinitionWatcher)
     with m:
         app.init_syntax_definitions()
+        eq_(app.highlight_cache, hcache)
+        eq_(app.syntax_watcher, watcher)
+
+def test_syntax_definitions_reloaded():
+    def test(c):
+        m = Mocker()
+        app = Application()
+        old, new, other = "<old>", "<new>", "<other>"
+        replaced = {old: {"new": new, "removed": None, "nested": old}[c.new]}
+        views = []
+        for name in c.docs:
+            view = m.mock(TextDocumentView)
+            doc = view.document >> m.mock(TextDocument)
+            (doc.id << name.lower()).count(1, 2)
+            if name.lower() in [v.lower() for v in c.docs[:len(views)]]:
+                views.append(view)
+                continue
+            sdef = old if name.isupper() else other
+            (doc.syntaxdef << sdef).count(1, 3)
+            if sdef is old:
+                if c.new == "new":
+                    doc.props.syntaxdef = new
+                elif c.new == "removed":
+                    doc.syntaxer.filename = None
+                    doc.update_syntaxer()
+                else:
+                    doc.syntaxer.reset()
+                    doc.color_text()
+            views.append(view)
+        proj = m.mock(Project)
+        proj.documents() >> views
+        ed = m.mock(Editor)
+        ed.projects >> [proj]
+        m.method(app.iter_editors)() >> [ed]
+        with m:
+            app.syntax_definitions_reloaded(replaced)
+    c = TestConfig(new="new")
+    yield test, c(docs="")
+    yield test, c(docs="a")
+    yield test, c(docs="A")
+    yield test, c(docs="AbA")
+    yield test, c(docs="Ab", new="removed")
+    yield test, c(docs="Ab", new="nested")
 
 def test_syntaxdefs():
     from editxt.syntax import SyntaxFactory
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2012 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+import logging
+
+from nose.tools import *
+
+from editxt.attrsink import ColorRuns, RecordingSink, UNKNOWN
+
+log = logging.getLogger(__name__)
+
+
+def test_RecordingSink():
+    sink = RecordingSink(5)
+    sink.begin()
+    sink.set_color(1, 2, "a")
+    sink.set_color(4, 3, "b")
+    sink.set_color(2, 1, None)
+    sink.end()
+    eq_(sink.calls, ["begin", (1, 2, "a"), (4, 3, "b"), (2, 1, None), "end"])
+    eq_(sink.colors, [None, "a", None, None, "b", "b", "b"])
+
+def test_ColorRuns_flush():
+    def test(runs, result, applied=()):
+        cr = ColorRuns()
+        for start, length, color in applied:
+            cr.applied.set(start, length, color)
+        for start, length, color in runs:
+            cr.color(start, length, color)
+        sink = RecordingSink()
+        eq_(cr.flush(sink), len(result))
+        eq_(sink.calls, (["begin"] + result + ["end"]) if result else [])
+        eq_(cr.pending, [])
+    # adjacent runs are merged
+    yield test, [(0, 2, "a"), (2, 3, "a"), (5, 1, "b")], [(0, 5, "a"), (5, 1, "b")]
+    yield test, [(0, 2, "a"), (3, 3, "a")], [(0, 2, "a"), (3, 3, "a")]
+    yield test, [(0, 2, None), (2, 3, "a"), (5, 0, "b")], [(2, 3, "a")]
+    # unchanged runs are not applied
+    yield test, [(0, 2, "a"), (2, 3, None), (5, 2, "b")], [], \
+        [(0, 2, "a"), (5, 2, "b")]
+    yield test, [(0, 2, "a"), (2, 3, "b")], [(2, 3, "b")], [(0, 2, "a")]
+    yield test, [(0, 6, "a")], [(2, 2, "a")], [(0, 2, "a"), (4, 2, "a")]
+    yield test, [(0, 6, None)], [(1, 2, None), (4, 1, None)], \
+        [(1, 2, "a"), (4, 1, "b")]
+    yield test, [(0, 2, "a"), (2, 2, "b")], [(0, 1, "a"), (3, 1, "b")], \
+        [(1, 1, "a"), (2, 1, "b")]
+    yield test, [(0, 4, None)], [(0, 4, None)], [(0, 4, UNKNOWN)]
+
+def test_ColorRuns_flush_updates_applied():
+    cr = ColorRuns()
+    cr.color(0, 3, "a")
+    cr.clear(3, 2)
+    cr.color(5, 2, "b")
+    cr.flush(RecordingSink())
+    eq_(list(cr.applied), [(0, 3, "a"), (5, 2, "b")])
+    cr.color(0, 4, "a")
+    cr.color(4, 3, None)
+    cr.flush(RecordingSink())
+    eq_(list(cr.applied), [(0, 3, "a"), (3, 1, "a")])
+
+def test_ColorRuns_text_edited():
+    def test(start, length, changelen, result):
+        cr = ColorRuns()
+        cr.applied.set(2, 3, "a")
+        cr.applied.set(5, 2, "b")
+        cr.text_edited(start, length, changelen)
+        eq_(list(cr.applied), result)
+    U = UNKNOWN
+    yield test, 0, 2, 2, [(0, 2, U), (4, 3, "a"), (7, 2, "b")]
+    yield test, 3, 1, 1, [(2, 1, "a"), (3, 1, U), (4, 2, "a"), (6, 2, "b")]
+    yield test, 3, 0, -3, [(2, 1, "a"), (3, 1, "b")]
+    yield test, 4, 1, -1, [(2, 2, "a"), (4, 1, U), (5, 1, "b")]
+    yield test, 4, 1, 0, [(2, 2, "a"), (4, 1, U), (5, 2, "b")]
+
+def test_ColorRuns_reapply_after_edit():
+    # text: "aaabb" -> insert "x" at 3 -> "aaaxbb"
+    cr = ColorRuns()
+    cr.color(0, 3, "a")
+    cr.color(3, 2, "b")
+    cr.flush(RecordingSink())
+    cr.text_edited(3, 1, 1)
+    cr.color(0, 3, "a")
+    cr.clear(3, 1)
+    cr.color(4, 2, "b")
+    sink = RecordingSink()
+    eq_(cr.flush(sink), 1)
+    eq_(sink.calls, ["begin", (3, 1, None), "end"])
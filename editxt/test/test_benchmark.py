@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2012 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+import logging
+
+from nose.tools import *
+
+import editxt.benchmark as mod
+
+log = logging.getLogger(__name__)
+
+
+def test_parse_size():
+    def test(value, result):
+        eq_(mod.parse_size(value), result)
+    yield test, "100", 100
+    yield test, "10K", 10240
+    yield test, "10k", 10240
+    yield test, "1.5K", 1536
+    yield test, "50M", 50 * 1024 * 1024
+
+def test_generate_text():
+    def test(language, size):
+        text = mod.generate_text(language, size)
+        assert size <= len(text) < size + 2048, len(text)
+        eq_(text, mod.generate_text(language, size))
+        assert text != mod.generate_text(language, size, seed=1)
+    for language in mod.LANGUAGES:
+        yield test, language, 5000
+
+def test_BenchTextStorage_replace():
+    ts = mod.BenchTextStorage(u"abc\ndef\n")
+    eq_(ts.replace(4, 3, u"xy"), (4, 2))
+    eq_(ts.string(), u"abc\nxy\n")
+    eq_(ts.changeInLength(), -1)
+
+def test_run():
+    mod.install_headless_modules()
+    data = mod.run(["python", "editxtlog"], ["2K"], repeat=1, output=None)
+    eq_(sorted(data["results"]), ["editxtlog/2K", "python/2K"])
+    result = data["results"]["python/2K"]
+    assert result["scan"]["tokens"] > 0, result
+    assert result["parallel_scan"]["tokens"] > 0, result
+    assert result["color"]["changes"] > 0, result
+    eq_(sorted(result["edits"]), sorted(mod.EDITS))
+    assert result["memory"]["spans"] > 0, result
+
+def test_split_chunks():
+    def test(text, offset, size, result):
+        eq_(mod.split_chunks(text, offset, size), result)
+    text = u"abc\ndef\n\nghi\njkl"
+    yield test, u"", 0, 4, [(0, 1)]
+    yield test, text, 0, 100, [(0, 17)]
+    yield test, text, 0, 4, [(0, 8), (8, 13), (13, 17)]
+    yield test, text, 0, 2, [(0, 4), (4, 8), (8, 13), (13, 17)]
+    yield test, text, 4, 2, [(4, 8), (8, 13), (13, 17)]
+    yield test, text, 0, 16, [(0, 17)] # empty line preferred in window
+
+def test_scan_parallel():
+    mod.install_headless_modules()
+    from editxt.syntax import SyntaxDefinition, RE
+    sdef = SyntaxDefinition("", "Test", (), [(["else"], "0000FF")], [
+        ('"""', ['"""'], "008080", None),
+        ('"', ['"', RE(r"[^\\]\n")], "00FF00", None),
+        ("#", [RE(r"(?=\n)")], "FF0000", None),
+    ])
+    text = (u'"a" else\n# x "\n\n"""\nelse\n\n"""\nelse\n"\n\n# """\n'
+            u'\n"""\n\n\n"""\n"""\nelse\n\n') * 3
+    def test(chunk_size, processes, offset=0):
+        eq_(list(mod.scan_parallel(sdef, text, offset, processes, chunk_size)),
+            list(sdef.matches(text, offset)))
+    for size in [1, 2, 3, 5, 8, 13, 21, 34, 100]:
+        yield test, size, 1
+    yield test, 7, 1, text.index(u"else\n\n")
+    # chunks scanned by a pool of processes
+    for size in [3, 13, 100]:
+        yield test, size, 2
+    yield test, 7, 3, text.index(u"else\n\n")
+
+def test_compare():
+    def result(scan, color, edit):
+        return {"scan": {"seconds": scan}, "color": {"seconds": color},
+                "edits": {"insert_quote": {"seconds": edit}}}
+    data = {"results": {"a/1K": result(1.0, 2.0, 0.5),
+                        "b/1K": result(1.0, 1.0, 1.0)}}
+    base = {"results": {"a/1K": result(1.0, 1.0, 0.0)}}
+    comparison = mod.compare(data, base)
+    eq_(comparison, [
+        ("a/1K color", 2.0, 1.0, 2.0),
+        ("a/1K insert_quote", 0.5, 0.0, None),
+        ("a/1K scan", 1.0, 1.0, 1.0),
+    ])
+    eq_(mod.regressions(comparison), [("a/1K color", 2.0, 1.0, 2.0)])
+    eq_(mod.regressions(comparison, 1.5), [])
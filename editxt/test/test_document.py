@@ -231,6 +231,12 @@ def test_document_set_main_view_of_window():
             sv.setHasVerticalRuler_(True)
             sv.setRulersVisible_(True)
 
+            clip = sv.contentView() >> m.mock(NSClipView)
+            clip.setPostsBoundsChangedNotifications_(True)
+            nc_class = m.replace("editxt.document.NSNotificationCenter")
+            nc_class.defaultCenter().addObserver_selector_name_object_(
+                dv, "visibleRectDidChange:", NSViewBoundsDidChangeNotification, clip)
+
             dv.wrap_mode = const.LINE_WRAP_NONE
             m.method(dv.reset_edit_state)()
             assert dv.scroll_view is None
@@ -617,6 +623,55 @@ def test_document_shouldClose_contextInfo_():
     yield test, True
     yield test, False
 
+def test_TextDocumentView_visibleRectDidChange_():
+    from editxt.syntax import Highlighter
+    def test(has_highlighter):
+        m = Mocker()
+        doc = m.mock(TextDocument)
+        dv = TextDocumentView.alloc().init_with_document(doc)
+        if has_highlighter:
+            hl = doc.highlighter >> m.mock(Highlighter)
+            hl.show(m.method(dv.visible_range)() >> (5, 10))
+        else:
+            doc.highlighter >> None
+        with m:
+            dv.visibleRectDidChange_(None)
+    yield test, True
+    yield test, False
+
+def test_TextDocumentView_textViewDidChangeSelection_():
+    from editxt.controls.statscrollview import StatusbarScrollView
+    from editxt.lineindex import LineIndex
+    def test(c):
+        m = Mocker()
+        doc = m.mock(TextDocument)
+        dv = TextDocumentView.alloc().init_with_document(doc)
+        dv.scroll_view = m.mock(StatusbarScrollView)
+        ts = NSTextStorage.alloc().initWithString_attributes_(c.text, {})
+        lines = LineIndex(c.text)
+        (doc.line_index << lines).count(len(c.moves))
+        (doc.indent_size << 4).count(len(c.moves))
+        notification = m.mock(NSNotification)
+        tv = (notification.object() << m.mock(NSTextView)).count(len(c.moves))
+        (tv.textStorage() << ts).count(len(c.moves))
+        results = []
+        for sel, status in c.moves:
+            tv.selectedRange() >> NSRange(*sel)
+            if status not in results[-1:]:
+                dv.scroll_view.statusView.updateLine_column_selection_(*status)
+            results.append(status)
+        with m:
+            for sel in c.moves:
+                dv.textViewDidChangeSelection_(notification)
+    c = TestConfig(text=u"ab\n\tc\td\n")
+    yield test, c(moves=[((0, 0), (1, 0, 0))])
+    yield test, c(moves=[((0, 0), (1, 0, 0)), ((0, 0), (1, 0, 0))])
+    yield test, c(moves=[((0, 0), (1, 0, 0)), ((2, 1), (1, 2, 1))])
+    yield test, c(moves=[((4, 0), (2, 4, 0)), ((6, 0), (2, 8, 0)),
+        ((5, 0), (2, 5, 0)), ((7, 0), (2, 9, 0)), ((3, 0), (2, 0, 0)),
+        ((8, 0), (3, 0, 0))])
+    yield test, c(moves=[((2, 0), (1, 2, 0)), ((1, 0), (1, 1, 0))])
+
 def test_TextDocumentView_close():
     from editxt.application import Application
     from editxt.editor import Editor
@@ -722,11 +777,38 @@ def test_TextDocument_init():
     })
     assert doc.text_storage is not None
     assert doc.syntaxer is not None
+    eq_(len(doc._line_index), 1)
     eq_(doc._filestat, None)
     eq_(doc.indent_size, 4)
     assert doc.props is not None
     #eq_(doc.save_hooks, [])
 
+def test_TextDocument_line_index():
+    doc = TextDocument.alloc().init()
+    eq_(len(doc.line_index), 1)
+    # the text storage has no delegate: the index is rebuilt on access
+    doc.text_storage.replaceCharactersInRange_withString_((0, 0), u"abc\ndef")
+    lines = doc.line_index
+    eq_(len(lines), 2)
+    eq_(lines.line_start(1), 4)
+    eq_(lines.line_at(7), 1)
+
+def test_TextDocument_reset_text_indexes():
+    doc = TextDocument.alloc().init()
+    ts = doc.text_storage
+    ts.replaceCharactersInRange_withString_((0, 0), u"abc\ndef")
+    eq_(len(doc.line_index), 2)
+    doc._search_index = object()
+    # replace the text with text of the same length (as a file read does)
+    data = NSString.stringWithString_(u"abcdefg") \
+        .dataUsingEncoding_(NSUTF8StringEncoding)
+    ok, err = doc.readFromData_ofType_error_(data, const.TEXT_DOCUMENT, None)
+    assert ok, err
+    eq_(ts.string(), u"abcdefg")
+    eq_(len(doc.line_index), 1)
+    eq_(doc.line_index.line_at(7), 0)
+    eq_(doc._search_index, None)
+
 def property_value_util(c, doc=None):
     if doc is None:
         doc = TextDocument.alloc().init()
@@ -1003,6 +1085,7 @@ def test_reload_document():
             # TODO reload without undo
             doc_ts.replaceCharactersInRange_withString_(range, text)
             undo.removeAllActions()
+            m.method(doc.reset_text_indexes)()
             return end()
         if tv.shouldChangeTextInRange_replacementString_(range, text) >> True:
             # TODO get edit_state of each document view
@@ -1019,6 +1102,7 @@ def test_reload_document():
             perform_clear_undo("_clearChanges", doc, 0)
             tv.setSelectedRange_(NSRange(0, 0)) # TODO remove
             m.method(doc.update_syntaxer)()
+        m.method(doc.reset_text_indexes)()
         end()
     from editxt.test.util import profile
     c = TestConfig(url_is_none=False, exists=True, is_reg_file=True,
@@ -1188,6 +1272,7 @@ def test_analyze_content():
             doc.indent_size = c.isize
         with m:
             doc.analyze_content()
+            eq_(doc._line_index.length, len(c.text))
     eols = [(mode, const.EOLS[mode]) for mode in [
         const.NEWLINE_MODE_UNIX,
         const.NEWLINE_MODE_MAC,
@@ -1209,6 +1294,8 @@ def test_analyze_content():
     yield test, c(text=u"  x", imode=SPC, isize=2)
     yield test, c(text=u"  \n   x", imode=SPC, isize=3, eol=const.NEWLINE_MODE_UNIX)
     yield test, c(text=u"  x\n     x", imode=SPC, isize=2, eol=const.NEWLINE_MODE_UNIX)
+    yield test, c(text=u"  \n\tx\n  x", imode=TAB, eol=const.NEWLINE_MODE_UNIX)
+    yield test, c(text=u"x\n \t x", imode=SPC, isize=1, eol=const.NEWLINE_MODE_UNIX)
 
 def test_makeWindowControllers():
     def test(ed_is_none):
@@ -1242,17 +1329,66 @@ def test_get_syntaxdef():
         eq_(doc.syntaxdef, sd)
 
 def test_set_syntaxdef():
-    from editxt.syntax import SyntaxCache, SyntaxDefinition
+    from editxt.application import Application
+    from editxt.syntax import SyntaxCache, SyntaxDefinition, SyntaxFactory
     m = Mocker()
     sd = m.mock(SyntaxDefinition)
+    app = m.replace("editxt.app", type=Application)
     doc = TextDocument.alloc().init()
     syn = doc.syntaxer = m.mock(SyntaxCache)
     with m.order():
+        (app.syntax_factory >> m.mock(SyntaxFactory)).link_nested(sd)
         syn.syntaxdef = sd
         syn.color_text(doc.text_storage)
     with m:
         doc.syntaxdef = sd
 
+def test_TextDocument_color_text():
+    from editxt.application import Application
+    from editxt.syntax import SyntaxCache, Highlighter
+    def test(c):
+        m = Mocker()
+        app = m.replace("editxt.app", type=Application)
+        hl_class = m.replace("editxt.document.Highlighter")
+        doc = TextDocument.alloc().init()
+        ts = doc.text_storage = m.mock(NSTextStorage)
+        syn = doc.syntaxer = m.mock(SyntaxCache)
+        if c.running:
+            old = doc.highlighter = m.mock(Highlighter)
+            old.stop()
+        background = c.offset > 0 or c.length >= const.SYNTAX_BACKGROUND_THRESHOLD
+        if c.offset == 0:
+            ts.length() >> c.length
+        if not background:
+            syn.color_text(ts)
+        elif c.offset == 0 and (m.method(doc.restore_highlight)() >> c.restored):
+            background = False
+        else:
+            hl = hl_class.alloc().init(syn, ts, c.offset) >> m.mock(Highlighter)
+            views = []
+            for has_text_view in (True, False):
+                view = m.mock(TextDocumentView)
+                views.append(view)
+                if has_text_view:
+                    view.text_view >> m.mock(NSTextView)
+                    hl.show(view.visible_range() >> (0, 10))
+                else:
+                    view.text_view >> None
+            app.iter_views_of_document(doc) >> views
+        with m:
+            if c.offset:
+                doc.color_text(c.offset)
+            else:
+                doc.color_text()
+            eq_(doc.highlighter, (hl if background else None))
+    c = TestConfig(running=False, length=100, offset=0, restored=False)
+    yield test, c
+    yield test, c(running=True)
+    yield test, c(offset=50)
+    yield test, c(length=const.SYNTAX_BACKGROUND_THRESHOLD)
+    yield test, c(length=const.SYNTAX_BACKGROUND_THRESHOLD, running=True)
+    yield test, c(length=const.SYNTAX_BACKGROUND_THRESHOLD, restored=True)
+
 def test_update_syntaxer():
     from editxt.syntax import SyntaxCache, SyntaxDefinition
     def test(c):
@@ -1274,7 +1410,7 @@ def test_update_syntaxer():
             doc.syntaxdef >> (None if c.newdef else sdef)
             if c.newdef:
                 doc.props.syntaxdef = sdef
-                syn.color_text(ts)
+                m.method(doc.color_text)()
         with m:
             doc.update_syntaxer()
     c = TestConfig(delset=False, namechange=False)
@@ -1292,16 +1428,102 @@ def test_TextDocument_comment_token():
     with m:
         eq_(doc.comment_token, "#")
 
+def test_TextDocument_search_index():
+    from editxt.trigram import TrigramIndex
+    def test(length, indexed):
+        m = Mocker()
+        doc = TextDocument.alloc().init()
+        ts = doc.text_storage = m.mock(NSTextStorage)
+        ts.length() >> length
+        with m:
+            index = doc.search_index
+            if indexed:
+                assert isinstance(index, TrigramIndex), index
+                assert doc.search_index is index
+            else:
+                eq_(index, None)
+    yield test, 0, False
+    yield test, const.SEARCH_INDEX_THRESHOLD - 1, False
+    yield test, const.SEARCH_INDEX_THRESHOLD, True
+
+def test_TextDocument_replace_ranges():
+    def test(ranges, strings, edits):
+        m = Mocker()
+        doc = TextDocument.alloc().init()
+        ts = doc.text_storage = m.mock(NSTextStorage)
+        ranges = [NSRange(*r) for r in ranges]
+        with m.order():
+            ts.beginEditing()
+            for rng, value in reversed(zip(ranges, strings)):
+                ts.replaceCharactersInRange_withString_(rng, value)
+            def end():
+                # the edits are processed when editing ends
+                eq_(doc._edits, edits)
+            ts.endEditing()
+            m.call(end)
+        with m:
+            doc.replace_ranges(ranges, strings)
+        eq_(doc._edits, None)
+    yield test, [(0, 3), (8, 3)], [u"x", u"xyzw"], [(0, 1, -2), (6, 4, 1)]
+    yield test, [(1, 1), (3, 1)], [u"", u"\r\n"], [(1, 0, -1), (2, 2, 1)]
+    yield test, [], [], []
+
 def test_textStorageDidProcessEditing_():
-    from editxt.syntax import SyntaxCache
-    m = Mocker()
-    doc = TextDocument.alloc().init()
-    ts = doc.text_storage = m.mock(NSTextStorage)
-    syn = doc.syntaxer = m.mock(SyntaxCache)
-    range = ts.editedRange() >> m.mock(NSRange)
-    syn.color_text(ts, range)
-    with m:
-        doc.textStorageDidProcessEditing_(None)
+    from editxt.lineindex import LineIndex
+    from editxt.syntax import SyntaxCache, Highlighter
+    from editxt.trigram import TrigramIndex
+    def test(c):
+        m = Mocker()
+        doc = TextDocument.alloc().init()
+        ts = doc.text_storage = m.mock(NSTextStorage)
+        syn = doc.syntaxer = m.mock(SyntaxCache)
+        lines = doc._line_index = m.mock(LineIndex)
+        if c.indexed:
+            index = doc._search_index = m.mock(TrigramIndex)
+        doc._edits = c.edits
+        range = ts.editedRange() >> m.mock(NSRange)
+        ts.editedMask() >> c.mask
+        if c.mask & NSTextStorageEditedCharacters:
+            (ts.changeInLength() << 3).count(1, 2)
+            text = ts.string() >> "<text>"
+            if c.edits is None:
+                (range.location << 1).count(1, 2)
+                (range.length << 2).count(1, 2)
+                lines.text_edited(text, 1, 2, 3)
+                if c.indexed:
+                    index.text_edited(text, 1, 2, 3)
+            else:
+                lines.batch_edited(text, c.edits)
+                if c.indexed:
+                    index.batch_edited(text, c.edits)
+        syn.color_text(ts, range, ANY, c.edits) >> c.offset
+        if c.highlighter:
+            hl = doc.highlighter = m.mock(Highlighter)
+            hl.running >> c.running
+        if c.highlighter and c.running:
+            if c.mask & NSTextStorageEditedCharacters:
+                hl.text_edited(range, 3, c.offset)
+        elif c.offset is not None:
+            m.method(doc.color_text)(c.offset)
+        with m:
+            doc.textStorageDidProcessEditing_(None)
+    c = TestConfig(highlighter=False, offset=None, running=True,
+        mask=NSTextStorageEditedAttributes, indexed=False, edits=None)
+    yield test, c
+    yield test, c(offset=42)
+    yield test, c(mask=NSTextStorageEditedCharacters)
+    yield test, c(mask=NSTextStorageEditedCharacters, indexed=True)
+    yield test, c(mask=NSTextStorageEditedAttributes, indexed=True)
+    edits = [(1, 0, -1), (4, 2, 1)]
+    yield test, c(mask=NSTextStorageEditedCharacters, edits=edits)
+    yield test, c(mask=NSTextStorageEditedCharacters, edits=edits, indexed=True)
+    yield test, c(highlighter=True, mask=NSTextStorageEditedAttributes)
+    yield test, c(highlighter=True, mask=NSTextStorageEditedCharacters)
+    yield test, c(highlighter=True, mask=NSTextStorageEditedCharacters, offset=42)
+    yield test, c(highlighter=True,
+        mask=NSTextStorageEditedCharacters | NSTextStorageEditedAttributes)
+    yield test, c(highlighter=True, running=False)
+    yield test, c(highlighter=True, running=False, offset=42)
 
 def test_updateChangeCount_():
     from editxt.application import Application
@@ -1354,6 +1576,7 @@ def test_TextDocument_close():
     wc = m.mock(EditorWindowController)
     wcs() >> [wc]
     rwc(wc)
+    m.method(doc.save_highlight)()
     with m:
         doc.close()
     assert doc.text_storage is None
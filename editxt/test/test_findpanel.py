@@ -22,6 +22,7 @@ from __future__ import with_statement
 import logging
 import os
 from contextlib import closing
+from functools import partial
 from tempfile import gettempdir
 
 from AppKit import *
@@ -33,7 +34,8 @@ from editxt.test.util import TestConfig, untested, check_app_state
 import editxt.constants as const
 from editxt.controls.textview import TextView
 from editxt.findpanel import FindController, FindOptions, FoundRange
-from editxt.findpanel import FORWARD, BACKWARD
+from editxt.findpanel import SearchMonitor, FORWARD, BACKWARD
+from editxt.search import LITERAL, REGEX, WORD, count_matches
 
 log = logging.getLogger(__name__)
 
@@ -271,6 +273,7 @@ def test_FindController_find():
         if c.has_tv and c.ftext:
             text = tv.string() >> "<text>"
             sel = tv.selectedRange() >> (1, 2)
+            m.method(fc.background_mode)(text, c.ftext) >> None
             range = _find(text, c.ftext, sel, direction) >> ("<range>" if c.found else None)
             if c.found:
                 tv.setSelectedRange_(range)
@@ -287,7 +290,6 @@ def test_FindController_find():
     yield test, c(found=True)
 
 def test_FindController__find():
-    import re
     from editxt.findpanel import WRAPTOKEN
     def test(c):
         m = Mocker()
@@ -302,8 +304,7 @@ def test_FindController__find():
         if opts.regular_expression >> c.regex:
             finditer = regexfind
         elif opts.match_entire_word >> c.mword:
-            finditer = regexfind
-            ftext = u"\\b" + re.escape(ftext) + u"\\b"
+            finditer = partial(regexfind, mode=WORD)
         else:
             finditer = simplefind
         range = NSMakeRange(sel.location, 0)
@@ -336,7 +337,6 @@ def test_FindController__find():
     yield test, c(matches=[(1, 2), (2, 2)])
 
 def test_FindController__replace_all():
-    import re
     def test(c):
         m = Mocker()
         fc = FindController.shared_controller()
@@ -353,33 +353,27 @@ def test_FindController__replace_all():
                     range = NSMakeRange(0, 0)
                 else:
                     range = NSMakeRange(range[0], len(text) - range[0])
+            m.method(fc.background_mode)(text, ftext) >> None
             if opts.regular_expression >> c.regex:
                 finditer = m.method(fc.regexfinditer)
             elif opts.match_entire_word >> c.mword:
-                ftext = u"\\b" + re.escape(ftext) + u"\\b"
-                finditer = m.method(fc.regexfinditer)
+                finditer = partial(m.method(fc.regexfinditer), mode=WORD)
             else:
                 finditer = m.method(fc.simplefinditer)
             rtext = m.property(fc, "replace_value").value >> c.rtext
-            found = None
             ranges = []
             rtexts = []
             items = []
             for r in c.ranges:
                 found = FoundRange(NSMakeRange(*r))
-                if ranges:
-                    rtexts.append(text[sum(ranges[-1]):r[0]])
                 ranges.append(found.range)
                 rtexts.append(rtext)
                 items.append(found)
             finditer(text, ftext, range, FORWARD, False) >> items
             if ranges:
-                start = c.ranges[0][0]
-                range = NSMakeRange(start, sum(c.ranges[-1]) - start)
-                value = "".join(rtexts)
-                if tv.shouldChangeTextInRange_replacementString_(range, value) >> c.replace:
-                    ts = tv.textStorage() >> m.mock(NSTextStorage)
-                    ts.replaceCharactersInRange_withString_(range, value)
+                values = [NSValue.valueWithRange_(r) for r in ranges]
+                if tv.shouldChangeTextInRanges_replacementStrings_(values, rtexts) >> c.replace:
+                    tv.doc_view.document.replace_ranges(ranges, rtexts)
                     tv.didChangeText()
                     tv.setNeedsDisplay_(True)
                     dobeep = False
@@ -403,7 +397,6 @@ def test_FindController__replace_all():
     yield test, c(ranges=[(1, 1), (4, 1)], beep=False)
 
 def test_FindController_count_occurrences():
-    import re
     def test(c):
         m = Mocker()
         beep = m.replace(NSBeep, passthrough=False)
@@ -416,12 +409,12 @@ def test_FindController_count_occurrences():
             ftext = u"<find>"
             text = tv.string() >> NSString.stringWithString_("<text>")
             opts = m.property(fc, "opts").value >> m.mock(FindOptions)
+            m.method(fc.background_mode)(text, ftext, c.allow_regex) >> None
             range = NSMakeRange(0, text.length())
             if c.allow_regex and (opts.regular_expression >> c.regex):
                 finditer = regexfind
             elif c.allow_regex and (opts.match_entire_word >> c.mword):
-                finditer = regexfind
-                ftext = u"\\b" + re.escape(ftext) + u"\\b"
+                finditer = partial(regexfind, mode=WORD)
             else:
                 finditer = simplefind
             finditer(text, ftext, range, FORWARD, False) >> xrange(c.cnt)
@@ -441,6 +434,119 @@ def test_FindController_count_occurrences():
     yield test, c(mword=True)
     yield test, c(cnt=42)
 
+def test_FindController_count_occurrences_in_background():
+    m = Mocker()
+    fc = FindController.shared_controller()
+    tv = m.method(fc.find_target)() >> m.mock(TextView)
+    text = tv.string() >> u"<text>"
+    m.method(fc.background_mode)(text, u"<find>", True) >> REGEX
+    run = m.method(fc.run_search)
+    run(tv, u"<find>", REGEX, u"Counting", count_matches, (0, 6), ANY)
+    with m:
+        fc.count_occurrences(u"<find>", True)
+
+def test_FindController_background_mode():
+    from editxt.trigram import TrigramIndex
+    def test(c):
+        m = Mocker()
+        fc = FindController.shared_controller()
+        opts = m.property(fc, "opts").value >> m.mock(FindOptions)
+        (opts.regular_expression << c.regex).count(0, 1)
+        (opts.match_entire_word << c.mword).count(0, 1)
+        text = u"x" * c.size
+        index = m.mock(TrigramIndex) if c.indexed else None
+        (m.method(fc.search_index)(text) << index).count(0, 1)
+        with m:
+            eq_(fc.background_mode(text, c.ftext), c.mode)
+    big = const.SEARCH_JOB_THRESHOLD
+    c = TestConfig(regex=False, mword=False, ftext=u"(a+)+b", size=10,
+                   indexed=False, mode=None)
+    yield test, c
+    yield test, c(size=big, mode=LITERAL)
+    yield test, c(size=big, mword=True, mode=WORD)
+    yield test, c(size=big, regex=True, mode=REGEX)
+    yield test, c(regex=True, ftext=u"a+b")
+    yield test, c(regex=True, mode=REGEX)
+    yield test, c(regex=True, ftext=u"(a+")
+    # indexed literal and word searches are fast at any size
+    yield test, c(size=big, indexed=True)
+    yield test, c(size=big, indexed=True, mword=True)
+    yield test, c(size=big, indexed=True, ftext=u"ab", mode=LITERAL)
+    yield test, c(size=big, indexed=True, ftext=u"\xe9t\xe9", mode=LITERAL)
+    yield test, c(size=big, indexed=True, regex=True, ftext=u"a+b", mode=REGEX)
+
+def test_FindController_stop_search():
+    def test(c):
+        m = Mocker()
+        fc = FindController.shared_controller()
+        flash = m.method(fc.flash_status_text)
+        monitor = m.mock(SearchMonitor) if c.has_monitor else None
+        if c.has_monitor:
+            monitor.stop() >> c.running
+            if c.running:
+                flash(u"Search stopped")
+        fc.search_monitor = monitor
+        with m:
+            eq_(fc.stop_search(), c.running)
+        eq_(fc.search_monitor, None)
+    c = TestConfig(has_monitor=True, running=False)
+    yield test, c(has_monitor=False)
+    yield test, c
+    yield test, c(running=True)
+
+def test_FindController_search_index():
+    from editxt.trigram import TrigramIndex
+    def test(c):
+        m = Mocker()
+        fc = FindController.shared_controller()
+        tv = m.method(fc.find_target)() >> (m.mock(TextView) if c.has_tv else None)
+        if c.has_tv:
+            index = tv.doc_view.document.search_index >> \
+                (m.mock(TrigramIndex) if c.indexed else None)
+            if c.indexed:
+                index.ready_for("<text>") >> c.ready
+        with m:
+            result = fc.search_index("<text>")
+            if c.has_tv and c.indexed and c.ready:
+                eq_(result, index)
+            else:
+                eq_(result, None)
+    c = TestConfig(has_tv=False, indexed=True, ready=True)
+    yield test, c
+    yield test, c(has_tv=True, indexed=False)
+    yield test, c(has_tv=True, ready=False)
+    yield test, c(has_tv=True)
+
+def test_range_of_string():
+    from editxt.findpanel import range_of_string
+    from editxt.trigram import TrigramIndex
+    def test(c):
+        m = Mocker()
+        text = m.mock(NSString)
+        index = m.mock(TrigramIndex) if c.indexed else None
+        range = NSMakeRange(5, 100)
+        if c.indexed:
+            index.candidates("abc", 5, 105, c.backward) >> c.candidates
+            for rng, found in zip(c.searched, c.found):
+                text.rangeOfString_options_range_("abc", c.opts,
+                    NSMakeRange(*rng)) >> NSMakeRange(*found)
+        else:
+            text.rangeOfString_options_range_("abc", c.opts, range) >> (10, 3)
+        with m:
+            result = range_of_string(text, "abc", c.opts, range, index)
+            eq_(result, NSMakeRange(*c.result))
+    c = TestConfig(indexed=False, opts=0, backward=False, result=(10, 3))
+    yield test, c
+    c = c(indexed=True, candidates=[(10, 20), (50, 104)])
+    yield test, c(searched=[(10, 12)], found=[(15, 3)], result=(15, 3))
+    yield test, c(searched=[(10, 12), (50, 55)], found=[(NSNotFound, 0), (60, 3)],
+        result=(60, 3))
+    yield test, c(searched=[(10, 12), (50, 55)], result=(NSNotFound, 0),
+        found=[(NSNotFound, 0), (NSNotFound, 0)])
+    yield test, c(opts=NSBackwardsSearch, backward=True,
+        candidates=[(50, 104), (10, 20)],
+        searched=[(50, 55)], found=[(60, 3)], result=(60, 3))
+
 def test_FindController_find_target():
     from editxt.editor import Editor
     from editxt.document import TextDocumentView
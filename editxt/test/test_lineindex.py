@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2012 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+import logging
+import random
+
+from nose.tools import *
+
+from editxt.lineindex import LineIndex, visual_column
+
+log = logging.getLogger(__name__)
+
+
+def starts(lines):
+    return [lines.line_start(i) for i in xrange(len(lines))]
+
+def test_LineIndex():
+    def test(text, result):
+        lines = LineIndex(text)
+        eq_(starts(lines), result)
+        eq_(lines.length, len(text))
+    yield test, u"", [0]
+    yield test, u"abc", [0]
+    yield test, u"abc\n", [0, 4]
+    yield test, u"a\nb\rc\r\nd\u2028e", [0, 2, 4, 7, 9]
+    yield test, u"\n\r\n\r\r", [0, 1, 3, 4, 5]
+
+def test_LineIndex_line_at():
+    lines = LineIndex(u"ab\ncd\r\n\nef")
+    eq_([lines.line_at(i) for i in xrange(11)], [0, 0, 0, 1, 1, 1, 1, 2, 3, 3, 3])
+    eq_(lines.line_at(-1), 0)
+    eq_(lines.line_at(100), 3)
+
+def test_LineIndex_line_range():
+    lines = LineIndex(u"ab\ncd\r\n\nef")
+    eq_([lines.line_range(i) for i in xrange(4)], [(0, 3), (3, 7), (7, 8), (8, 10)])
+    eq_(lines.line_range(-1), (8, 10))
+    eq_(lines.line_start(-1), 8)
+
+def test_LineIndex_line_ranges():
+    def test(range, result):
+        lines = LineIndex(u"ab\ncd\r\n\nef\n")
+        eq_(list(lines.line_ranges(*range)), result)
+    yield test, (0, 0), []
+    yield test, (0, 1), [(0, 3)]
+    yield test, (0, 3), [(0, 3)]
+    yield test, (2, 4), [(0, 3), (3, 7)]
+    yield test, (7, 11), [(7, 8), (8, 11)]
+    yield test, (0, 11), [(0, 3), (3, 7), (7, 8), (8, 11)]
+    yield test, (11, 12), [(11, 11)]
+
+def test_LineIndex_text_edited():
+    def test(text, index, length, value, result):
+        lines = LineIndex(text)
+        text = text[:index] + value + text[index + length:]
+        lines.text_edited(text, index, len(value), len(value) - length)
+        eq_(starts(lines), result)
+        eq_(starts(lines), starts(LineIndex(text)))
+    yield test, u"ab\ncd", 1, 0, u"x", [0, 4]
+    yield test, u"ab\ncd", 1, 0, u"\n", [0, 2, 4]
+    yield test, u"ab\ncd", 2, 1, u"", [0]
+    yield test, u"a\rb", 2, 0, u"\n", [0, 3]
+    yield test, u"a\r\nb", 2, 1, u"", [0, 2]
+    yield test, u"a\nb", 1, 0, u"\r", [0, 3]
+    yield test, u"a\r\nb", 2, 0, u"x", [0, 2, 4]
+    yield test, u"a\nb\nc\nd", 1, 4, u"", [0, 2]
+    yield test, u"a\nb\nc\nd", 0, 7, u"\n\n", [0, 1, 2]
+
+def test_LineIndex_text_edited_lazy():
+    # edits in random places must leave the index equal to a new index
+    chars = u"ab\n\r\u2028"
+    rand = random.Random(42)
+    for n in xrange(100):
+        text = u"".join(rand.choice(chars) for i in xrange(rand.randint(0, 30)))
+        lines = LineIndex(text)
+        for x in xrange(20):
+            start = rand.randint(0, len(text))
+            end = rand.randint(start, min(start + 5, len(text)))
+            value = u"".join(rand.choice(chars) for i in xrange(rand.randint(0, 4)))
+            text = text[:start] + value + text[end:]
+            lines.text_edited(text, start, len(value), len(value) - (end - start))
+            eq_(starts(lines), starts(LineIndex(text)), repr(text))
+            eq_(lines.length, len(text))
+
+def random_edits(rand, text, chars):
+    """Replace random (sorted, disjoint) ranges of text
+
+    :returns: A tuple (text, edits); the edited text and a list of edits
+    (see LineIndex.batch_edited).
+    """
+    pos = 0
+    edits = []
+    parts = []
+    delta = 0
+    for x in xrange(rand.randint(1, 6)):
+        start = rand.randint(pos, min(pos + 10, len(text)))
+        end = rand.randint(start, min(start + 5, len(text)))
+        value = u"".join(rand.choice(chars) for i in xrange(rand.randint(0, 4)))
+        parts.extend([text[pos:start], value])
+        edits.append((start + delta, len(value), len(value) - (end - start)))
+        delta += len(value) - (end - start)
+        pos = end
+    parts.append(text[pos:])
+    return u"".join(parts), edits
+
+def test_LineIndex_batch_edited():
+    def test(text, edits, result):
+        lines = LineIndex(text)
+        parts = []
+        pos = 0
+        for start, end, value in edits:
+            parts.extend([text[pos:start], value])
+            pos = end
+        parts.append(text[pos:])
+        text = u"".join(parts)
+        delta = 0
+        batch = []
+        for start, end, value in edits:
+            batch.append((start + delta, len(value), len(value) - (end - start)))
+            delta += len(value) - (end - start)
+        lines.batch_edited(text, batch)
+        eq_(starts(lines), result)
+        eq_(lines.length, len(text))
+    yield test, u"ab\ncd\nef", [(0, 0, u"\n"), (4, 5, u"x")], [0, 1, 4, 7]
+    yield test, u"a\rb", [(1, 2, u"\r"), (2, 2, u"\n")], [0, 3]
+    yield test, u"a\r\nb\nc", [(1, 2, u""), (4, 5, u"\n\n")], [0, 2, 4, 5]
+    # the line starts of unknown changes are found again
+    yield test, u"a\nb", [], [0, 2]
+    lines = LineIndex(u"a\nb")
+    lines.batch_edited(u"a\nb\nc", [(0, 1, 0)])
+    eq_(starts(lines), [0, 2, 4])
+
+def test_LineIndex_batch_edited_random():
+    chars = u"ab\n\r\u2028"
+    rand = random.Random(42)
+    for n in xrange(200):
+        text = u"".join(rand.choice(chars) for i in xrange(rand.randint(0, 30)))
+        lines = LineIndex(text)
+        for x in xrange(5):
+            text, edits = random_edits(rand, text, chars)
+            lines.batch_edited(text, edits)
+            eq_(starts(lines), starts(LineIndex(text)), repr(text))
+            eq_(lines.length, len(text))
+
+def test_LineIndex_text_edited_unknown_change():
+    lines = LineIndex(u"a\nb")
+    lines.text_edited(u"a\nb\nc\n", 0, 1, 0) # length does not match
+    eq_(starts(lines), [0, 2, 4, 6])
+
+def test_LineIndex_version():
+    lines = LineIndex(u"a\nb")
+    version = lines.version
+    lines.text_edited(u"ax\nb", 1, 1, 1)
+    assert lines.version > version
+    version = lines.version
+    lines.reset(u"")
+    assert lines.version > version
+
+def test_visual_column():
+    def test(text, tab_width, result, column=0):
+        eq_(visual_column(text, tab_width, column), result)
+    yield test, u"", 4, 0
+    yield test, u"abc", 4, 3
+    yield test, u"\t", 4, 4
+    yield test, u"a\t", 4, 4
+    yield test, u"abcd\t", 4, 8
+    yield test, u"\t\tx", 4, 9
+    yield test, u"a\tb", 2, 3
+    yield test, u"\t", 0, 1
+    yield test, u"\tx", 4, 5, 3
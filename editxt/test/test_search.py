@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2012 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+import logging
+import random
+import re
+import time
+
+from nose.tools import *
+
+from editxt.search import PatternCache, REGEX, LITERAL, WORD, reverse_finditer
+from editxt.search import (SearchJob, count_matches, find_match, iter_matches,
+    nested_quantifiers, replace_matches)
+
+log = logging.getLogger(__name__)
+
+FLAGS = re.UNICODE | re.MULTILINE
+
+def spans(matches):
+    return [m.span() for m in matches]
+
+def test_reverse_finditer():
+    def test(pattern, text, start=0, end=None, size=8, overlap=3):
+        regex = re.compile(pattern, FLAGS)
+        stop = len(text) if end is None else end
+        eq_(spans(reverse_finditer(regex.finditer, text, start, end, size, overlap)),
+            spans(reversed(list(regex.finditer(text, start, stop)))))
+    text = u"abc\nab abc\nxyz\nabc"
+    yield test, u"abc", u""
+    yield test, u"abc", text
+    yield test, u"abc", text, 2, 16
+    yield test, u"^a", text
+    yield test, u"c$", text
+    yield test, u"$", text
+    yield test, u"x*", text
+    yield test, u"c\nx", text
+    yield test, u"(?s)b.*?x", text # longer than the overlap
+    yield test, u"(?s)a.*", text
+    yield test, u"q", text
+
+def test_reverse_finditer_random():
+    patterns = [u"a", u"ab*", u"^a", u"a$", u"x*", u"a\nb", u"\\bab",
+        u"(?s)a.*?b", u"a[^b]{0,30}b"]
+    def test(seed):
+        rand = random.Random(seed)
+        text = u"".join(rand.choice(u"aabbx \n")
+            for i in xrange(rand.randint(0, 300)))
+        regex = re.compile(rand.choice(patterns), FLAGS)
+        start = rand.randint(0, len(text))
+        end = rand.randint(start, len(text))
+        eq_(spans(reverse_finditer(regex.finditer, text, start, end,
+                                   rand.randint(60, 100), 30)),
+            spans(reversed(list(regex.finditer(text, start, end)))),
+            (regex.pattern, text, start, end))
+    for seed in xrange(200):
+        yield test, seed
+
+def test_reverse_finditer_chained_matches():
+    # matches chained through the overlap may differ from a forward scan,
+    # but they are real matches generated from end to start
+    regex = re.compile(u"(?s)a.{5,20}", FLAGS)
+    rand = random.Random(42)
+    text = u"".join(rand.choice(u"aabbx \n") for i in xrange(1000))
+    matches = list(reverse_finditer(regex.finditer, text, 0, None, 50, 2))
+    assert matches
+    starts = [m.start() for m in matches]
+    eq_(starts, sorted(set(starts), reverse=True))
+    for match in matches:
+        eq_(regex.match(text, match.start()).span(), match.span())
+
+def test_reverse_finditer_scans_near_end():
+    regex = re.compile(u"x")
+    scanned = []
+    def finditer(text, pos, endpos):
+        scanned.append((pos, endpos))
+        return regex.finditer(text, pos, endpos)
+    text = u"x" + u"-" * 10000 + u"x"
+    matches = reverse_finditer(finditer, text, size=100, overlap=10)
+    eq_(matches.next().span(), (10001, 10002))
+    # the first match is confirmed by the scan of the previous window
+    eq_(scanned, [(9903, 10002), (9813, 10002)])
+
+def test_PatternCache_compile():
+    def test(pattern, mode, text, result, flags=0):
+        cache = PatternCache()
+        regex = cache.compile(pattern, flags, mode)
+        eq_([m.group() for m in regex.finditer(text)], result)
+        eq_((cache.hits, cache.misses), (0, 1))
+        assert cache.compile(pattern, flags, mode) is regex
+        eq_((cache.hits, cache.misses), (1, 1))
+    yield test, u"a.c", REGEX, u"abc a.c", [u"abc", u"a.c"]
+    yield test, u"a.c", LITERAL, u"abc a.c", [u"a.c"]
+    yield test, u"ab", WORD, u"ab abc cab ab", [u"ab", u"ab"]
+    yield test, u"a+", WORD, u"a+b a+ a+c", [u"a+", u"a+"]
+    yield test, u"AB", WORD, u"ab abc", [u"ab"], re.IGNORECASE
+
+def test_PatternCache_keys():
+    cache = PatternCache()
+    regex = cache.compile(u"a")
+    assert cache.compile(u"a", re.IGNORECASE) is not regex
+    assert cache.compile(u"a", 0, WORD) is not regex
+    assert cache.compile(u"a", 0, REGEX) is regex
+    eq_((len(cache), cache.hits, cache.misses), (3, 1, 3))
+
+def test_PatternCache_eviction():
+    cache = PatternCache(size=2)
+    cache.compile(u"a")
+    cache.compile(u"b")
+    cache.compile(u"a") # a is used more recently than b
+    cache.compile(u"c")
+    eq_(len(cache), 2)
+    eq_((cache.hits, cache.misses), (1, 3))
+    cache.compile(u"a")
+    eq_((cache.hits, cache.misses), (2, 3))
+    cache.compile(u"b")
+    eq_((cache.hits, cache.misses), (2, 4))
+    cache.clear()
+    eq_(len(cache), 0)
+
+def test_PatternCache_errors():
+    cache = PatternCache()
+    assert_raises(re.error, cache.compile, u"(")
+    assert_raises(ValueError, cache.compile, u"a", 0, "glob")
+    eq_(len(cache), 0)
+
+def test_nested_quantifiers():
+    def test(pattern, result):
+        eq_(nested_quantifiers(pattern), result)
+    yield test, r"abc", []
+    yield test, r"a+b*", []
+    yield test, r"[ru]?'.*?'", []
+    yield test, r"(a+)+b", ["{1,inf}"]
+    yield test, r"(?:\s*x?)*", ["{0,inf}"]
+    yield test, r"(a|b+){2,5}", ["{2,5}"]
+    yield test, r"(?=(a*)*)", ["{0,inf}"]
+    yield test, r"(?:[^\n]{1000}){10}", [] # fixed-length repeat
+    yield test, r"(a?)?", [] # optional is not repeated
+
+def test_iter_matches():
+    def test(location, length, backward, wrap, result):
+        finditer = re.compile(u"ab", FLAGS).finditer
+        text = u"ab ab ab ab"
+        found = iter_matches(finditer, text, location, length, backward, wrap)
+        eq_([None if m is None else m.start() for m in found], result)
+    yield test, 4, 0, False, False, [6, 9]
+    yield test, 4, 0, False, True, [6, 9, None, 0]
+    yield test, 4, 0, True, False, [0]
+    yield test, 5, 0, True, True, [3, 0, None, 9, 6]
+    yield test, 2, 6, False, True, [3, 6]
+    yield test, 2, 6, True, True, [6, 3]
+
+def test_find_match():
+    def test(selection, backward, wrap, result):
+        finditer = re.compile(u"ab", FLAGS).finditer
+        eq_(find_match(noprogress, finditer, u"ab ab ab", selection,
+                       backward, wrap), result)
+    yield test, (1, 0), False, False, (3, 5)
+    yield test, (3, 2), False, False, (6, 8) # skip selected match
+    yield test, (7, 0), False, False, None
+    yield test, (7, 0), False, True, (0, 2)
+    yield test, (3, 2), True, False, (0, 2)
+    yield test, (2, 0), True, False, (0, 2)
+    yield test, (0, 0), True, True, (6, 8)
+    yield test, (0, 2), True, False, None
+
+def noprogress(done, count=0):
+    pass
+
+def run(job):
+    job.start()
+    assert job.join(30), job
+    return job
+
+def test_SearchJob():
+    regex = re.compile(u"a", FLAGS)
+    text = u"abc " * 10000
+    job = run(SearchJob(count_matches, regex, text, (0, len(text))))
+    eq_((job.finished, job.error, job.result), (True, None, 10000))
+    job = run(SearchJob(count_matches, regex, text, (4, 10)))
+    eq_(job.result, 2)
+
+def slow(progress, finditer, text, total):
+    for i in xrange(total):
+        progress(float(i) / total, i)
+        time.sleep(0.01)
+    return total
+
+def test_SearchJob_progress():
+    job = SearchJob(slow, re.compile(u""), u"", (30,))
+    job.interval = 0.05
+    run(job)
+    eq_(job.result, 30)
+    done, count = job.progress
+    assert 0 < done < 1, job.progress
+    assert 0 < count < 30, job.progress
+
+def test_SearchJob_callback():
+    finished = []
+    def callback(job):
+        finished.append((job.finished, job.result))
+    regex = re.compile(u"a", FLAGS)
+    run(SearchJob(count_matches, regex, u"aaa", (0, 3), callback=callback))
+    eq_(finished, [(True, 3)])
+
+def test_SearchJob_replace_matches():
+    regex = re.compile(u"(a)(b)", FLAGS)
+    text = u"ab xab ab"
+    job = run(SearchJob(replace_matches, regex, text, (1, len(text), u"\\2\\1")))
+    eq_(job.result, [(4, 6, u"\\2\\1"), (7, 9, u"\\2\\1")])
+    job = run(SearchJob(replace_matches, regex, text, (0, 9, u"\\2\\1", True)))
+    eq_(job.result, [(0, 2, u"ba"), (4, 6, u"ba"), (7, 9, u"ba")])
+
+def fail(progress, finditer, text):
+    raise ValueError("bad search")
+
+def test_SearchJob_error():
+    job = run(SearchJob(fail, re.compile(u""), u""))
+    eq_((job.result, job.error), (None, "bad search"))
+
+def test_SearchJob_timeout():
+    def test(func, pattern, text, args):
+        start = time.time()
+        job = run(SearchJob(func, re.compile(pattern, FLAGS), text, args, 0.5))
+        eq_((job.result, job.error), (None, "timed out"))
+        assert time.time() - start < 5, time.time() - start
+    # a scan that finds nothing and reports no progress
+    text = u"abcd efgh " * (2 * 1024 * 1024)
+    pattern = u"[a-h ]{1,40}Z"
+    yield test, count_matches, pattern, text, (0, len(text))
+    yield test, find_match, pattern, text, ((0, 0),)
+    # catastrophic backtracking
+    yield test, count_matches, u"(a+)+b", u"a" * 40, (0, 40)
+
+def test_SearchJob_cancel():
+    regex = re.compile(u"(a+)+b", FLAGS) # backtracks forever
+    job = SearchJob(count_matches, regex, u"a" * 40, (0, 40))
+    job.start()
+    assert not job.join(0.5)
+    job.cancel()
+    assert job.join(5), job
+    eq_((job.finished, job.result, job.error), (True, None, "canceled"))
+    assert job._process.poll() is not None
@@ -32,6 +32,7 @@ from editxt.test.util import TestConfig, untested, check_app_state
 
 import editxt.constants as const
 from editxt.controls.textview import TextView
+from editxt.lineindex import LineIndex
 from editxt.sortlines import SortLinesController, sortlines
 
 log = logging.getLogger(__name__)
@@ -70,6 +71,7 @@ jkl 4 1 246
         tv = m.mock(TextView)
         ts = tv.textStorage() >> m.mock(NSTextStorage)
         text = tv.string() >> NSString.stringWithString_(c.text)
+        tv.doc_view.document.line_index >> LineIndex(c.text)
         if opts.sort_selection:
             sel = tv.selectedRange() >> c.sel
             sel = text.lineRangeForRange_(sel)
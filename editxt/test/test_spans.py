@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2012 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+import logging
+from array import array
+
+from nose.tools import *
+
+from editxt.spans import SpanStore
+
+log = logging.getLogger(__name__)
+
+
+def make_store(*spans):
+    store = SpanStore()
+    for start, length, info in spans:
+        store.set(start, length, info)
+    return store
+
+def test_SpanStore_set_get():
+    store = make_store((2, 3, "a"), (7, 1, "b"), (5, 2, "a"))
+    eq_(list(store), [(2, 3, "a"), (5, 2, "a"), (7, 1, "b")])
+    eq_(len(store), 3)
+    eq_(store.infos, ["a", "b"])
+    eq_(store.get(0), None)
+    eq_(store.get(2), (2, 3, "a"))
+    eq_(store.get(4), (2, 3, "a"))
+    eq_(store.get(5), (5, 2, "a"))
+    eq_(store.get(7), (7, 1, "b"))
+    eq_(store.get(8), None)
+
+def test_SpanStore_set_overlap():
+    def test(span, result):
+        store = make_store((2, 3, "a"), (5, 2, "b"), (10, 5, "c"))
+        store.set(*span)
+        eq_(list(store), result)
+    yield test, (0, 1, "x"), [(0, 1, "x"), (2, 3, "a"), (5, 2, "b"), (10, 5, "c")]
+    yield test, (2, 3, "x"), [(2, 3, "x"), (5, 2, "b"), (10, 5, "c")]
+    yield test, (3, 3, "x"), [(2, 1, "a"), (3, 3, "x"), (6, 1, "b"), (10, 5, "c")]
+    yield test, (1, 12, "x"), [(1, 12, "x"), (13, 2, "c")]
+    yield test, (11, 2, "x"), [(2, 3, "a"), (5, 2, "b"), (10, 1, "c"),
+        (11, 2, "x"), (13, 2, "c")]
+    yield test, (16, 2, "x"), [(2, 3, "a"), (5, 2, "b"), (10, 5, "c"), (16, 2, "x")]
+    yield test, (4, 0, "x"), [(2, 3, "a"), (5, 2, "b"), (10, 5, "c")]
+
+def test_SpanStore_clear():
+    def test(range, result):
+        store = make_store((2, 3, "a"), (5, 2, "b"), (10, 5, "c"))
+        store.clear(*range)
+        eq_(list(store), result)
+    yield test, (0, 2), [(2, 3, "a"), (5, 2, "b"), (10, 5, "c")]
+    yield test, (0, 3), [(3, 2, "a"), (5, 2, "b"), (10, 5, "c")]
+    yield test, (4, 2), [(2, 2, "a"), (6, 1, "b"), (10, 5, "c")]
+    yield test, (5, 2), [(2, 3, "a"), (10, 5, "c")]
+    yield test, (11, 2), [(2, 3, "a"), (5, 2, "b"), (10, 1, "c"), (13, 2, "c")]
+    yield test, (3, 100), [(2, 1, "a")]
+    yield test, (0, 100), []
+
+def test_SpanStore_adjust():
+    def test(index, changelen, changed, result):
+        store = make_store((2, 3, "a"), (5, 2, "b"), (10, 5, "c"))
+        eq_(store.adjust(index, changelen), changed)
+        eq_(list(store), result)
+        for start, length, info in result:
+            eq_(store.get(start), (start, length, info))
+            eq_(store.get(start + length - 1), (start, length, info))
+    # insert
+    yield test, 0, 2, (0, 2), [(4, 3, "a"), (7, 2, "b"), (12, 5, "c")]
+    yield test, 2, 2, (2, 2), [(4, 3, "a"), (7, 2, "b"), (12, 5, "c")]
+    yield test, 3, 2, (3, 2), [(2, 5, "a"), (7, 2, "b"), (12, 5, "c")]
+    yield test, 5, 2, (5, 2), [(2, 3, "a"), (7, 2, "b"), (12, 5, "c")]
+    yield test, 8, 2, (8, 2), [(2, 3, "a"), (5, 2, "b"), (12, 5, "c")]
+    yield test, 20, 2, (20, 2), [(2, 3, "a"), (5, 2, "b"), (10, 5, "c")]
+    # delete
+    yield test, 0, -1, (0, 0), [(1, 3, "a"), (4, 2, "b"), (9, 5, "c")]
+    yield test, 7, -2, (7, 0), [(2, 3, "a"), (5, 2, "b"), (8, 5, "c")]
+    yield test, 3, -1, (2, 2), [(4, 2, "b"), (9, 5, "c")]
+    yield test, 5, -2, (5, 0), [(2, 3, "a"), (8, 5, "c")]
+    yield test, 4, -2, (2, 3), [(8, 5, "c")]
+    yield test, 8, -3, (8, 4), [(2, 3, "a"), (5, 2, "b")]
+    yield test, 12, -10, (10, 2), [(2, 3, "a"), (5, 2, "b")]
+
+def test_SpanStore_adjust_lazy():
+    store = make_store(*[(i * 10, 5, "a") for i in range(100)])
+    store.adjust(500, 3)
+    eq_(store.starts.values[49], 490)
+    eq_(store.starts.values[50], 500) # not shifted yet
+    eq_(store.get(503), (503, 5, "a"))
+    store.adjust(504, -1)
+    store.adjust(503, 1)
+    eq_(store.starts.values[50], 510) # still not shifted
+    eq_(store.get(503), None)
+    eq_(store.get(513), (513, 5, "a"))
+    store.adjust(0, 1)
+    eq_(list(store)[:3], [(1, 5, "a"), (11, 5, "a"), (21, 5, "a")])
+    eq_(list(store)[49:52], [(491, 5, "a"), (514, 5, "a"), (524, 5, "a")])
+    eq_(store.get(1000), None)
+    eq_(store.get(994), (994, 5, "a"))
+
+def test_SpanStore_reset():
+    store = make_store((2, 3, "a"), (5, 2, "b"))
+    store.adjust(3, 1)
+    store.reset()
+    eq_(list(store), [])
+    eq_(store.infos, [])
+    store.set(0, 1, "c")
+    eq_(list(store), [(0, 1, "c")])
+
+def test_SpanStore_overlapping():
+    def test(range, result):
+        store = make_store((2, 3, "a"), (5, 2, "b"), (10, 5, "c"))
+        eq_(list(store.overlapping(*range)), result)
+    yield test, (0, 2), []
+    yield test, (0, 3), [(2, 3, "a")]
+    yield test, (4, 2), [(2, 3, "a"), (5, 2, "b")]
+    yield test, (7, 3), []
+    yield test, (6, 100), [(5, 2, "b"), (10, 5, "c")]
+    yield test, (3, 0), []
+
+def test_SpanStore_arrays():
+    store = make_store((2, 3, "a"), (5, 2, "b"), (10, 5, "a"))
+    store.adjust(6, 2) # pending shift
+    starts, lengths, ids, infos = store.arrays()
+    eq_(list(starts), [2, 5, 12])
+    eq_(list(lengths), [3, 4, 5])
+    eq_(list(ids), [0, 1, 0])
+    eq_(infos, ["a", "b"])
+    copy = SpanStore.from_arrays(array("i", starts), array("i", lengths),
+                                 array("i", ids), infos)
+    eq_(list(copy), list(store))
+    copy.set(20, 1, "b")
+    copy.set(21, 1, "c")
+    eq_(list(copy)[-2:], [(20, 1, "b"), (21, 1, "c")])
+    eq_(copy.infos, ["a", "b", "c"])
+    eq_(store.infos, ["a", "b"])
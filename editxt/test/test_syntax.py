@@ -21,6 +21,7 @@ from __future__ import with_statement
 
 import logging
 import os
+import re
 from contextlib import closing
 from tempfile import gettempdir
 
@@ -32,7 +33,7 @@ from editxt.test.util import TestConfig, untested, check_app_state
 
 import editxt.constants as const
 from editxt.syntax import SyntaxFactory, SyntaxCache, SyntaxDefinition
-from editxt.syntax import NoHighlight, PLAIN_TEXT
+from editxt.syntax import NoHighlight, PLAIN_TEXT, RE
 
 log = logging.getLogger(__name__)
 
@@ -48,7 +49,7 @@ def test_SyntaxFactory_load_definitions():
         log = m.replace("editxt.syntax.log", passthrough=False)
         glob = m.replace("glob.glob", passthrough=False)
         exists = m.replace("os.path.exists", passthrough=False)
-        load = sf.load_definition = m.mock()
+        load = sf.read_definition = m.mock()
         if c.path and exists(c.path) >> c.exists:
             info = {
                 "disabled": dict(name="dis", disabled=True, filepatterns=[]), # should cause info log
@@ -137,6 +138,147 @@ def test_SyntaxFactory_load_definition():
     yield test, c(info=dict(name="text", filepatterns=["*.txt"], comment_token="X"))
     yield test, c(info=dict(name="text", filepatterns=["*.txt"]))
 
+def test_SyntaxFactory_read_definition():
+    from shutil import rmtree
+    from tempfile import mkdtemp
+    from editxt.syntax import LazySyntaxDefinition
+    def test(c):
+        tmp = mkdtemp()
+        try:
+            filename = os.path.join(tmp, "test" + const.SYNTAX_DEF_EXTENSION)
+            with open(filename, "w") as fh:
+                fh.write(c.source)
+            sdef = SyntaxFactory().read_definition(filename)
+            eq_(isinstance(sdef, LazySyntaxDefinition), c.lazy)
+            if c.lazy:
+                assert not sdef.loaded
+            eq_(sdef.name, "Test")
+            eq_(set(sdef.filepatterns), set(["*.test"]))
+            eq_(sdef.disabled, c.disabled)
+            eq_(sdef.comment_token, "#")
+            if c.lazy:
+                assert sdef.loaded
+        finally:
+            rmtree(tmp)
+    c = TestConfig(lazy=True, disabled=False)
+    source = 'name = "Test"\nfilepatterns = %s\ncomment_token = "#"\n'
+    yield test, c(source=source % '["*.test"]')
+    yield test, c(source=source % '["*.test"]' + "disabled = True\n", disabled=True)
+    yield test, c(source=source % '"*.test".split()', lazy=False)
+    yield test, c(source=source % '["*.test"]' +
+        "disabled = bool(1)\n", lazy=False, disabled=True)
+    yield test, c(source=source % '["*.test"]' +
+        "from editxt.syntax import NoHighlight\n"
+        "class SyntaxDefinition(NoHighlight):\n"
+        "    def __init__(self, filename, name, filepatterns, comment_token, **kw):\n"
+        "        NoHighlight.__init__(self, name, comment_token)\n"
+        "        self.filepatterns = filepatterns\n", lazy=False)
+
+def test_LazySyntaxDefinition():
+    from editxt.syntax import LazySyntaxDefinition
+    m = Mocker()
+    sf = m.mock(SyntaxFactory)
+    sdef = m.mock(SyntaxDefinition)
+    sf.load_definition("/path/to/file") >> sdef
+    sdef.comment_token >> "#"
+    sdef.scan >> "<scan>"
+    with m:
+        lazy = LazySyntaxDefinition(sf, "/path/to/file", "Test", ["*.test"])
+        eq_(lazy.name, "Test")
+        eq_(lazy.filepatterns, set(["*.test"]))
+        eq_(lazy.disabled, False)
+        assert not lazy.loaded
+        eq_(lazy.comment_token, "#")
+        assert lazy.loaded
+        eq_(lazy.scan, "<scan>")
+
+def test_LazySyntaxDefinition_load_error():
+    from editxt.syntax import LazySyntaxDefinition
+    m = Mocker()
+    sf = m.mock(SyntaxFactory)
+    log = m.replace("editxt.syntax.log", passthrough=False)
+    expect(sf.load_definition("/path/to/file")).throw(Exception("bad"))
+    log.error(ANY, "/path/to/file", exc_info=True)
+    with m:
+        lazy = LazySyntaxDefinition(sf, "/path/to/file", "Test", ["*.test"])
+        eq_(lazy.load(), PLAIN_TEXT)
+        eq_(lazy.load(), PLAIN_TEXT)
+        eq_(lazy.name, "Test")
+
+def test_SyntaxFactory_get_definition_loads_lazy_definition():
+    from editxt.syntax import LazySyntaxDefinition
+    m = Mocker()
+    sf = SyntaxFactory()
+    lazy = m.mock(LazySyntaxDefinition)
+    sf.registry["*.test"] = lazy
+    lazy.loaded >> False
+    lazy.load()
+    with m:
+        eq_(sf.get_definition("file.test"), lazy)
+        eq_(sf.get_definition("file.test"), lazy)
+
+def test_DefinitionCache():
+    from shutil import rmtree
+    from tempfile import mkdtemp
+    from editxt.syntax import DefinitionCache
+    tmp = mkdtemp()
+    try:
+        path = os.path.join(tmp, "cache", const.SYNTAX_CACHE_FILE)
+        sdef = SyntaxDefinition("/defs/test.syntax.py", "Test", ["*.test"],
+            [(["else"], "0000FF")], [('"', ['"'], "00FF00", None)])
+        cache = DefinitionCache(path, "1.0")
+        eq_(cache.get_header("/defs/test.syntax.py", 1), None)
+        cache.set_header("/defs/a.syntax.py", 1, dict(name="A", filepatterns=set(["*.a"])))
+        cache.set_definition("/defs/test.syntax.py", 2, sdef)
+        cache.save()
+        assert not cache.dirty
+
+        cache = DefinitionCache(path, "1.0")
+        eq_(cache.get_header("/defs/a.syntax.py", 1), dict(name="A", filepatterns=["*.a"]))
+        eq_(cache.get_header("/defs/a.syntax.py", 3), None) # file changed
+        eq_(cache.get_definition("/defs/a.syntax.py", 1), None) # not loaded
+        eq_(cache.get_header("/defs/test.syntax.py", 2),
+            dict(name="Test", filepatterns=["*.test"], disabled=False))
+        loaded = cache.get_definition("/defs/test.syntax.py", 2)
+        eq_(loaded.name, "Test")
+        eq_(loaded.regex.pattern, sdef.regex.pattern)
+        eq_(loaded.wordinfo, sdef.wordinfo)
+        cache.prune("/defs", ["/defs/test.syntax.py"])
+        eq_(sorted(cache.entries), ["/defs/test.syntax.py"])
+
+        cache = DefinitionCache(path, "2.0") # new version
+        eq_(cache.entries, {})
+    finally:
+        rmtree(tmp)
+
+def test_SyntaxFactory_read_definition_cached():
+    from shutil import rmtree
+    from tempfile import mkdtemp
+    from editxt.syntax import DefinitionCache, LazySyntaxDefinition
+    tmp = mkdtemp()
+    try:
+        filename = os.path.join(tmp, "test" + const.SYNTAX_DEF_EXTENSION)
+        with open(filename, "w") as fh:
+            fh.write('name = "Test"\nfilepatterns = ["*.test"]\n')
+        cache = DefinitionCache(os.path.join(tmp, const.SYNTAX_CACHE_FILE), "1.0")
+        sf = SyntaxFactory(cache)
+        sf.load_definitions(tmp)
+        eq_(sf.get_definition("x.test").comment_token, "")
+        cache.save()
+
+        m = Mocker()
+        execf = m.replace(execfile, passthrough=False)
+        parse = m.replace("ast.parse", passthrough=False)
+        with m:
+            cache = DefinitionCache(cache.path, "1.0")
+            sf = SyntaxFactory(cache)
+            sdef = sf.read_definition(filename)
+            assert isinstance(sdef, LazySyntaxDefinition), sdef
+            eq_(sdef.name, "Test")
+            eq_(sdef.load().name, "Test") # unpickled, not executed
+    finally:
+        rmtree(tmp)
+
 def test_SyntaxFactory_index_definitions():
     from editxt.valuetrans import SyntaxDefTransformer
     class FakeDef(object):
@@ -170,6 +312,180 @@ def test_SyntaxFactory_get_definition():
     eq_(sf.get_definition("somefile.txt"), "<syntax def>")
     eq_(sf.get_definition("somefile.text"), PLAIN_TEXT)
 
+def test_SyntaxFactory_get_definition_precedence():
+    def test(filename, result):
+        sf = SyntaxFactory()
+        for pattern in ["*.py", "test_*.py", "*.gz", "*.tar.gz", "Makefile",
+                        "[Mm]akefile", "*.htm?", "*rc", "*"]:
+            sf.registry[pattern] = pattern
+        eq_(sf.get_definition(filename), result)
+    yield test, "a.txt", PLAIN_TEXT
+    yield test, "a.b.py", "*.py"
+    yield test, "test_a.py", "test_*.py"
+    yield test, "a.gz", "*.gz"
+    yield test, "a.tar.gz", "*.tar.gz"
+    yield test, "Makefile", "Makefile"
+    yield test, "makefile", "[Mm]akefile"
+    yield test, "a.html", "*.htm?"
+    yield test, ".bashrc", "*rc"
+    yield test, "README", "*"
+
+def test_SyntaxFactory_get_definition_cache():
+    m = Mocker()
+    sf = SyntaxFactory()
+    find = sf._find_definition = m.mock()
+    find("a.py") >> "<python>"
+    find("a.txt") >> PLAIN_TEXT
+    find("a.py") >> "<python 2>"
+    with m:
+        eq_(sf.get_definition("a.py"), "<python>")
+        eq_(sf.get_definition("a.txt"), PLAIN_TEXT)
+        eq_(sf.get_definition("a.py"), "<python>")
+        sf.invalidate()
+        eq_(sf.get_definition("a.py"), "<python 2>")
+
+def test_SyntaxFactory_get_definition_cache_size():
+    sf = SyntaxFactory()
+    size = const.SYNTAX_LOOKUP_CACHE_SIZE
+    for i in xrange(size + 10):
+        sf.get_definition("file%i.txt" % i)
+    eq_(len(sf._lookups), size)
+    assert "file0.txt" not in sf._lookups, sf._lookups.keys()[:5]
+    assert "file%i.txt" % (size + 9) in sf._lookups
+
+def load_resource_definitions(*names):
+    """Get a SyntaxFactory with definitions from the resources directory"""
+    from os.path import abspath, dirname, join
+    path = join(dirname(dirname(dirname(abspath(__file__)))),
+        "resources", "syntaxdefs")
+    sf = SyntaxFactory()
+    for name in names:
+        sdef = sf.load_definition(join(path, name + const.SYNTAX_DEF_EXTENSION))
+        for pattern in sdef.filepatterns:
+            sf.registry[pattern] = sdef
+    sf.invalidate()
+    return sf
+
+def test_SyntaxFactory_link_nested():
+    import cPickle as pickle
+    sf = load_resource_definitions("mako", "javascript")
+    mako = sf.get_definition("page.mako")
+    js = sf.get_definition("page.js")
+    eq_(mako.embedded.values(), ["javascript"])
+    eq_(mako.nested.values(), [js])
+    eq_(sf.get_nested_definition("JavaScript"), js)
+    eq_(sf.get_nested_definition("js"), js) # file extension
+    eq_(sf.get_nested_definition("php"), None)
+    copy = pickle.loads(pickle.dumps(mako, pickle.HIGHEST_PROTOCOL))
+    eq_(copy.embedded, mako.embedded)
+    eq_(copy.nested, {})
+    sdef = SyntaxDefinition("", "Test", (), (), [("<", [">"], "0000FF", js)])
+    copy = pickle.loads(pickle.dumps(sdef, pickle.HIGHEST_PROTOCOL))
+    eq_(copy.nested.values()[0].name, "JavaScript")
+
+def test_SyntaxFactory_reload_definitions():
+    from shutil import rmtree
+    from tempfile import mkdtemp
+    def write(name, source):
+        filename = os.path.join(tmp, name + const.SYNTAX_DEF_EXTENSION)
+        with open(filename, "w") as fh:
+            fh.write(source)
+        return filename
+    tmp = mkdtemp()
+    try:
+        outer_file = write("outer", 'name = "Outer"\nfilepatterns = ["*.outer"]\n'
+            'delimited_ranges = [("<", [">"], "0000FF", "inner")]\n')
+        inner_file = write("inner", 'name = "Inner"\nfilepatterns = ["*.inner"]\n'
+            'word_groups = [(["x"], "FF0000")]\n')
+        m = Mocker()
+        sf = SyntaxFactory()
+        index = sf.index_definitions = m.mock()
+        expect(index()).count(3)
+        with m:
+            sf.load_definitions(tmp)
+            outer = sf.get_definition("file.outer")
+            inner = sf.get_definition("file.inner")
+            eq_(outer.nested.values(), [inner])
+            eq_(sf.reload_definitions([]), {})
+
+            write("inner", 'name = "Inner"\nfilepatterns = ["*.inner"]\n'
+                'word_groups = [(["y"], "FF0000")]\n')
+            replaced = sf.reload_definitions([inner_file])
+            new = sf.get_definition("file.inner")
+            assert new is not inner, new
+            eq_(replaced, {inner: new, outer: outer})
+            eq_(new.regex.pattern, r"(?P<g0>\by\b)")
+            eq_(outer.nested.values(), [new])
+            eq_(sf.get_definition("file.outer"), outer)
+
+            os.remove(outer_file)
+            eq_(sf.reload_definitions([outer_file]), {outer: None})
+            eq_(sf.get_definition("file.outer"), PLAIN_TEXT)
+
+            added = write("added", 'name = "Added"\nfilepatterns = ["*.add"]\n')
+            eq_(sf.reload_definitions([added]), {})
+            eq_(sf.get_definition("file.add").name, "Added")
+    finally:
+        rmtree(tmp)
+
+def test_SyntaxFactory_link_nested_after_reload():
+    from shutil import rmtree
+    from tempfile import mkdtemp
+    def write(name, source):
+        filename = os.path.join(tmp, name + const.SYNTAX_DEF_EXTENSION)
+        with open(filename, "w") as fh:
+            fh.write(source)
+        return filename
+    tmp = mkdtemp()
+    try:
+        outer_file = write("outer", 'name = "Outer"\nfilepatterns = ["*.outer"]\n'
+            'delimited_ranges = [("<", [">"], "0000FF", "inner")]\n')
+        write("inner", 'name = "Inner"\nfilepatterns = ["*.inner"]\n'
+            'word_groups = [(["x"], "FF0000")]\n')
+        m = Mocker()
+        sf = SyntaxFactory()
+        index = sf.index_definitions = m.mock()
+        index()
+        with m:
+            sf.load_definitions(tmp)
+            write("outer", 'name = "Outer"\nfilepatterns = ["*.outer"]\n'
+                'delimited_ranges = [("[", ["]"], "0000FF", "inner")]\n')
+            replaced = sf.reload_definitions([outer_file])
+        # the replacement was not looked up by filename (it is set on a
+        # document by the reload callback or chosen from the syntax menu)
+        new, = replaced.values()
+        eq_(new.nested, {})
+        # TextDocument.syntaxdef links it when it becomes current
+        sf.link_nested(new)
+        color = SyntaxDefinition.getColor
+        eq_([d.name for d in new.nested.values()], ["Inner"])
+        ts = FakeTextStorage(u"x [x] x")
+        syn = SyntaxCache()
+        syn.syntaxdef = new
+        syn.color_text(ts)
+        blue, red = color("0000FF"), color("FF0000")
+        eq_(ts.colors, [None, None, blue, red, blue, None, None])
+    finally:
+        rmtree(tmp)
+
+def test_SyntaxDefinitionWatcher():
+    from editxt.syntax import SyntaxDefinitionWatcher
+    m = Mocker()
+    sf = m.mock(SyntaxFactory)
+    callback = m.mock()
+    sf.file_status() >> {"a": (1, 10), "b": (1, 20)}
+    sf.file_status() >> {"a": (1, 10), "b": (1, 20)}
+    sf.file_status() >> {"a": (2, 10), "c": (1, 30)}
+    replaced = {"<old a>": "<new a>", "<old b>": None}
+    sf.reload_definitions(["a", "b", "c"]) >> replaced
+    callback(replaced)
+    with m:
+        watcher = SyntaxDefinitionWatcher.alloc().init(sf, callback)
+        eq_(watcher.reload(), {})
+        eq_(watcher.reload(), replaced)
+        watcher.stop()
+        assert not watcher.running
+
 def test_SyntaxCache_syntaxdef_default():
     syn = SyntaxCache()
     eq_(syn.syntaxdef, PLAIN_TEXT) # check default
@@ -178,15 +494,17 @@ def test_SyntaxCache_syntaxdef_default():
 def test_SyntaxCache_syntaxdef():
     m = Mocker()
     syn = SyntaxCache()
-    syn.cache.append("something")
+    syn.set(NSRange(0, 3), "something")
     sd = m.mock(SyntaxDefinition)
     with m:
         assert syn.syntaxdef is not sd
         syn.syntaxdef = sd
-        eq_(syn.cache, [])
+        eq_(list(syn.cache), [])
         eq_(syn.syntaxdef, sd)
-        syn.cache.append("something")
-        eq_(syn.cache, ["something"])
+        syn.set(NSRange(0, 3), "something")
+        eq_(list(syn.cache), [(0, 3, "something")])
+        syn.syntaxdef = sd
+        eq_(list(syn.cache), [(0, 3, "something")])
         eq_(syn.syntaxdef, sd)
 
 def test_NoHighlight_scan():
@@ -206,3 +524,540 @@ def test_NoHighlight_scan():
     yield test, c(value="abc")
     yield test, c(offset=1)
 
+
+def test_SyntaxCache_line_state():
+    syn = SyntaxCache()
+    syn.set(NSRange(2, 5), "g1")
+    eq_(syn.line_state(0), None)
+    eq_(syn.line_state(2), None)
+    eq_(syn.line_state(3), ("g1", 2))
+    eq_(syn.line_state(6), ("g1", 2))
+    eq_(syn.line_state(7), None)
+    eq_(syn.line_state(100), None)
+
+def test_SyntaxDefinition_scan_state():
+    def test(c):
+        sdef = SyntaxDefinition("", "Test", (), [(["else"], "0000FF")],
+            [('"', ['"'], "00FF00", None), ("#", ["\n"], "FF0000", None)])
+        tokens = []
+        def setcolor(color, range, prevend, info):
+            if info is not None:
+                tokens.append((range.location, range.length, info))
+        sdef.scan(c.text, setcolor, c.offset, c.state)
+        eq_(tokens, c.tokens)
+    c = TestConfig(text=u'x "a\nb" else # c\nelse', offset=5)
+    yield test, c(offset=7, state=None, tokens=[(8, 4, "g0"),
+        (13, 4, "g2"), (17, 4, "g0")])
+    yield test, c(state=("g1", 2), tokens=[(2, 5, "g1"), (8, 4, "g0"),
+        (13, 4, "g2"), (17, 4, "g0")])
+    yield test, c(offset=10, state=("g0", 8), tokens=[(8, 4, "g0"),
+        (13, 4, "g2"), (17, 4, "g0")])
+    yield test, c(text=u'x "a\nb else', state=("g1", 2), tokens=[(2, 9, "g1")])
+
+def test_SyntaxDefinition_keyword_lookup():
+    def make_sdef(lookup, flags=0):
+        minimum = const.SYNTAX_KEYWORD_LOOKUP_MIN
+        const.SYNTAX_KEYWORD_LOOKUP_MIN = 0 if lookup else 1000
+        try:
+            return SyntaxDefinition("", "Test", (), [
+                (["if", "for", "<=", "in"], "0000FF"),
+                ([RE(r"fo\w"), "if", "else"], "00FF00"),
+                (["rx", "x-y"], "FF0000"),
+            ], [(RE("[ru]?'"), ["'"], "008080", None)], flags=flags)
+        finally:
+            const.SYNTAX_KEYWORD_LOOKUP_MIN = minimum
+    def scan(sdef, text):
+        tokens = []
+        def setcolor(color, range, prevend, info):
+            if info is not None:
+                tokens.append((range.location, range.length, info))
+        sdef.scan(text, setcolor)
+        return tokens
+    def test(text, tokens, flags=0):
+        sdef = make_sdef(True, flags)
+        eq_(sdef.keywords.get("if"), "g0")
+        eq_(scan(sdef, text), tokens)
+        eq_(scan(make_sdef(False, flags), text), tokens)
+    yield test, u"if else iffy", [(0, 2, "g0"), (3, 4, "g1")]
+    yield test, u"for fox in", [(0, 3, "g0"), (4, 3, "g1"), (8, 2, "g0")]
+    yield test, u"x-y <= rx", [(0, 3, "g2"), (4, 2, "g0"), (7, 2, "g2")]
+    yield test, u"xr'if' r'x' rx", [(1, 5, "g3"), (7, 4, "g3"), (12, 2, "g2")]
+    yield test, u"IF For", [(0, 2, "g0"), (3, 3, "g0")], re.IGNORECASE
+    yield test, u"IF For", []
+
+def test_SyntaxDefinition_long_lines():
+    from editxt.syntax import LONG_LINE
+    def test(text, tokens, offset=0, max_time=None):
+        sdef = SyntaxDefinition("", "Test", (), [(["else"], "0000FF")],
+            [('"', ['"'], "00FF00", None)], max_line_length=10,
+            max_line_time=max_time)
+        eq_(list(sdef.matches(text, offset)), tokens)
+        eq_(sdef.wordinfo[LONG_LINE][1], LONG_LINE)
+    L = LONG_LINE
+    yield test, u"else else", [("g0", 0, 4), ("g0", 5, 9)]
+    yield test, u"else else else", [("g0", 0, 4), ("g0", 5, 9), (L, 10, 14)]
+    yield test, u'else "a" else\nelse', \
+        [("g0", 0, 4), ("g1", 5, 8), ("g0", 9, 13), ("g0", 14, 18)]
+    yield test, u'else "a" else else\nelse else else\nelse',  [
+        ("g0", 0, 4), ("g1", 5, 8), ("g0", 9, 13), (L, 13, 18), ("g0", 19, 23),
+        ("g0", 24, 28), (L, 29, 33), ("g0", 34, 38)]
+    # a token that begins before the cutoff is not cut
+    yield test, u'else "abcdefghijk" else\nelse', \
+        [("g0", 0, 4), ("g1", 5, 18), (L, 18, 23), ("g0", 24, 28)]
+    yield test, u'"a\nbcdefghijklm" else else\nelse', \
+        [("g1", 0, 16), (L, 16, 26), ("g0", 27, 31)]
+    yield test, u"else else else else", [(L, 12, 19)], 12
+    yield test, u"else else else else", [("g0", 5, 9), (L, 10, 19)], 5
+    # time limit (always exceeded) cuts at the second token of a long line
+    yield test, u"else else else\nelse else", \
+        [("g0", 0, 4), (L, 5, 14), ("g0", 15, 19), ("g0", 20, 24)], 0, -1
+
+class FakeTextStorage(object):
+
+    def __init__(self, text):
+        self.text = text
+        self.colors = [None] * len(text)
+        self.changes = 0
+        self.edits = 0
+        self.done()
+
+    def string(self):
+        return self.text
+
+    def length(self):
+        return len(self.text)
+
+    def editedMask(self):
+        return self.mask
+
+    def changeInLength(self):
+        return self.delta
+
+    def beginEditing(self):
+        # color_text is called by the text storage delegate while the edit
+        # is being processed; a nested bracket would process it again
+        assert not self.mask, "beginEditing while processing an edit"
+        self.edits += 1
+
+    def endEditing(self):
+        pass
+
+    def addAttribute_value_range_(self, name, value, rng):
+        self.changes += rng.length
+        self.colors[rng.location:rng.location + rng.length] = [value] * rng.length
+
+    def removeAttribute_range_(self, name, rng):
+        self.colors[rng.location:rng.location + rng.length] = [None] * rng.length
+
+    def replace(self, start, length, value):
+        self.text = self.text[:start] + value + self.text[start + length:]
+        self.colors[start:start + length] = [None] * len(value)
+        self.mask = NSTextStorageEditedCharacters
+        self.delta = len(value) - length
+        return NSRange(start, len(value))
+
+    def done(self):
+        self.mask = 0
+        self.delta = 0
+
+def test_SyntaxCache_color_text_incremental():
+    def test(c):
+        sdef = SyntaxDefinition("", "Test", (), [(["else"], "0000FF")],
+            [('"', ['"'], "00FF00", None), ("#", ["\n"], "FF0000", None)],
+            max_line_length=c.max_line_length)
+        ts = FakeTextStorage(c.text)
+        syn = SyntaxCache()
+        syn.syntaxdef = sdef
+        syn.color_text(ts)
+        ts.done()
+        ts.changes = ts.edits = 0
+        edited = ts.replace(c.start, c.length, c.value)
+        syn.color_text(ts, edited)
+        ref = FakeTextStorage(ts.text)
+        full = SyntaxCache()
+        full.syntaxdef = sdef
+        full.color_text(ref)
+        eq_(ts.colors, ref.colors)
+        eq_(list(syn.cache), list(full.cache))
+        eq_(ts.changes, c.changes)
+        eq_(ts.edits, 0)
+    lines = u"\n".join([u'x = "a" else', u"# comment", u"y = z"] * 3)
+    c = TestConfig(text=lines, length=0, max_line_length=None)
+    yield test, c(start=0, value=u"else ", changes=4)
+    yield test, c(start=1, value=u"x", changes=0)
+    yield test, c(start=5, value=u"b", changes=1)
+    yield test, c(start=4, length=3, value=u"", changes=0)
+    yield test, c(start=4, value=u'"', changes=74)
+    yield test, c(start=13, length=1, value=u"", changes=0)
+    yield test, c(start=len(lines), value=u" else", changes=4)
+    # the cutoff of a long line moves when the line is edited
+    yield test, c(start=0, value=u"else ", changes=9, max_line_length=12)
+    yield test, c(start=4, length=3, value=u"", changes=4, max_line_length=8)
+
+def test_TextStorageSink():
+    from editxt.syntax import TextStorageSink
+    def test(editing):
+        m = Mocker()
+        ts = m.mock()
+        color = m.mock()
+        sink = TextStorageSink(ts, editing)
+        with m.order():
+            if not editing:
+                ts.beginEditing()
+            ts.addAttribute_value_range_(
+                NSForegroundColorAttributeName, color, NSRange(1, 2))
+            ts.removeAttribute_range_(
+                NSForegroundColorAttributeName, NSRange(4, 3))
+            if not editing:
+                ts.endEditing()
+        with m:
+            sink.begin()
+            sink.set_color(1, 2, color)
+            sink.set_color(4, 3, None)
+            sink.end()
+    yield test, False
+    yield test, True
+
+def test_SyntaxCache_color_text_edits():
+    def test(c):
+        sdef = SyntaxDefinition("", "Test", (), [(["else"], "0000FF")],
+            [('"', ['"'], "00FF00", None), ("#", ["\n"], "FF0000", None)])
+        ts = FakeTextStorage(c.text)
+        syn = SyntaxCache()
+        syn.syntaxdef = sdef
+        syn.color_text(ts)
+        ts.done()
+        ts.changes = 0
+        edits = []
+        delta = 0
+        for start, length, value in c.edits:
+            edits.append((start + delta, len(value), len(value) - length))
+            delta += len(value) - length
+        for start, length, value in reversed(c.edits):
+            ts.replace(start, length, value)
+        ts.delta = delta
+        first = edits[0][0]
+        edited = NSRange(first, edits[-1][0] + edits[-1][1] - first)
+        syn.color_text(ts, edited, edits=edits)
+        ref = FakeTextStorage(ts.text)
+        full = SyntaxCache()
+        full.syntaxdef = sdef
+        full.color_text(ref)
+        eq_(ts.colors, ref.colors)
+        eq_(list(syn.cache), list(full.cache))
+        eq_(ts.changes, c.changes)
+    lines = u"\n".join([u'x = "a" else', u"# comment", u"y = z"] * 30)
+    c = TestConfig(text=lines)
+    # only the edited tokens are colored
+    yield test, c(edits=[(0, 0, u"else "), (len(lines), 0, u" else")],
+        changes=8)
+    yield test, c(edits=[(1, 0, u"x"), (5, 1, u"bc"), (300, 4, u"")],
+        changes=2)
+    # an unbalanced delimiter changes the color of the rest of the text
+    yield test, c(edits=[(4, 0, u'"'), (13, 1, u"")], changes=775)
+    yield test, c(edits=[(8, 4, u"if"), (12, 0, u" else")], changes=4)
+
+def test_SyntaxCache_color_text_overlapping_edits():
+    sf = load_resource_definitions("mako", "javascript")
+    def test(filename, text, changes):
+        sdef = sf.get_definition(filename)
+        ts = FakeTextStorage(text)
+        syn = SyntaxCache()
+        syn.syntaxdef = sdef
+        syn.color_text(ts)
+        ts.done()
+        edits = []
+        delta = 0
+        for start, end, value in changes:
+            edits.append((start + delta, len(value), len(value) - (end - start)))
+            delta += len(value) - (end - start)
+        for start, end, value in reversed(changes):
+            ts.replace(start, end - start, value)
+        ts.delta = delta
+        first = edits[0][0]
+        edited = NSRange(first, edits[-1][0] + edits[-1][1] - first)
+        syn.color_text(ts, edited, edits=edits)
+        ref = FakeTextStorage(ts.text)
+        full = SyntaxCache()
+        full.syntaxdef = sdef
+        full.color_text(ref)
+        eq_(ts.colors, ref.colors)
+        eq_(list(syn.cache), list(full.cache))
+        for name, nested in full.nested.items():
+            eq_(list(syn.nested[name].cache), list(nested.cache))
+    # the rescan of an earlier edit extends beyond a later edit
+    yield test, "page.mako", \
+        u'"\n</script>"${ -->//\n</script>x\n--><%doc>-->\'<!---->\nx', \
+        [(15, 15, u"'"), (37, 41, u'"<%'), (46, 50, u"////<script>")]
+    yield test, "page.js", \
+        u'--><!---->/* "<%<!--<%-->"<%doc></script>\n"<%/*/*var%>', \
+        [(0, 0, u"//"), (31, 33, u""), (40, 40, u" <%doc>\n")]
+
+def test_SyntaxCache_color_slice():
+    def test(c):
+        sdef = SyntaxDefinition("", "Test", (), [(["else"], "0000FF")],
+            [('"', ['"'], "00FF00", None), ("#", ["\n"], "FF0000", None)])
+        ts = FakeTextStorage(c.text)
+        syn = SyntaxCache()
+        syn.syntaxdef = sdef
+        eq_(syn.color_slice(ts, c.offset, c.limit), c.result)
+        eq_(list(syn.cache), c.tokens)
+    c = TestConfig(text=u'"a" else\n# x\nelse', offset=0, limit=100)
+    full = [(0, 3, "g1"), (4, 4, "g0"), (9, 4, "g2"), (13, 4, "g0")]
+    yield test, c(result=None, tokens=full)
+    yield test, c(offset=3, result=None, tokens=full[1:])
+    yield test, c(limit=4, result=3, tokens=full[:1])
+    yield test, c(limit=5, result=8, tokens=full[:2])
+    yield test, c(offset=8, limit=10, result=13, tokens=full[2:3])
+
+def test_SyntaxCache_color_text_deadline():
+    sdef = SyntaxDefinition("", "Test", (), [(["else"], "0000FF")],
+        [('"', ['"'], "00FF00", None), ("#", ["\n"], "FF0000", None)])
+    ts = FakeTextStorage(u'"a" else\n# x\nelse')
+    syn = SyntaxCache()
+    syn.syntaxdef = sdef
+    eq_(syn.color_text(ts, deadline=0), 3)
+    eq_(list(syn.cache), [(0, 3, "g1")])
+    eq_(syn.color_text(ts), None)
+    eq_(len(syn.cache), 4)
+
+def test_SyntaxCache_color_tokens():
+    sdef = SyntaxDefinition("", "Test", (), [(["else"], "0000FF")],
+        [('"', ['"'], "00FF00", None), ("#", ["\n"], "FF0000", None)])
+    text = u'"a" else\n# x\nelse'
+    tokens = []
+    def setcolor(color, range, prevend, info):
+        tokens.append((color, range.location, range.length, info))
+    sdef.scan(text, setcolor)
+    ts = FakeTextStorage(text)
+    ts.colors[:] = ["stale"] * len(text)
+    syn = SyntaxCache()
+    syn.syntaxdef = sdef
+    syn.runs.applied.set(0, len(text), "stale")
+    eq_(syn.color_tokens(ts, tokens[:2], 0), 8)
+    eq_(syn.color_tokens(ts, tokens[2:], 8), len(text))
+    ref = FakeTextStorage(text)
+    full = SyntaxCache()
+    full.syntaxdef = sdef
+    full.color_text(ref)
+    eq_(ts.colors, ref.colors)
+    eq_(list(syn.cache), list(full.cache))
+
+def test_HighlightCache():
+    from shutil import rmtree
+    from tempfile import mkdtemp
+    from editxt.syntax import HighlightCache
+    sdef = SyntaxDefinition("", "Test", (), [(["else"], "0000FF")],
+        [('"', ['"'], "00FF00", None), ("#", ["\n"], "FF0000", None)])
+    text = u'"a" else\n# x\nelse'
+    syn = SyntaxCache()
+    syn.syntaxdef = sdef
+    syn.color_text(FakeTextStorage(text))
+    tmp = mkdtemp()
+    try:
+        path = os.path.join(tmp, "doc.txt")
+        with open(path, "w") as fh:
+            fh.write(text)
+        cache = HighlightCache(os.path.join(tmp, "cache"), max_files=2)
+        eq_(cache.load(path, text, sdef), None)
+        cache.save(path, text, sdef, syn.cache)
+        spans = cache.load(path, text, sdef)
+        eq_(list(spans), list(syn.cache))
+        spans.set(0, 1, "g0") # infos are interned
+        eq_(spans.infos, syn.cache.infos)
+        eq_(cache.load(path, text + u"x", sdef), None) # text changed
+        other = SyntaxDefinition("", "Other", (), [(["else"], "0000FF")], [])
+        eq_(cache.load(path, text, other), None) # syntax changed
+        # valid spans are not written again
+        filename = cache.filename(path)
+        os.utime(filename, (1, 1))
+        inode = os.stat(filename).st_ino
+        cache.save(path, text, sdef, syn.cache)
+        eq_(os.stat(filename).st_ino, inode)
+        assert os.stat(filename).st_mtime > 1 # recently used
+        cache.save(path, text, other, syn.cache)
+        assert os.stat(filename).st_ino != inode # replaced
+        eq_(cache.load(path, text, sdef), None)
+        cache.save(path, text, sdef, syn.cache)
+        eq_(list(cache.load(path, text, sdef)), list(syn.cache))
+        for name in "abc":
+            other = os.path.join(tmp, name)
+            with open(other, "w") as fh:
+                fh.write(text)
+            cache.save(other, text, sdef, syn.cache)
+        eq_(len(os.listdir(cache.path)), 2)
+        eq_(cache.load(path, text, sdef), None) # pruned
+    finally:
+        rmtree(tmp)
+
+def test_HighlightCache_non_ascii_path():
+    from shutil import rmtree
+    from tempfile import mkdtemp
+    from editxt.syntax import HighlightCache
+    sdef = SyntaxDefinition("", "Test", (), [(["else"], "0000FF")], [])
+    text = u"else x else"
+    syn = SyntaxCache()
+    syn.syntaxdef = sdef
+    syn.color_text(FakeTextStorage(text))
+    tmp = mkdtemp()
+    try:
+        path = os.path.join(tmp, "caf\xc3\xa9.txt") # UTF-8 bytes
+        with open(path, "w") as fh:
+            fh.write(text)
+        cache = HighlightCache(os.path.join(tmp, "cache"))
+        cache.save(path, text, sdef, syn.cache)
+        filename = cache.filename(path)
+        eq_(filename, cache.filename(path.decode("utf-8")))
+        eq_(list(cache.load(path, text, sdef)), list(syn.cache))
+        # the saved key matches: the file is not written again
+        inode = os.stat(filename).st_ino
+        cache.save(path, text, sdef, syn.cache)
+        eq_(os.stat(filename).st_ino, inode)
+    finally:
+        rmtree(tmp)
+
+def test_SyntaxCache_restore():
+    sdef = SyntaxDefinition("", "Test", (), [(["else"], "0000FF")],
+        [('"', ['"'], "00FF00", None), ("#", ["\n"], "FF0000", None)])
+    text = u'"a" else\n# x\nelse\nx'
+    ref = FakeTextStorage(text)
+    full = SyntaxCache()
+    full.syntaxdef = sdef
+    full.color_text(ref)
+    ts = FakeTextStorage(text)
+    ts.colors[:] = ["stale"] * len(text)
+    syn = SyntaxCache()
+    syn.syntaxdef = sdef
+    syn.restore(ts, full.cache)
+    eq_(ts.colors, ref.colors)
+    assert syn.cache is full.cache
+
+def test_SyntaxCache_nested():
+    sf = load_resource_definitions("mako", "javascript")
+    mako = sf.get_definition("page.mako")
+    js = sf.get_definition("page.js")
+    color = SyntaxDefinition.getColor
+    text = (u'<div class="x">\n<script type="text/javascript">\n'
+            u'var s = "</div>"; // <b>\nif (x) {\n    return true;\n}\n'
+            u'</script>\n<p>var</p>\n')
+    def check(ts, token, value, offset=0):
+        i = ts.text.index(token, offset)
+        eq_(ts.colors[i:i + len(token)], [value] * len(token), token)
+    ts = FakeTextStorage(text)
+    syn = SyntaxCache()
+    syn.syntaxdef = mako
+    syn.color_text(ts)
+    check(ts, u'<script type="text/javascript">', color("000080"))
+    check(ts, u"var", color("0000CC"))
+    check(ts, u'"</div>"', color("008080"))
+    check(ts, u"// <b>", color("008000"))
+    check(ts, u"return", color("0000CC"))
+    check(ts, u"</script>", color("000080"))
+    check(ts, u"<p>", color("000080"))
+    check(ts, u"var", None, text.index(u"<p>"))
+
+    def test(c):
+        ts = FakeTextStorage(text)
+        syn = SyntaxCache()
+        syn.syntaxdef = mako
+        syn.color_text(ts)
+        ts.done()
+        scans = []
+        for sdef in [mako, js]:
+            def scan(text, setcolor, offset=0, state=None, sdef=sdef):
+                scans.append((sdef.name, offset))
+                type(sdef).scan(sdef, text, setcolor, offset, state)
+            sdef.scan = scan
+        try:
+            start = text.index(c.find) + c.offset
+            edited = ts.replace(start, c.length, c.value)
+            syn.color_text(ts, edited)
+        finally:
+            del mako.scan, js.scan
+        ref = FakeTextStorage(ts.text)
+        full = SyntaxCache()
+        full.syntaxdef = mako
+        full.color_text(ref)
+        eq_(ts.colors, ref.colors)
+        eq_(list(syn.cache), list(full.cache))
+        name, = mako.nested
+        eq_(list(syn.nested[name].cache), list(full.nested[name].cache))
+        eq_(scans, c.scans)
+    c = TestConfig(offset=0, length=0)
+    # the outer scan resumes inside the range; the nested scan of the range
+    # begins at the edited line
+    yield test, c(find=u"return", value=u"x", scans=[
+        ("Mako Templates", 81), ("JavaScript", 34)])
+    yield test, c(find=u"true", length=4, value=u"", scans=[
+        ("Mako Templates", 81), ("JavaScript", 34)])
+    yield test, c(find=u"if", value=u"/*", scans=[
+        ("Mako Templates", 72), ("JavaScript", 19)]) # after the comment
+    # an edit in the start delimiter does not change the nested tokens
+    yield test, c(find=u"text/", value=u"x", scans=[("Mako Templates", 0)])
+    # the end of the range changed: scan all of it again
+    yield test, c(find=u"</script>", offset=2, length=1, value=u"", scans=[
+        ("Mako Templates", 100), ("JavaScript", 0)])
+
+def test_Highlighter():
+    from editxt.syntax import Highlighter
+    def test(c):
+        m = Mocker()
+        nsthread = m.replace("editxt.syntax.NSThread")
+        workers = []
+        def detach(selector, target, args):
+            workers.append(args)
+        expect(nsthread.detachNewThreadSelector_toTarget_withObject_(
+            "tokenize:", ANY, ANY)).count(1, None).call(detach)
+        sdef = SyntaxDefinition("", "Test", (), [(["else"], "0000FF")],
+            [('"', ['"'], "00FF00", None), ("#", ["\n"], "FF0000", None)])
+        text = u'"a" else\n# x\nelse\n' * 5
+        ts = FakeTextStorage(text)
+        syn = SyntaxCache()
+        syn.syntaxdef = sdef
+        with m:
+            hl = Highlighter.alloc().init(syn, ts, 0)
+            hl.batch_size = 2
+            batches = []
+            def work():
+                # run the worker, but do not apply its tokens yet
+                if workers:
+                    hl.tokenize(batches.append, *workers.pop())
+            def apply(n=1):
+                for i in xrange(n):
+                    hl.applyTokens_(batches.pop(0))
+            for action in c.actions:
+                action(hl, ts, work, apply)
+            while hl.running:
+                work()
+                apply()
+        eq_(len(workers), 0)
+        ref = FakeTextStorage(ts.text)
+        full = SyntaxCache()
+        full.syntaxdef = sdef
+        full.color_text(ref)
+        eq_(ts.colors, ref.colors)
+        eq_(list(syn.cache), list(full.cache))
+    def show(range):
+        def action(hl, ts, work, apply):
+            hl.show(NSRange(*range))
+            hl.colorVisible()
+        return action
+    def step(hl, ts, work, apply):
+        work()
+        apply(3)
+    def edit(start, length, value):
+        def action(hl, ts, work, apply):
+            edited = ts.replace(start, length, value)
+            resume = hl.syntaxer.color_text(ts, edited)
+            hl.text_edited(edited, ts.changeInLength(), resume)
+            ts.done()
+            eq_(hl.version, 2)
+            apply(2) # stale batches are discarded
+        return action
+    c = TestConfig(actions=[])
+    yield test, c
+    yield test, c(actions=[show((40, 10))])
+    yield test, c(actions=[step, show((0, 5))])
+    yield test, c(actions=[step, edit(1, 0, u"x")])
+    yield test, c(actions=[step, edit(60, 0, u'"')])
+    yield test, c(actions=[step, edit(10, 2, u"")])
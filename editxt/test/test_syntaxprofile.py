@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2012 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+import logging
+
+from nose.tools import *
+
+import editxt.syntaxprofile as mod
+
+log = logging.getLogger(__name__)
+
+
+def test_line_col():
+    def test(index, result):
+        eq_(mod.line_col(u"ab\ncd\n", index), result)
+    yield test, 0, (1, 1)
+    yield test, 2, (1, 3)
+    yield test, 3, (2, 1)
+    yield test, 6, (3, 1)
+
+def test_profile_pattern():
+    result = mod.profile_pattern(r"b|(?=c)", 0, u"abcb", worst=2)
+    eq_(result["matches"], 3)
+    eq_(len(result["worst"]), 2)
+    searches = set((pos, found) for s, pos, found in
+                   mod.profile_pattern(r"b|(?=c)", 0, u"abcb", 10)["worst"])
+    eq_(searches, set([(0, 1), (2, 2), (3, 3), (4, None)]))
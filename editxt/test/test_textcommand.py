@@ -72,10 +72,13 @@ def test_load_commands():
 # built-in text command and input handler tests
 
 def test_is_comment_range():
+    from editxt.lineindex import LineIndex
     from editxt.textcommand import is_comment_range
     def test(c):
         range = c.range if "range" in c else (0, len(c.text))
         eq_(is_comment_range(c.text, range, c.token), c.result)
+        lines = LineIndex(unicode(c.text))
+        eq_(is_comment_range(c.text, range, c.token, lines), c.result)
     c = TestConfig(token="x", result=False)
     yield test, c(text="")
     yield test, c(text="x\n\n")
@@ -242,6 +245,7 @@ def test_uncomment_line():
 
 def test_text_commands():
     from editxt.document import TextDocument
+    from editxt.lineindex import LineIndex
     import editxt.textcommand as tc
     SAME = "<SAME AS INPUT>"
     def test(c):
@@ -255,6 +259,8 @@ def test_text_commands():
         (tv.doc_view.document.indent_mode << c.mode).count(0, None)
         (tv.doc_view.document.indent_size << c.size).count(0, None)
         (tv.doc_view.document.eol << c.eol).count(0, None)
+        lines = LineIndex(c.input)
+        (tv.doc_view.document.line_index << lines).count(0, None)
         sel = NSMakeRange(*c.oldsel); (tv.selectedRange() << sel).count(0, None)
         (tv.string() << NSString.stringWithString_(c.input)).count(0, None)
         (tv.shouldChangeTextInRange_replacementString_(ANY, ANY) << True).count(0, None)
@@ -435,6 +441,19 @@ def test_text_commands():
         yield test, c(input=u"\n       ", output=u"\n    ", oldsel=(8+i, 0), newsel=(5+i, 0))
         yield test, c(input=u"\n        ", output=u"\n    ", oldsel=(9+i, 0), newsel=(5+i, 0))
 
+def test_iterlines():
+    from editxt.lineindex import LineIndex
+    from editxt.textcommand import iterlines
+    def test(text, range, result):
+        eq_(list(iterlines(text, range)), result)
+        eq_(list(iterlines(text, range, LineIndex(text))), result)
+    yield test, u"", (0,), [u""]
+    yield test, u"a", (0,), [u"a"]
+    yield test, u"a\nb\r\nc\rd\u2028", (0,), [u"a\n", u"b\r\n", u"c\r", u"d\u2028"]
+    yield test, u"a\nbc\n\nd", (2, 4), [u"bc\n", u"\n"]
+    yield test, u"a\nbc\n\nd", (3, 3), [u"c\n", u"\n"]
+    yield test, u"a\nbc\n\nd", (2, 0), []
+
 def test_panel_actions():
     def test(c):
         act = c.action()
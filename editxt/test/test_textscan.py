@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2012 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+import logging
+import random
+from contextlib import contextmanager
+
+from nose.tools import *
+
+import editxt.textscan as mod
+from editxt.textscan import scan_text, replace_newlines, change_indentation
+
+log = logging.getLogger(__name__)
+
+SCANNERS = ["numpy", "python"] if mod.numpy is not None else ["python"]
+
+@contextmanager
+def scanner(name):
+    numpy = mod.numpy
+    if name == "python":
+        mod.numpy = None
+    try:
+        yield
+    finally:
+        mod.numpy = numpy
+
+def test_scan_text():
+    def test(name, text, starts, ends, indents, tabs, newlines):
+        with scanner(name):
+            scan = scan_text(text)
+            eq_(list(scan.starts), starts)
+            eq_(list(scan.ends), ends)
+            eq_(list(scan.indents), indents)
+            eq_(list(scan.tabs), tabs)
+            eq_(list(scan.spaces), [i - t for i, t in zip(indents, tabs)])
+            eq_(dict((eol, list(offsets)) for eol, offsets
+                in scan.newlines.iteritems() if len(offsets)), newlines)
+            eq_(list(scan.line_starts()), starts)
+            eq_(len(scan), len(starts))
+    for name in SCANNERS:
+        yield test, name, u"", [0], [0], [0], [0], {}
+        yield test, name, u"abc", [0], [3], [0], [0], {}
+        yield test, name, u" \t x\n", [0, 5], [4, 5], [3, 0], [1, 0], {u"\n": [4]}
+        yield test, name, u"a\nb\rc\r\nd\u2028e", [0, 2, 4, 7, 9], \
+            [1, 3, 5, 8, 10], [0] * 5, [0] * 5, \
+            {u"\n": [1], u"\r": [3], u"\r\n": [5], u"\u2028": [8]}
+        yield test, name, u"\n\r\n\r\r", [0, 1, 3, 4, 5], [0, 1, 3, 4, 5], \
+            [0] * 5, [0] * 5, {u"\n": [0], u"\r\n": [1], u"\r": [3, 4]}
+        yield test, name, u"\t\t\n  \n\t x", [0, 3, 6], [2, 5, 9], \
+            [2, 2, 2], [2, 0, 1], {u"\n": [2, 5]}
+
+def test_TextScan_eol():
+    def test(name, text, line, result):
+        with scanner(name):
+            eq_(scan_text(text).eol(line), result)
+    for name in SCANNERS:
+        yield test, name, u"", 0, None
+        yield test, name, u"abc", 0, None
+        yield test, name, u"abc\r\n", 0, u"\r\n"
+        yield test, name, u"abc\r\n", 1, None
+        yield test, name, u"a\rb\u2028", 1, u"\u2028"
+
+def test_TextScan_indented_line():
+    def test(name, text, result):
+        with scanner(name):
+            eq_(scan_text(text).indented_line(), result)
+    for name in SCANNERS:
+        yield test, name, u"", None
+        yield test, name, u"abc\ndef", None
+        yield test, name, u"  ", 0
+        yield test, name, u"x\n  \n\t\nx", 2
+        yield test, name, u"x\n  \n\tx\n  x", 2
+        yield test, name, u"x\n  \n x\n\tx", 2
+
+def test_replace_newlines():
+    def test(name, text, eol, result):
+        with scanner(name):
+            eq_(replace_newlines(text, eol), result)
+            if text == result:
+                assert replace_newlines(text, eol) is text
+    for name in SCANNERS:
+        yield test, name, u"", u"\n", u""
+        yield test, name, u"abc", u"\r\n", u"abc"
+        yield test, name, u"a\nb\n", u"\n", u"a\nb\n"
+        yield test, name, u"\r \n \u2028", u"\n", u"\n \n \n"
+        yield test, name, u"\r \r\n\n \u2028", u"\n", u"\n \n\n \n"
+        yield test, name, u"\r \r\n\n \u2028", u"\r", u"\r \r\r \r"
+        yield test, name, u"\r \r\n\n \u2028", u"\u2028", \
+            u"\u2028 \u2028\u2028 \u2028"
+        yield test, name, u"\r \r\n\n \u2028", u"\r\n", \
+            u"\r\n \r\n\r\n \r\n"
+        yield test, name, u"\n\n\xe9\U0001d11e\r\n", u"\r\n", \
+            u"\r\n\r\n\xe9\U0001d11e\r\n"
+
+def test_change_indentation():
+    def test(name, text, old, new, result):
+        with scanner(name):
+            eq_(change_indentation(text, old, new), result)
+    for name in SCANNERS:
+        yield test, name, u"", u"  ", u"\t", u""
+        yield test, name, u"a  b", u"  ", u"\t", u"a  b"
+        yield test, name, u"  a\n    b\n", u"  ", u"\t", u"\ta\n\t\tb\n"
+        yield test, name, u"   a\r\n \t  b", u"  ", u"\t", u"\t a\r\n \t\tb"
+        yield test, name, u"\ta\n \t\tb  \t", u"\t", u"    ", \
+            u"    a\n         b  \t"
+
+def test_scanners_agree():
+    # compare the scanners and the operations built on them with their
+    # definitions (regular expression substitutions) on random text
+    import re
+    if len(SCANNERS) < 2:
+        return
+    def test(seed):
+        rand = random.Random(seed)
+        chars = u"ab \t\n\r\u2028"
+        text = u"".join(rand.choice(chars) for i in xrange(rand.randint(0, 60)))
+        scans = []
+        for name in SCANNERS:
+            with scanner(name):
+                scan = scan_text(text)
+                scans.append([map(int, getattr(scan, attr)) for attr in
+                    ["starts", "ends", "indents", "tabs", "spaces"]])
+                for eol in mod.EOLS:
+                    eq_(replace_newlines(text, eol), mod.EOL.sub(eol, text))
+                expect = u"".join(
+                    re.sub(u"^[ \t]+", lambda m: m.group().replace(u"  ", u"\t"), line)
+                    for line in re.split(u"(\r\n|[\n\r\u2028])", text))
+                eq_(change_indentation(text, u"  ", u"\t"), expect, repr(text))
+        eq_(scans[0], scans[1], repr(text))
+    for seed in xrange(200):
+        yield test, seed
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2012 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+import logging
+import random
+import re
+
+from nose.tools import *
+
+from editxt.test.test_lineindex import random_edits
+from editxt.test.test_textscan import SCANNERS, scanner
+from editxt.trigram import TrigramIndex, literal_prefix, fold, bloom
+
+log = logging.getLogger(__name__)
+
+class SmallIndex(TrigramIndex):
+    block_size = 16
+    overlap = 8
+
+def make_index(text):
+    index = SmallIndex()
+    index.reset(text)
+    return index
+
+def starts(index):
+    return [index.starts[i] for i in xrange(len(index))]
+
+def test_literal_prefix():
+    def test(pattern, result, flags=0):
+        eq_(literal_prefix(pattern, flags), result)
+    yield test, u"", u""
+    yield test, u"abc", u"abc"
+    yield test, u"abc.*def", u"abc"
+    yield test, u"abcd*", u"abc"
+    yield test, u"\\bword\\b", u"word"
+    yield test, u"^x", u"x"
+    yield test, u"a|b", u""
+    yield test, u"(abc)", u""
+    yield test, u"[ab]cd", u""
+    yield test, u"a\\.b", u"a.b"
+    yield test, u"(", u""
+
+def test_fold():
+    eq_(fold(u"aBc \u212a\xe9\xc9"), u"abc k\x80\x80")
+
+def test_TrigramIndex_reset():
+    def test(name, text, result):
+        with scanner(name):
+            index = make_index(text)
+            eq_(starts(index), result)
+            eq_(index.length, len(text))
+            assert index.ready
+            eq_(index.blooms, [bloom(text[i:i + 24]) for i in result])
+    for name in SCANNERS:
+        yield test, name, u"", []
+        yield test, name, u"abc", [0]
+        yield test, name, u"x" * 40, [0, 16, 32]
+        yield test, name, u"The Quick Brown \u212a\xe9 Fox", [0, 16]
+
+def test_TrigramIndex_candidates():
+    text = (u"abc " * 4) + (u"xyz " * 8) + u"ABC"
+    index = make_index(text)
+    def test(literal, start, end, result, backward=False):
+        eq_(list(index.candidates(literal, start, end, backward)), result)
+    yield test, u"abc", 0, len(text), [(0, 16), (32, 51)]
+    yield test, u"abc", 0, len(text), [(32, 51), (0, 16)], True
+    yield test, u"abc", 5, 40, [(5, 16), (32, 40)]
+    yield test, u"yz ", 0, len(text), [(0, 48)]
+    yield test, u"qqq", 0, len(text), []
+    yield test, u"ab", 3, 7, [(3, 7)]
+    yield test, u"abc", 7, 7, []
+
+def test_TrigramIndex_finditer():
+    text = (u"Abc def " * 5) + u"\nabc\n"
+    index = make_index(text)
+    def test(pattern, start=0, end=None, flags=re.UNICODE | re.MULTILINE):
+        regex = re.compile(pattern, flags)
+        stop = len(text) if end is None else end
+        eq_([m.span() for m in index.finditer(regex, text, start, end)],
+            [m.span() for m in regex.finditer(text, start, stop)])
+    yield test, u"abc"
+    yield test, u"abc", 0, None, re.IGNORECASE
+    yield test, u"\\babc d", 0, None, re.IGNORECASE
+    yield test, u"def [a-z]+", 4, 30
+    yield test, u"^abc$"
+    yield test, u"c d"
+    yield test, u"xyz"
+
+def test_TrigramIndex_text_edited():
+    # every occurrence of a literal in the edited text begins in a
+    # candidate range
+    def test(name, seed):
+        rand = random.Random(seed)
+        chars = u"abcAB \n\u212a\xe9"
+        text = u"".join(rand.choice(chars) for i in xrange(rand.randint(0, 100)))
+        with scanner(name):
+            index = make_index(text)
+            for i in xrange(10):
+                start = rand.randint(0, len(text))
+                length = rand.randint(0, min(20, len(text) - start))
+                new = u"".join(rand.choice(chars) for i in xrange(rand.randint(0, 20)))
+                text = text[:start] + new + text[start + length:]
+                index.text_edited(text, start, len(new), len(new) - length)
+                eq_(index.length, len(text))
+                blocks = starts(index)
+                eq_(blocks, sorted(set(blocks)))
+                folded = fold(text)
+                for i in xrange(5):
+                    pos = rand.randint(0, max(len(text) - 3, 0))
+                    literal = folded[pos:pos + rand.randint(3, 10)]
+                    if len(literal) < 3:
+                        continue
+                    ranges = list(index.candidates(literal, 0, len(text)))
+                    for pos in xrange(len(text)):
+                        if folded.startswith(literal, pos):
+                            assert any(lo <= pos < hi for lo, hi in ranges), \
+                                (text, literal, pos, ranges)
+    for name in SCANNERS:
+        for seed in xrange(50):
+            yield test, name, seed
+
+def test_TrigramIndex_batch_edited():
+    # each block is indexed with the text that follows it, as if the
+    # blocks had been indexed after the edits
+    def test(name, seed):
+        rand = random.Random(seed)
+        chars = u"abcAB \n\u212a\xe9"
+        text = u"".join(rand.choice(chars) for i in xrange(rand.randint(0, 150)))
+        with scanner(name):
+            index = make_index(text)
+            for i in xrange(5):
+                text, edits = random_edits(rand, text, chars)
+                index.batch_edited(text, edits)
+                eq_(index.length, len(text))
+                blocks = starts(index)
+                eq_(blocks, sorted(set(blocks)))
+                ends = blocks[1:] + [len(text)]
+                assert all(end - start <= 16 for start, end in zip(blocks, ends))
+                eq_(index.blooms, [bloom(text[start:end + 8])
+                    for start, end in zip(blocks, ends)], repr(text))
+    for name in SCANNERS:
+        for seed in xrange(50):
+            yield test, name, seed
+
+def test_TrigramIndex_text_edited_not_ready():
+    index = SmallIndex()
+    index.text_edited(u"abc", 0, 3, 3)
+    assert not index.ready
+    index = make_index(u"abc")
+    index.text_edited(u"abcdef", 0, 1, 1) # length does not match
+    assert not index.ready
+
+def test_TrigramIndex_ready_for():
+    text = u"abc def " * 10
+    index = SmallIndex()
+    assert not index.ready_for(text)
+    index._worker.join()
+    assert index.ready_for(text)
+    eq_(starts(index), range(0, len(text), 16))
+    assert not index.ready_for(text + u"x")
+    index._worker.join()
+    # the text was edited before the worker's index was used
+    index.text_edited(text, 0, 0, 0)
+    assert not index.ready_for(text)
+    index._worker.join()
+    assert index.ready_for(text)
@@ -60,7 +60,8 @@ def test_wrap_selected_lines():
         sel = (0, len(text)) if c.sel is None else c.sel
         sel = text.lineRangeForRange_(tv.selectedRange() >> sel)
         eol = tv.doc_view.document.eol >> m.mock()
-        lines = iterlines(text, sel) >> "<lines>"
+        index = tv.doc_view.document.line_index >> "<index>"
+        lines = iterlines(text, sel, index) >> "<lines>"
         eol.join(wrap(lines, opts, tv) >> [c.result]) >> c.result
         tv.shouldChangeTextInRange_replacementString_(sel, c.result) >> True
         output = []
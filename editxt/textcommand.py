@@ -27,6 +27,7 @@ from AppKit import *
 from Foundation import *
 
 import editxt.constants as const
+from editxt import textscan
 from editxt.util import register_undo_callback
 
 log = logging.getLogger(__name__)
@@ -130,7 +131,8 @@ class CommentText(SelectionCommand):
         text = textview.string()
         sel = text.lineRangeForRange_(textview.selectedRange())
         comment_token = textview.doc_view.document.comment_token
-        if is_comment_range(text, sel, comment_token):
+        lines = textview.doc_view.document.line_index
+        if is_comment_range(text, sel, comment_token, lines):
             func = uncomment_line
         else:
             func = comment_line
@@ -140,7 +142,7 @@ class CommentText(SelectionCommand):
             textview.doc_view.document.indent_size,
             type(self).PAD,
         )
-        seltext = u"".join(func(line, *args) for line in iterlines(text, sel))
+        seltext = u"".join(func(line, *args) for line in iterlines(text, sel, lines))
         if textview.shouldChangeTextInRange_replacementString_(sel, seltext):
             textview.textStorage().replaceCharactersInRange_withString_(sel, seltext)
             textview.setSelectedRange_((sel[0], len(seltext)))
@@ -158,9 +160,9 @@ class PadCommentText(CommentText):
         return (",", NSCommandKeyMask | NSShiftKeyMask)
 
 
-def is_comment_range(text, range, comment_token):
+def is_comment_range(text, range, comment_token, lines=None):
     comments = 0
-    for i, line in enumerate(iterlines(text, range)):
+    for i, line in enumerate(iterlines(text, range, lines)):
         if i > 1:
             break
         if line.strip().startswith(comment_token):
@@ -318,7 +320,8 @@ def tab_indent(textview, sender):
                 return istr + line
             return line.lstrip(u" \t")
         sel = text.lineRangeForRange_(sel)
-        seltext = u"".join(indent(line) for line in iterlines(text, sel))
+        lines = textview.doc_view.document.line_index
+        seltext = u"".join(indent(line) for line in iterlines(text, sel, lines))
         select = True
     if textview.shouldChangeTextInRange_replacementString_(sel, seltext):
         textview.textStorage().replaceCharactersInRange_withString_(sel, seltext)
@@ -344,7 +347,8 @@ def tab_dedent(textview, sender):
         return line[remove:]
     text = textview.string()
     sel = text.lineRangeForRange_(textview.selectedRange())
-    seltext = u"".join(dedent(line) for line in iterlines(text, sel))
+    lines = textview.doc_view.document.line_index
+    seltext = u"".join(dedent(line) for line in iterlines(text, sel, lines))
     if len(seltext) != sel.length:
         if textview.shouldChangeTextInRange_replacementString_(sel, seltext):
             textview.textStorage().replaceCharactersInRange_withString_(sel, seltext)
@@ -358,8 +362,8 @@ def insert_newline(textview, sender):
     sel = textview.selectedRange()
     text = textview.string()
     if sel.location > 0:
-        i = text.rfind(eol, 0, sel[0])
-        i = 0 if i < 0 else (i + len(eol))
+        lines = textview.doc_view.document.line_index
+        i = lines.line_start(lines.line_at(sel[0]))
         indent = _ws.match(text, i)
         if indent:
             eol += indent.group()[:sel[0]-i]
@@ -373,14 +377,10 @@ def insert_newline(textview, sender):
         textview.scrollRangeToVisible_((sel[0] + len(eol), 0))
 
 def move_to_beginning_of_line(textview, sender):
-    eol = textview.doc_view.document.eol
     sel = textview.selectedRange()
     text = textview.string()
-    if sel[0] > 0:
-        i = text.rfind(eol, 0, sel[0])
-        i = 0 if i < 0 else (i + len(eol))
-    else:
-        i = 0
+    lines = textview.doc_view.document.line_index
+    i = lines.line_start(lines.line_at(sel[0]))
     new = (i, 0)
     wslead = _ws.match(text, i)
     if wslead:
@@ -439,15 +439,20 @@ def delete_backward(textview, sender):
 _line_splitter = re.compile(u"([^\n\r\u2028]*(?:%s)?)" % "|".join(
     eol for eol in sorted(const.EOLS.values(), key=len, reverse=True)))
 
-def iterlines(text, range=(0,)):
+def iterlines(text, range=(0,), lines=None):
     """iterate over lines of text
 
     By default this function iterates over all lines in the give text. If the
     'range' parameter (NSRange or tuple) is given, lines within that range will
-    be yielded.
+    be yielded. If 'lines' (a LineIndex of the text, see editxt.lineindex) is
+    given it is used to find the lines rather than scanning the text.
     """
     if not text:
         yield text
+    elif lines is not None:
+        start, end = (0, len(text)) if range == (0,) else (range[0], sum(range))
+        for lstart, lend in lines.line_ranges(start, end):
+            yield text[max(lstart, start):min(lend, end)]
     else:
         if range != (0,):
             range = (range[0], sum(range))
@@ -456,14 +461,11 @@ def iterlines(text, range=(0,)):
                 yield line.group()
 
 
-_newlines = re.compile("|".join(
-    eol for eol in sorted(const.EOLS.values(), key=len, reverse=True)))
-
 def replace_newlines(textview, eol):
     sel = textview.selectedRange()
     text = textview.string()
-    next = _newlines.sub(eol, text)
-    if text == next:
+    next = textscan.replace_newlines(text, eol)
+    if next is text:
         return
     range = (0, len(text))
     if textview.shouldChangeTextInRange_replacementString_(range, next):
@@ -472,24 +474,15 @@ def replace_newlines(textview, eol):
         textview.setSelectedRange_(sel)
 
 
-_indentation_regex = re.compile(u"([ \t]*)([^\r\n\u2028]*[\r\n\u2028]*)")
-
 def change_indentation(textview, old_indent, new_indent, size):
     attr_change = (new_indent == u"\t")
     text_change = (old_indent != new_indent)
     if attr_change or text_change:
         text = next = textview.string()
         if text_change:
-            #next = text.replace(old_indent, new_indent)
             # TODO detect comment characters at the beginning of a line and
             # replace indentation beyond the comment characters
-            fragments = []
-            for match in _indentation_regex.finditer(text):
-                ws, other = match.groups()
-                if ws:
-                    fragments.append(ws.replace(old_indent, new_indent))
-                fragments.append(other)
-            next = u"".join(fragments)
+            next = textscan.change_indentation(text, old_indent, new_indent)
         range = (0, len(text))
         if textview.shouldChangeTextInRange_replacementString_(range, next):
             if attr_change:
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2012 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+"""Newline and indentation scanner"""
+import logging
+import re
+import sys
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+log = logging.getLogger(__name__)
+
+# newlines of const.EOLS (longest first)
+EOLS = (u"\r\n", u"\n", u"\r", u"\u2028")
+EOL = re.compile(u"\r\n|[\n\r\u2028]")
+INDENT = re.compile(u"[ \t]*")
+
+if sys.maxunicode == 0xFFFF:
+    UNIT, CODEC = "u2", "utf-16"
+else:
+    UNIT, CODEC = "u4", "utf-32"
+CODEC += "-le" if sys.byteorder == "little" else "-be"
+
+
+def scan_text(text):
+    """Scan text for newlines and indentation
+
+    The scan is vectorized with NumPy if it is installed; otherwise a slower
+    pure-Python scanner is used.
+
+    :returns: A TextScan object.
+    """
+    if numpy is not None:
+        return _scan_array(text)
+    return _scan_unicode(text)
+
+
+class TextScan(object):
+    """Newlines and indentation of a text
+
+    Attributes (NumPy arrays if NumPy is installed, otherwise arrays of the
+    array module) are:
+
+    - newlines: dict ``{eol: offsets}``; the offsets of the newlines of each
+      kind in EOLS, in order.
+    - starts: the offsets at which lines begin. The first is zero. A newline
+      at the end of the text begins an empty last line.
+    - ends: the offsets at which lines end (before the newline).
+    - indents: the number of leading whitespace (space and tab) characters
+      on each line.
+    - tabs: the number of tabs in the leading whitespace of each line.
+    - spaces: the number of spaces in the leading whitespace of each line.
+
+    The pure-Python scanner does not find leading whitespace until one of
+    indents, tabs or spaces is first used.
+    """
+
+    def __init__(self, text, newlines, starts, ends, indents=None,
+            tabs=None, spaces=None):
+        self.text = text
+        self.newlines = newlines
+        self.starts = starts
+        self.ends = ends
+        if indents is not None:
+            self.indents = indents
+            self.tabs = tabs
+            self.spaces = spaces
+
+    def __getattr__(self, name):
+        if name not in ("indents", "tabs", "spaces"):
+            raise AttributeError(name)
+        self.indents, self.tabs, self.spaces = \
+            _scan_indentation(self.text, self.starts)
+        return getattr(self, name)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __repr__(self):
+        return "<%s %i lines>" % (type(self).__name__, len(self))
+
+    def line_starts(self):
+        """Get an array ("i") of line starts (see editxt.lineindex.LineIndex)"""
+        if numpy is not None and isinstance(self.starts, numpy.ndarray):
+            return array("i", self.starts.astype(numpy.intc).tostring())
+        return array("i", self.starts)
+
+    def eol(self, line=0):
+        """Get the newline at the end of the given line (None if it has none)"""
+        if line + 1 >= len(self.starts):
+            return None
+        return self.text[self.ends[line]:self.starts[line + 1]]
+
+    def indented_line(self):
+        """Get the line whose indentation is the indentation of the text
+
+        This is the first indented line that contains more than whitespace,
+        or (if there is no such line) the last indented line. None if no
+        line is indented.
+        """
+        indents = self.indents
+        if numpy is not None and isinstance(indents, numpy.ndarray):
+            indented = numpy.flatnonzero(indents)
+            if not len(indented):
+                return None
+            filled = indented[(self.starts[indented] + indents[indented])
+                < self.ends[indented]]
+            return int(filled[0] if len(filled) else indented[-1])
+        last = None
+        for line, (start, end, indent) in enumerate(
+                zip(self.starts, self.ends, indents)):
+            if indent:
+                if start + indent < end:
+                    return line
+                last = line
+        return last
+
+    def lines_where(self, counts, minimum):
+        """Get the numbers of lines where counts[line] >= minimum
+
+        :param counts: One of the per-line arrays of this scan.
+        """
+        if numpy is not None and isinstance(counts, numpy.ndarray):
+            return numpy.flatnonzero(counts >= minimum)
+        return [line for line, count in enumerate(counts) if count >= minimum]
+
+
+def replace_newlines(text, eol, scan=None):
+    """Replace all newlines in text with eol
+
+    :param scan: A TextScan of text; the text will be scanned if not given.
+    :returns: The new text (text itself if it has no other kind of newline).
+    """
+    if scan is None:
+        scan = scan_text(text)
+    if not any(len(offsets) for kind, offsets
+               in scan.newlines.iteritems() if kind != eol):
+        return text
+    if numpy is not None and isinstance(scan.starts, numpy.ndarray):
+        units = _as_array(text)
+        crlf = scan.newlines[u"\r\n"]
+        if eol == u"\r\n":
+            single = numpy.sort(numpy.concatenate([offsets
+                for kind, offsets in scan.newlines.iteritems() if kind != eol]))
+            units = units.copy()
+            units[single] = ord(u"\r")
+            units = numpy.insert(units, single + 1, ord(u"\n"))
+        else:
+            units = units.copy()
+            units[scan.ends[:-1]] = ord(eol)
+            units = numpy.delete(units, crlf + 1)
+        try:
+            return units.tostring().decode(CODEC)
+        except UnicodeDecodeError:
+            # unpaired surrogate
+            log.debug("cannot decode code units", exc_info=True)
+    return EOL.sub(eol, text)
+
+
+def change_indentation(text, old_indent, new_indent, scan=None):
+    """Replace old_indent with new_indent in the leading whitespace of lines
+
+    Only the lines that may contain old_indent are processed.
+
+    :param scan: A TextScan of text; the text will be scanned if not given.
+    :returns: The new text.
+    """
+    if scan is None:
+        scan = scan_text(text)
+    if old_indent == u"\t":
+        lines = scan.lines_where(scan.tabs, 1)
+    else:
+        lines = scan.lines_where(scan.spaces, len(old_indent))
+    starts = scan.starts
+    indents = scan.indents
+    fragments = []
+    prev = 0
+    for line in lines:
+        start = starts[line]
+        end = start + indents[line]
+        fragments.append(text[prev:start])
+        fragments.append(text[start:end].replace(old_indent, new_indent))
+        prev = end
+    if not fragments:
+        return text
+    fragments.append(text[prev:])
+    return u"".join(fragments)
+
+
+def _as_array(text):
+    """Get the code units of text as a NumPy array (without copying)"""
+    if not text:
+        return numpy.zeros(0, UNIT)
+    return numpy.frombuffer(buffer(text), UNIT)
+
+
+def _scan_array(text):
+    units = _as_array(text)
+    size = len(units)
+    lf = units == ord(u"\n")
+    cr = units == ord(u"\r")
+    ls = units == ord(u"\u2028")
+    crlf = cr.copy()
+    crlf[:-1] &= lf[1:]
+    crlf[-1:] = False
+    lone_cr = cr & ~crlf
+    lone_lf = lf.copy()
+    lone_lf[1:] &= ~cr[:-1]
+    newlines = {
+        u"\r\n": numpy.flatnonzero(crlf),
+        u"\n": numpy.flatnonzero(lone_lf),
+        u"\r": numpy.flatnonzero(lone_cr),
+        u"\u2028": numpy.flatnonzero(ls),
+    }
+    starts = numpy.concatenate(([0], numpy.flatnonzero(lf | lone_cr | ls) + 1))
+    ends = numpy.concatenate((numpy.flatnonzero(lone_lf | cr | ls), [size]))
+
+    tab = units == ord(u"\t")
+    other = ~(tab | (units == ord(u" ")))
+    # offset of the first character after the leading whitespace of a line
+    filled = numpy.append(numpy.flatnonzero(other), size)
+    firsts = filled[numpy.searchsorted(filled, starts)]
+    tabsums = numpy.concatenate(([0], numpy.cumsum(tab)))
+    indents = firsts - starts
+    tabs = tabsums[firsts] - tabsums[starts]
+    return TextScan(text, newlines, starts, ends, indents, tabs, indents - tabs)
+
+
+def _scan_unicode(text):
+    newlines = dict((eol, array("i")) for eol in EOLS)
+    starts = array("i", [0])
+    ends = array("i")
+    for match in EOL.finditer(text):
+        newlines[match.group()].append(match.start())
+        ends.append(match.start())
+        starts.append(match.end())
+    ends.append(len(text))
+    return TextScan(text, newlines, starts, ends)
+
+
+def _scan_indentation(text, starts):
+    indents = array("i")
+    tabs = array("i")
+    spaces = array("i")
+    match_indent = INDENT.match
+    for start in starts:
+        indent = match_indent(text, start).group()
+        count = indent.count(u"\t")
+        indents.append(len(indent))
+        tabs.append(count)
+        spaces.append(len(indent) - count)
+    return indents, tabs, spaces
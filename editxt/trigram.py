@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2012 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+"""Trigram index for narrowing searches in large texts"""
+import logging
+import re
+import sre_constants
+import sre_parse
+import threading
+from array import array
+
+from editxt import textscan
+from editxt.search import LITERAL, pattern_cache
+from editxt.spans import OffsetArray
+
+log = logging.getLogger(__name__)
+
+# non-ASCII characters that match ASCII characters when case is ignored or
+# that are canonically equivalent to ASCII characters
+FOLD = {
+    u"\u0130": u"i",
+    u"\u037e": u";",
+    u"\u1fef": u"`",
+    u"\u212a": u"k",
+}
+NON_ASCII = re.compile(u"[^\x00-\x7f]")
+# trigram hash multipliers
+HASH = (0x9E3779B1, 0x85EBCA77, 0xC2B2AE3D)
+
+
+class TrigramIndex(object):
+    """Index of the trigrams in blocks of a text
+
+    The text is divided into blocks of (at most) block_size characters. The
+    trigrams of each block (and of the following overlap characters, so
+    matches that begin in a block and end in the next are found) are
+    recorded in a Bloom filter. A search for a literal string needs to scan
+    only the blocks whose filters contain all of its trigrams. Trigrams are
+    case-folded (non-ASCII characters are all folded to one character), so
+    the index can be used for case-sensitive and case-insensitive searches.
+
+    The index of a whole text is built by a worker thread (see start). It
+    is updated (on the thread that edits the text) after each edit;
+    only the blocks that overlap the edit are indexed again. Block starts
+    are shifted lazily (see editxt.spans.OffsetArray).
+    """
+
+    block_size = 4096
+    overlap = 64
+
+    def __init__(self):
+        self.version = 0
+        self.ready = False
+        self.length = 0
+        self.starts = OffsetArray()
+        self.blooms = []
+        self._pending = None
+        self._worker = None
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __repr__(self):
+        return "<%s %i blocks%s>" % (type(self).__name__, len(self),
+            "" if self.ready else " (not ready)")
+
+    def start(self, text):
+        """Index text in a worker thread
+
+        The index can be used when the worker is done (see ready_for).
+        """
+        self.version += 1
+        self.ready = False
+        self._pending = None
+        args = (unicode(text), self.version)
+        self._worker = worker = threading.Thread(target=self._build, args=args)
+        worker.daemon = True
+        worker.start()
+
+    def _build(self, text, version):
+        try:
+            blocks = self.index_blocks(text, 0, len(text), version)
+        except Exception:
+            log.error("cannot index text", exc_info=True)
+            return
+        if blocks is not None and version == self.version:
+            self._pending = (version, len(text)) + blocks
+
+    def reset(self, text):
+        """Index text now (on the current thread)"""
+        self.version += 1
+        self._worker = self._pending = None
+        self._set_blocks(len(text), *self.index_blocks(text, 0, len(text)))
+
+    def _set_blocks(self, length, starts, blooms):
+        self.starts = OffsetArray(array("i", starts))
+        self.blooms = blooms
+        self.length = length
+        self.ready = True
+
+    def ready_for(self, text):
+        """Check if the index can be used to search text
+
+        A new worker is started if the index is not ready and there is no
+        worker building it.
+        """
+        pending = self._pending
+        if pending is not None:
+            self._pending = self._worker = None
+            if pending[0] == self.version:
+                self._set_blocks(*pending[1:])
+        if self.ready and self.length == len(text):
+            return True
+        if self._worker is None or not self._worker.is_alive():
+            self.start(text)
+        return False
+
+    def text_edited(self, text, index, length, changelen):
+        """Update the index after an edit
+
+        :param text: The edited text.
+        :param index: The offset of the edit.
+        :param length: The length of the new (inserted) text.
+        :param changelen: The change in length of the text.
+        """
+        self.batch_edited(text, [(index, length, changelen)])
+
+    def batch_edited(self, text, edits):
+        """Update the index after a batch of edits
+
+        The blocks that depend on the replaced text are removed first, then
+        the gaps (merged where they touch) are indexed in the edited text.
+
+        :param text: The edited text.
+        :param edits: A list of ``(index, length, changelen)`` tuples (see
+        text_edited) in ascending order, with offsets in the edited text.
+        """
+        changelen = sum(edit[2] for edit in edits)
+        if not self.ready or self.length + changelen != len(text):
+            # discard the worker's blocks (if any); a new worker will be
+            # started when the index is used
+            self.version += 1
+            self.ready = False
+            self._worker = None
+            return
+        self.version += 1
+        gaps = []
+        for edit in edits:
+            first, start, end = self._remove(*edit)
+            while gaps and start <= gaps[-1][2]:
+                prev = gaps.pop()
+                first = min(first, prev[0])
+                start = min(start, prev[1])
+            gaps.append((first, start, end))
+        inserted = 0
+        for first, start, end in gaps:
+            starts, blooms = self.index_blocks(text, start, end)
+            if starts:
+                self._insert(first + inserted, starts, blooms)
+                inserted += len(starts)
+
+    def candidates(self, literal, start, end, backward=False):
+        """Generate ranges ``(start, end)`` where matches of literal may begin
+
+        Ranges are within the given range. No range is generated if
+        literal cannot be found there (the index must be ready for the text).
+        Everything is a candidate if literal is shorter than three
+        characters.
+
+        :param backward: Generate ranges from the end toward the start.
+        """
+        if end <= start:
+            return
+        mask = bloom(literal[:self.overlap])
+        if not mask:
+            yield start, end
+            return
+        blooms = self.blooms
+        nblocks = len(blooms)
+        if backward:
+            blocks = xrange(self.starts.bisect(end - 1) - 1, -1, -1)
+        else:
+            blocks = xrange(max(self.starts.bisect(start) - 1, 0), nblocks)
+        lo = hi = None
+        for i in blocks:
+            bstart = self.starts[i]
+            bend = self.starts[i + 1] if i + 1 < nblocks else self.length
+            if backward and bend <= start or not backward and bstart >= end:
+                break
+            if blooms[i] & mask != mask:
+                continue
+            bstart = max(bstart, start)
+            bend = min(bend, end)
+            if lo is None:
+                lo, hi = bstart, bend
+            elif bstart == hi:
+                hi = bend
+            elif bend == lo:
+                lo = bstart
+            else:
+                yield lo, hi
+                lo, hi = bstart, bend
+        if lo is not None:
+            yield lo, hi
+
+    def finditer(self, regex, text, start=0, end=None):
+        """Generate matches of regex like ``regex.finditer(text, start, end)``
+
+        Only the blocks that may contain the literal prefix of regex (see
+        literal_prefix) are searched. The whole range is searched if the
+        prefix is shorter than three characters.
+        """
+        if end is None:
+            end = len(text)
+        prefix = literal_prefix(regex.pattern, regex.flags)
+        if len(prefix) < 3:
+            for match in regex.finditer(text, start, end):
+                yield match
+            return
+        find = pattern_cache.compile(prefix, regex.flags, LITERAL).search
+        extra = len(prefix) - 1
+        pos = start
+        for lo, hi in self.candidates(prefix, start, end):
+            lo = max(lo, pos)
+            while lo < hi:
+                found = find(text, lo, min(hi + extra, end))
+                if found is None or found.start() >= hi:
+                    break
+                match = regex.match(text, found.start(), end)
+                if match is None:
+                    lo = found.start() + 1
+                    continue
+                yield match
+                pos = lo = match.end()
+
+    def index_blocks(self, text, start, end, version=None):
+        """Get the block starts and Bloom filters of a range of text
+
+        Each block is indexed with the text that follows it (up to overlap
+        characters beyond end). None is returned if version is given and
+        the version of the index changes before all blocks are indexed.
+
+        :returns: A tuple (starts, blooms).
+        """
+        size = self.block_size
+        overlap = self.overlap
+        vectorized = textscan.numpy is not None
+        blooms = []
+        for chunk in xrange(start, end, size * 256):
+            chunk_end = min(chunk + size * 256, end)
+            if vectorized:
+                hashes = _hash_array(text, chunk,
+                    min(chunk_end + overlap, len(text)))
+            for block in xrange(chunk, chunk_end, size):
+                window = min(block + size, end) + overlap
+                if vectorized:
+                    blooms.append(_bloom_array(
+                        hashes, block - chunk, window - chunk))
+                else:
+                    blooms.append(bloom(text[block:window]))
+            if version is not None and version != self.version:
+                return None
+        return range(start, end, size), blooms
+
+    # internal helpers
+
+    def _insert(self, i, starts, blooms):
+        self.starts.insert(i, starts)
+        self.blooms[i:i] = blooms
+
+    def _delete(self, lo, hi):
+        self.starts.delete(lo, hi)
+        del self.blooms[lo:hi]
+
+    def _remove(self, index, length, changelen):
+        """Remove the blocks that depend on the text replaced by an edit
+
+        :returns: A tuple ``(i, start, end)``; the index at which to insert
+        new blocks and the range of text that they must cover.
+        """
+        oldend = index + length - changelen
+        first = max(self.starts.bisect(index - self.overlap) - 1, 0)
+        last = self.starts.bisect(oldend - 1)
+        start = self.starts[first] if first < len(self.starts) else 0
+        if last < len(self.starts):
+            end = self.starts[last] + changelen
+        else:
+            end = self.length + changelen
+        if last > first:
+            self._delete(first, last)
+        self.starts.shift(first, changelen)
+        self.length += changelen
+        return first, start, end
+
+
+def literal_prefix(pattern, flags=0):
+    """Get the literal text that begins every match of a regular expression
+
+    Zero-width assertions (such as ``^`` and ``\\b``) before the literal are
+    skipped. An empty string is returned if matches do not begin with
+    literal text.
+    """
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except Exception:
+        return u""
+    chars = []
+    for op, arg in parsed:
+        if op == sre_constants.LITERAL:
+            chars.append(unichr(arg))
+        elif op == sre_constants.AT and not chars:
+            continue
+        else:
+            break
+    return u"".join(chars)
+
+
+def fold(text):
+    """Fold text for indexing (see TrigramIndex)"""
+    return NON_ASCII.sub(_fold_char, text).lower()
+
+def _fold_char(match):
+    return FOLD.get(match.group(), u"\x80")
+
+
+def bloom(text):
+    """Get the Bloom filter (an integer) of the trigrams of text"""
+    bits = TrigramIndex.block_size * 2 - 1
+    codes = map(ord, fold(text))
+    k0, k1, k2 = HASH
+    value = 0
+    for i in xrange(len(codes) - 2):
+        h = (codes[i] * k0 + codes[i + 1] * k1 + codes[i + 2] * k2) & 0xFFFFFFFF
+        value |= (1 << (h & bits)) | (1 << ((h >> 16) & bits))
+    return value
+
+
+def _hash_array(text, start, end):
+    """Get the Bloom filter bits of the trigrams in a range of text
+
+    :returns: A pair of NumPy arrays; the bits of the trigram at each offset
+    (relative to start) in the range. Hashes are computed with (wrapping)
+    32-bit arithmetic, so they are the same as those of bloom.
+    """
+    numpy = textscan.numpy
+    units = textscan._as_array(text)[start:end].astype(numpy.uint32)
+    units[(units >= ord(u"A")) & (units <= ord(u"Z"))] += 32
+    for char, ascii in FOLD.iteritems():
+        units[units == ord(char)] = ord(ascii)
+    units[units > 0x7f] = 0x80
+    k0, k1, k2 = (numpy.uint32(k) for k in HASH)
+    hashes = units[:-2] * k0 + units[1:-1] * k1 + units[2:] * k2
+    bits = TrigramIndex.block_size * 2 - 1
+    return (hashes & bits).astype(numpy.uint16), \
+        ((hashes >> 16) & bits).astype(numpy.uint16)
+
+
+def _bloom_array(hashes, start, end):
+    """Get the Bloom filter of the trigrams between start and end
+
+    :param hashes: Bits returned by _hash_array.
+    """
+    numpy = textscan.numpy
+    size = TrigramIndex.block_size * 2
+    row = numpy.zeros(size, bool)
+    for bits in hashes:
+        row[size - 1 - bits[start:max(end - 2, start)]] = True
+    return int(numpy.packbits(row).tostring().encode("hex"), 16)
@@ -52,7 +52,7 @@ def wrap_selected_lines(textview, options):
     text = textview.string()
     sel = text.lineRangeForRange_(textview.selectedRange())
     eol = textview.doc_view.document.eol
-    lines = iterlines(text, sel)
+    lines = iterlines(text, sel, textview.doc_view.document.line_index)
     output = eol.join(wraplines(lines, options, textview))
     if textview.shouldChangeTextInRange_replacementString_(sel, output):
         textview.textStorage().replaceCharactersInRange_withString_(sel, output)
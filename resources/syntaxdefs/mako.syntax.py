@@ -30,6 +30,7 @@ delimited_ranges = [
     (RE("<%[a-z]"), [">"], "800000", None),
     (RE("</%"), [">"], "800000", None),
     ("<!--", ["-->"], "008000", None),
+    (RE(r"<script\b[^>]*>"), ["</script>"], "000080", "javascript"),
     (RE("<[^/%]"), [">"], "000080", None),
     (RE("</[^%]"), [">"], "000080", None),
     ("##", [RE(r"(?=\n)")], "008000", None),
@@ -37,6 +37,200 @@ def eq(v0, v1):
         print v1
         print
 
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# syntax keywords: regex alternation vs dict lookup
+
+init = """
+import random
+import editxt.constants as const
+from editxt.syntax import SyntaxFactory, SyntaxDefinition
+
+JS_UNIT = u"\\n".join([
+    u"function %s(a, b) {",
+    u"    var x = 'string ' + a; // comment %d",
+    u"    if (x !== null && typeof b === 'undefined') {",
+    u"        return new Array(a, b, this.value);",
+    u"    } else {",
+    u"        for (var i = 0; i < a.length; i++) { x += /re[g]x/g.test(a[i]) ? 1 : 0; }",
+    u"    }",
+    u"    /* block",
+    u"       comment */",
+    u"    return x;",
+    u"}",
+    u"",
+])
+TEXT = u"".join(JS_UNIT % ("fn%d" % i, i) for i in xrange(8000)) # 2.5 MB
+
+rand = random.Random(2)
+EXTRA = ["".join(rand.choice("abcdefghijklmnopqrstuvwxyz")
+    for j in xrange(rand.randint(3, 9))) for i in xrange(1000)]
+JS = SyntaxFactory().load_definition("resources/syntaxdefs/javascript.syntax.py")
+
+def sdef(extra, lookup):
+    groups = list(JS.word_groups)
+    if extra:
+        groups.append((EXTRA[:extra], "FF00FF"))
+    minimum = const.SYNTAX_KEYWORD_LOOKUP_MIN
+    const.SYNTAX_KEYWORD_LOOKUP_MIN = 0 if lookup else 100000
+    try:
+        return SyntaxDefinition("", "js", (), groups, JS.delimited_ranges)
+    finally:
+        const.SYNTAX_KEYWORD_LOOKUP_MIN = minimum
+
+def scan(sdef):
+    tokens = []
+    def setcolor(color, range, prevend, info):
+        tokens.append((range.location, range.length, info))
+    sdef.scan(TEXT, setcolor)
+    return tokens
+"""
+
+trials = [
+
+"scan(sdef(0, False))",
+"scan(sdef(0, True))",
+"scan(sdef(140, False))",
+"scan(sdef(140, True))",
+"scan(sdef(1000, False))",
+"scan(sdef(1000, True))",
+
+]
+n = 1
+
+# 2.5 MB of javascript, 136001 tokens
+# 61 keywords (javascript.syntax.py)
+# trial 0: 0.68927192688   alternation
+# trial 1: 0.953459978104  dict lookup
+# 201 keywords
+# trial 2: 1.06027698517   alternation
+# trial 3: 1.05216693878   dict lookup
+# 1061 keywords
+# trial 4: 3.80832004547   alternation
+# trial 5: 0.798412084579  dict lookup
+#
+# alternation time grows with the number of keywords; dict lookup does not,
+# but has a fixed cost for each word in the text (hence the threshold,
+# const.SYNTAX_KEYWORD_LOOKUP_MIN)
+
+try:
+    exec init
+    v0 = eval(trials[0])
+    v1 = eval(trials[1])
+    eq(v0, v1)
+except Exception:
+    log.error("trial equality test failed", exc_info=True)
+    print
+
+for i, trial in enumerate(trials):
+    try:
+        t = timeit.Timer(trial, init)
+        v1 = t.timeit(n)
+    except Exception, ex:
+        print "# trial %i failed: %s" % (i, ex)
+        traceback.print_exc()
+    else:
+        print "# trial %i:" % i, v1
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+'''
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# syntax cache: per-character list vs SpanStore (time and memory)
+
+init = """
+import random
+import sys
+from editxt.spans import SpanStore
+
+class ListCache(object):
+    # the per-character syntax cache that was replaced by SpanStore
+
+    def __init__(self):
+        self.cache = []
+
+    def get(self, index):
+        try:
+            value = self.cache[index]
+        except IndexError:
+            return None
+        if value is None:
+            return None
+        return index - value[0], value[0] + value[1], value[2]
+
+    def set(self, start, length, info):
+        cache = self.cache
+        while start > len(cache):
+            cache.append(None)
+        for i in xrange(length):
+            try:
+                cache[start + i] = (i, length - i, info)
+            except IndexError:
+                cache.append((i, length - i, info))
+
+    def adjust(self, index, changelen):
+        self.cache[index:index] = [None for i in xrange(changelen)]
+
+def tokens(size=1000000, seed=1):
+    # roughly one 8 character token per 16 characters of text
+    rand = random.Random(seed)
+    start = 0
+    while True:
+        start += rand.randint(1, 16)
+        length = rand.randint(1, 16)
+        if start + length > size:
+            break
+        yield start, length, rand.choice(["g0", "g1", "g2", "g3"])
+        start += length
+TOKENS = list(tokens())
+
+def fill(cls):
+    cache = cls()
+    for start, length, info in TOKENS:
+        cache.set(start, length, info)
+    return cache
+
+def lookup(cache):
+    get = cache.get
+    return [get(start + 1) for start, length, info in TOKENS[::100]]
+
+def edit(cache):
+    # type 200 characters in the middle of the text, then look up the tail
+    for i in xrange(200):
+        cache.adjust(500000 + i, 1)
+    return lookup(cache)
+
+def memory(cls):
+    cache = fill(cls)
+    if cls is ListCache:
+        items = cache.cache
+        size = sys.getsizeof(items)
+        size += sum(sys.getsizeof(item) for item in items if item is not None)
+    else:
+        size = sum(sys.getsizeof(a) for a in [cache.starts.values,
+            cache.lengths, cache.ids, cache.infos, cache._info_ids])
+    return len(TOKENS), size
+"""
+
+trials = [
+
+"lookup(fill(ListCache))",
+"lookup(fill(SpanStore))",
+"edit(fill(ListCache))",
+"edit(fill(SpanStore))",
+
+]
+n = 1
+
+# 1 MB of text, 58766 tokens
+# trial 0: 0.63511300087
+# trial 1: 0.3140001297
+# trial 2: 0.891439914703
+# trial 3: 0.424812793732
+#
+# memory(ListCache): 48736912 bytes (list + one tuple per character)
+# memory(SpanStore): 708392 bytes
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # if x vs try vs if x is y
 
@@ -80,31 +274,6 @@ n = 1000000
 # trial 2: 0.248097896576
 # trial 3: 0.299978971481
 
-# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-
-try:
-    exec init
-    v0 = eval(trials[0])
-    v1 = eval(trials[1])
-    eq(v0, v1)
-except Exception:
-    log.error("trial equality test failed", exc_info=True)
-    print
-
-for i, trial in enumerate(trials):
-    try:
-        t = timeit.Timer(trial, init)
-        v1 = t.timeit(n)
-    except Exception, ex:
-        print "# trial %i failed: %s" % (i, ex)
-        traceback.print_exc()
-    else:
-        print "# trial %i:" % i, v1
-
-# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-
-'''
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # if [] vs if x == ['y']
 